@@ -1,2 +1,13 @@
-from openhls import compiler, flopoco, ir, rtl, testbench
-from openhls import config
+import importlib
+
+# (the compiler imports flopoco, ir and rtl; the testbench, i.e., cocotb and the flopoco
+# converter, is only imported on first use)
+from openhls import compiler, config
+
+__all__ = ["compiler", "config", "flopoco", "ir", "rtl", "testbench"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
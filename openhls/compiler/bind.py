@@ -0,0 +1,88 @@
+import heapq
+import logging
+import re
+from collections import defaultdict
+
+from openhls.compiler.schedule import RESOURCE_FREE
+from openhls.ir.ops import OpType, LATENCIES
+from openhls.ir.parse import tokenize_mlir_module
+
+logger = logging.getLogger(__name__)
+
+reg_pe = re.compile(r'pe = "\([^"]*\)"')
+reg_op_id = re.compile(r'op_id = "(\d+)"')
+reg_auxdeps = re.compile(r"auxdeps = \[.*\],")
+
+
+def bind_pes(ops, limits):
+    # the (op type, logical pe) groups of each type go onto at most limit physical pes; the
+    # physical pes are the logical pes with the most work of that type (preferring ones that
+    # aren't already physical pes of another type, since a pe runs one op at a time) and the
+    # rest of the groups go to whichever is least loaded (counting all of its ops)
+    work = defaultdict(int)
+    pe_work = defaultdict(int)
+    for op in ops:
+        if op.type in RESOURCE_FREE or op.pe_idx[0] < 0:
+            continue
+        work[op.type, op.pe_idx] += LATENCIES[op]
+        pe_work[op.pe_idx] += LATENCIES[op]
+
+    binding = {}
+    physical = set()
+    for op_type, limit in limits.items():
+        groups = sorted(
+            ((w, pe_idx) for (t, pe_idx), w in work.items() if t == op_type),
+            key=lambda g: (g[1] in physical, -g[0], g[1]),
+        )
+        if len(groups) <= limit:
+            continue
+        physical.update(pe_idx for _w, pe_idx in groups[:limit])
+        loads = [(pe_work[pe_idx], pe_idx) for _w, pe_idx in groups[:limit]]
+        heapq.heapify(loads)
+        for w, pe_idx in groups[limit:]:
+            load, phys_pe_idx = heapq.heappop(loads)
+            binding[op_type, pe_idx] = phys_pe_idx
+            pe_work[phys_pe_idx] += w
+            heapq.heappush(loads, (load + w, phys_pe_idx))
+        logger.info(
+            f"Bound {op_type.value} ops on {len(groups)} pes onto {limit} pes"
+        )
+    return binding
+
+
+def bind(module_str, limits):
+    # returns the module with ops moved to their physical pes (and the per-pe program order aux
+    # deps remade) and whether anything moved; the scheduler then time-multiplexes the ips of
+    # each physical pe (i.e., the extra fsm states) and emit_verilog muxes their inputs by state
+    limits = {OpType(op): limit for op, limit in limits.items() if limit > 0}
+    if not limits:
+        return module_str, False
+
+    lines = module_str.splitlines()
+    ops = [record for kind, record in tokenize_mlir_module(lines) if kind == "op"]
+    binding = bind_pes(ops, limits)
+    if not binding:
+        return module_str, False
+
+    pe_idxs = {}
+    for op in ops:
+        if op.type != OpType.CST:
+            pe_idxs[int(op.op_id)] = binding.get((op.type, op.pe_idx), op.pe_idx)
+
+    aux_deps = []
+    most_recent_op_id = {}
+    for op_id, pe_idx in sorted(pe_idxs.items()):
+        if pe_idx in most_recent_op_id:
+            aux_deps.append([most_recent_op_id[pe_idx], op_id])
+        most_recent_op_id[pe_idx] = op_id
+
+    for i, line in enumerate(lines):
+        op_id = reg_op_id.search(line)
+        if op_id is not None and int(op_id.group(1)) in pe_idxs:
+            lines[i] = reg_pe.sub(
+                f'pe = "{pe_idxs[int(op_id.group(1))]}"', line, count=1
+            )
+        elif reg_auxdeps.search(line):
+            lines[i] = reg_auxdeps.sub(f"auxdeps = {sorted(aux_deps)},", line)
+
+    return "\n".join(lines), True
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+from openhls.config import (
+    CACHE_DIR,
+    CACHE_MAX_SIZE_MB,
+    USE_CACHE,
+    INCLUDE_AUX_DEPS,
+    LOOP_TILING_FACTOR,
+    REGISTER_TILES_TWICE,
+    FOLD_CONSTANTS,
+    CSE,
+    REDUCTION_TREE,
+    RESOURCE_LIMITS,
+    FSM_ENCODING,
+    KEEP_IPS,
+    USE_UNIQUE_IP_PARAM,
+    MUL_LATENCY,
+    DIV_LATENCY,
+    ADD_LATENCY,
+    SUB_LATENCY,
+    SQRT_LATENCY,
+    MAX_LATENCY,
+    GT_LATENCY,
+    NEG_LATENCY,
+    RELU_LATENCY,
+)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_TABLE = (
+    MUL_LATENCY,
+    DIV_LATENCY,
+    ADD_LATENCY,
+    SUB_LATENCY,
+    SQRT_LATENCY,
+    MAX_LATENCY,
+    GT_LATENCY,
+    NEG_LATENCY,
+    RELU_LATENCY,
+)
+
+# the config knobs each stage's output actually depends on (on top of its input text)
+STAGE_CONFIG = {
+    "translate": lambda width_exponent, width_fraction: (),
+    "rewrite": lambda width_exponent, width_fraction: (LOOP_TILING_FACTOR,),
+    "trace": lambda width_exponent, width_fraction: (
+        INCLUDE_AUX_DEPS,
+        REGISTER_TILES_TWICE,
+        LATENCY_TABLE,
+        FOLD_CONSTANTS,
+        CSE,
+        REDUCTION_TREE,
+        # folding is done in flopoco arithmetic
+        width_exponent if FOLD_CONSTANTS else None,
+        width_fraction if FOLD_CONSTANTS else None,
+    ),
+    "schedule": lambda width_exponent, width_fraction: (
+        width_exponent,
+        width_fraction,
+        LATENCY_TABLE,
+        INCLUDE_AUX_DEPS,
+        sorted(RESOURCE_LIMITS.items()),
+    ),
+    "verilog": lambda width_exponent, width_fraction: (
+        width_exponent,
+        width_fraction,
+        KEEP_IPS,
+        USE_UNIQUE_IP_PARAM,
+        LATENCY_TABLE,
+        FSM_ENCODING,
+    ),
+}
+
+
+class ArtifactCache:
+    def __init__(self, cache_dir, max_size_mb, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.enabled = enabled
+        self.stats = {}
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, stage, width_exponent, width_fraction, *inputs):
+        h = hashlib.sha256(stage.encode())
+        for inp in inputs + STAGE_CONFIG[stage](width_exponent, width_fraction):
+            if isinstance(inp, str):
+                inp = inp.encode()
+            elif not isinstance(inp, bytes):
+                inp = repr(inp).encode()
+            h.update(len(inp).to_bytes(8, "little"))
+            h.update(inp)
+        return h.hexdigest()
+
+    def _path(self, stage, key):
+        return self.cache_dir / f"{stage}-{key}.pkl"
+
+    def _file_path(self, stage, key, fp):
+        return self.cache_dir / f"{stage}-{key}-{Path(fp).name}"
+
+    def get(self, stage, key):
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            # bump mtime so eviction is least-recently-used rather than least-recently-written
+            os.utime(path)
+        except FileNotFoundError:
+            # missing, or evicted by a concurrent compile
+            return None
+        return value
+
+    def put(self, stage, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(stage, key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*-*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                # evicted by a concurrent compile
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.debug(f"Evicting {path.name} from artifact cache")
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def run(self, stage, fn, width_exponent, width_fraction, *inputs):
+        if not self.enabled:
+            return fn()
+
+        key = self.key(stage, width_exponent, width_fraction, *inputs)
+        value = self.get(stage, key)
+        if value is not None:
+            logger.info(f"Cache hit for {stage}")
+            self.stats[stage] = "hit"
+            return value
+
+        logger.info(f"Cache miss for {stage}")
+        self.stats[stage] = "miss"
+        value = fn()
+        self.put(stage, key, value)
+        return value
+
+    def run_with_files(self, stage, fn, fps, width_exponent, width_fraction, *inputs):
+        # like run but fn also writes the files fps, which are cached (as files) alongside its value
+        if not self.enabled:
+            return fn()
+
+        key = self.key(stage, width_exponent, width_fraction, *inputs)
+        value = self.get(stage, key)
+        if value is not None:
+            try:
+                for fp in fps:
+                    cached_fp = self._file_path(stage, key, fp)
+                    shutil.copyfile(cached_fp, fp)
+                    os.utime(cached_fp)
+            except FileNotFoundError:
+                value = None
+        if value is not None:
+            logger.info(f"Cache hit for {stage}")
+            self.stats[stage] = "hit"
+            return value
+
+        logger.info(f"Cache miss for {stage}")
+        self.stats[stage] = "miss"
+        value = fn()
+        for fp in fps:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(fp, tmp)
+            os.replace(tmp, self._file_path(stage, key, fp))
+        self.put(stage, key, value)
+        return value
+
+    def report(self):
+        if not self.enabled or not self.stats:
+            return
+        logger.info(
+            "Artifact cache: "
+            + ", ".join(f"{stage} {res}" for stage, res in self.stats.items())
+        )
+
+
+def make_cache(use_cache=USE_CACHE):
+    return ArtifactCache(CACHE_DIR, CACHE_MAX_SIZE_MB, enabled=use_cache)
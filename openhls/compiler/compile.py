@@ -1,25 +1,47 @@
 import argparse
 import ast
 import io
+import json
 import logging
 import os
 import re
 import shutil
 import sys
+import time
 from pathlib import Path
 from subprocess import Popen, PIPE
 
-import astor
-
 from openhls import ip_cores
 from openhls.compiler import state
-from openhls.compiler.runner import Forward, get_default_args
-from openhls.config import DEBUG, WIDTH_EXPONENT, WIDTH_FRACTION
+from openhls.compiler.bind import bind
+from openhls.compiler.cache import make_cache
+from openhls.compiler.runner import Forward, get_default_args, reductions_fp
+from openhls.compiler.schedule import (
+    copy_overwritten_results,
+    native_schedule,
+    crosscheck_schedules,
+    parse_ii,
+)
+from openhls.config import (
+    DEBUG,
+    WIDTH_EXPONENT,
+    WIDTH_FRACTION,
+    USE_CACHE,
+    INCLUDE_AUX_DEPS,
+    SCHEDULER,
+    SCHEDULE_MODE,
+    II,
+    RESOURCE_LIMITS,
+    SIMULATOR,
+    TB_SHARDS,
+    WAVES,
+    WAVES_SCOPE,
+)
+from openhls.ir.ops import OpType
 from openhls.ir.parse import parse_mlir_module
 from openhls.ir.transforms import transform_forward, rewrite_schedule_vals
 from openhls.rtl.emit_verilog import emit_verilog
 from openhls.rtl.basic import generate_imports_tcl, gen_clock_xdc
-from openhls.testbench.tb_runner import testbench_runner
 from openhls.util import import_module_from_fp, import_module_from_string
 
 logger = logging.getLogger(__name__)
@@ -47,6 +69,8 @@ def translate(affine_mlir_str):
 def rewrite(pythonized_mlir):
     tree = ast.parse(pythonized_mlir)
     new_tree = transform_forward(tree)
+    import astor
+
     rewritten_py_code = astor.code_gen.to_source(new_tree)
     return rewritten_py_code
 
@@ -57,6 +81,16 @@ def run_rewrite(mod):
     Forward(mod.forward)
     file.seek(0)
     s = file.read()
+    folded_ops = state.state.folded_ops
+    if folded_ops:
+        logger.info(
+            f"Folded {sum(folded_ops.values())} ops while tracing {dict(folded_ops)}"
+        )
+    cse_ops = state.state.cse_ops
+    if cse_ops:
+        logger.info(
+            f"Reused {sum(cse_ops.values())} identical ops while tracing {dict(cse_ops)}"
+        )
 
     args = get_default_args(mod.forward)
     output_name = next(
@@ -65,7 +99,7 @@ def run_rewrite(mod):
         if hasattr(arg, "output") and arg.output
     )
 
-    return s, output_name
+    return s, output_name, state.state.reductions
 
 
 def run_circt(mlir_output):
@@ -86,6 +120,19 @@ def run_circt(mlir_output):
     return res.decode()
 
 
+def write_stats(artifacts_dir, name, stage_times, **stats):
+    fp = f"{artifacts_dir}/{name}.stats.json"
+    if os.path.exists(fp):
+        with open(fp) as f:
+            all_stats = json.load(f)
+    else:
+        all_stats = {}
+    all_stats.setdefault("stage_times", {}).update(stage_times)
+    all_stats.update(stats)
+    with open(fp, "w") as f:
+        json.dump(all_stats, f, indent=2)
+
+
 def scf_to_affine(fp):
     cst_map = {}
     old_lines = open(fp).readlines()
@@ -118,30 +165,59 @@ def compile(
     n_test_vectors,
     threshold,
     clock_period,
+    use_cache=USE_CACHE,
+    scheduler=SCHEDULER,
+    schedule_mode=SCHEDULE_MODE,
+    ii=II,
+    simulator=SIMULATOR,
+    tb_shards=TB_SHARDS,
+    waves=WAVES,
+    waves_scope=WAVES_SCOPE,
+    stage_times=None,
 ):
     fp = os.path.abspath(fp)
     dirname, filename = os.path.split(fp)
     name, ext = os.path.splitext(filename)
     artifacts_dir = f"{dirname}"
     os.makedirs(artifacts_dir, exist_ok=True)
+    cache = make_cache(use_cache)
+    # fresh per-compilation state (importing the module creates it)
+    state.state = None
+    # (optionally the caller's, e.g., the compile server's) wall time per stage run
+    stage_times = {} if stage_times is None else stage_times
 
     if do_translate:
         logger.info("Translating MLIR back to Python")
+        start = time.perf_counter()
         affine_mlir_str = scf_to_affine(fp)
         if DEBUG:
             with open(f"{artifacts_dir}/{name}.affine.mlir", "w") as f:
                 f.write(affine_mlir_str)
-        pythonized_mlir = translate(affine_mlir_str)
+        pythonized_mlir = cache.run(
+            "translate",
+            lambda: translate(affine_mlir_str),
+            width_exponent,
+            width_fraction,
+            affine_mlir_str,
+        )
         if DEBUG:
             with open(f"{artifacts_dir}/{name}_pythonized_mlir.py", "w") as f:
                 f.write(pythonized_mlir)
+        stage_times["translate"] = time.perf_counter() - start
     else:
         with open(f"{artifacts_dir}/{name}_pythonized_mlir.py", "r") as f:
             pythonized_mlir = f.read()
 
     if do_rewrite:
         logger.info("Rewriting Python")
-        rewritten_py_code = rewrite(pythonized_mlir)
+        start = time.perf_counter()
+        rewritten_py_code = cache.run(
+            "rewrite",
+            lambda: rewrite(pythonized_mlir),
+            width_exponent,
+            width_fraction,
+            pythonized_mlir,
+        )
         if DEBUG:
             with open(f"{artifacts_dir}/{name}_rewritten.py", "w") as f:
                 f.write(rewritten_py_code)
@@ -150,31 +226,85 @@ def compile(
             )
         else:
             mod = import_module_from_string("pythonized_mlir", rewritten_py_code)
+        stage_times["rewrite"] = time.perf_counter() - start
     else:
         mod = import_module_from_fp(
             "pythonized_mlir", f"{artifacts_dir}/{name}_rewritten.py"
         )
 
     if DEBUG:
-        rewritten_mlir_output, output_name = run_rewrite(mod)
+        start = time.perf_counter()
+        with open(f"{artifacts_dir}/{name}_rewritten.py") as f:
+            rewritten_py_code = f.read()
+        rewritten_mlir_output, output_name, reductions = cache.run(
+            "trace",
+            lambda: run_rewrite(mod),
+            width_exponent,
+            width_fraction,
+            rewritten_py_code,
+        )
         with open(f"{artifacts_dir}/{name}.rewritten.mlir", "w") as f:
             f.write(rewritten_mlir_output)
+        with open(reductions_fp(f"{artifacts_dir}/{name}_rewritten.py"), "w") as f:
+            json.dump(reductions, f)
+        stage_times["trace"] = time.perf_counter() - start
+        # no state on a trace cache hit
+        if state.state is not None:
+            write_stats(
+                artifacts_dir,
+                name,
+                {},
+                folded_ops=dict(state.state.folded_ops),
+                cse_ops=dict(state.state.cse_ops),
+            )
 
     with open(f"{artifacts_dir}/{name}.rewritten.mlir", "r") as f:
         rewritten_mlir_output = f.read()
 
     if do_schedule:
         logger.info("Scheduling")
-        scheduled_mlir = run_circt(rewritten_mlir_output)
-        if DEBUG:
-            with open(f"{artifacts_dir}/{name}.sched.mlir", "w") as f:
-                f.write(scheduled_mlir)
+        start = time.perf_counter()
 
-        sched_and_rewritten_mlir = rewrite_schedule_vals(
-            scheduled_mlir, rewritten_mlir_output
+        def schedule_circt():
+            scheduled_mlir = run_circt(rewritten_mlir_output)
+            if DEBUG:
+                with open(f"{artifacts_dir}/{name}.sched.mlir", "w") as f:
+                    f.write(scheduled_mlir)
+
+            return copy_overwritten_results(
+                rewrite_schedule_vals(scheduled_mlir, rewritten_mlir_output)
+            )
+
+        def schedule():
+            nonlocal rewritten_mlir_output
+            rewritten_mlir_output, bound = bind(rewritten_mlir_output, RESOURCE_LIMITS)
+            if scheduler == "circt":
+                return schedule_circt()
+            sched_mlir = native_schedule(
+                rewritten_mlir_output,
+                mode=schedule_mode,
+                # the traced op graph has the logical pes
+                state=None if bound else state.state,
+                include_aux_deps=INCLUDE_AUX_DEPS,
+                ii=ii,
+            )
+            if scheduler == "crosscheck":
+                crosscheck_schedules(sched_mlir, schedule_circt())
+            return sched_mlir
+
+        sched_and_rewritten_mlir = cache.run(
+            "schedule",
+            schedule,
+            width_exponent,
+            width_fraction,
+            rewritten_mlir_output,
+            scheduler,
+            schedule_mode,
+            ii if schedule_mode == "modulo" else None,
         )
         with open(f"{artifacts_dir}/{name}.rewritten.sched.mlir", "w") as f:
             f.write(sched_and_rewritten_mlir)
+        stage_times["schedule"] = time.perf_counter() - start
 
     if do_verilog or do_testbench:
         with open(f"{artifacts_dir}/{name}.rewritten.sched.mlir", "r") as f:
@@ -190,29 +320,47 @@ def compile(
             csts,
             pe_idxs,
         ) = parse_mlir_module(sched_and_rewritten_mlir)
+        achieved_ii = parse_ii(sched_and_rewritten_mlir)
+        if achieved_ii is not None:
+            logger.info(
+                f"Pipelined with II {achieved_ii} (latency {return_time + 1})"
+            )
 
     if do_verilog:
         logger.info("Emitting RTL")
-        module, blackbox, input_wires, output_wires, max_fsm_stage = emit_verilog(
-            name,
+        start = time.perf_counter()
+        module_fp = f"{artifacts_dir}/{name}.sv"
+        blackbox_fp = f"{artifacts_dir}/{name}_blackbox.sv"
+
+        def verilog():
+            with open(module_fp, "w") as module_f, open(blackbox_fp, "w") as blackbox_f:
+                return emit_verilog(
+                    name,
+                    width_exponent,
+                    width_fraction,
+                    op_id_data,
+                    func_args,
+                    returns,
+                    return_time,
+                    vals,
+                    csts,
+                    pe_idxs,
+                    module_f,
+                    blackbox_f,
+                    for_testbench=do_testbench,
+                    ii=achieved_ii,
+                )
+
+        input_wires, output_wires, max_fsm_stage = cache.run_with_files(
+            "verilog",
+            verilog,
+            [module_fp, blackbox_fp],
             width_exponent,
             width_fraction,
-            op_id_data,
-            func_args,
-            returns,
-            return_time,
-            vals,
-            csts,
-            pe_idxs,
-            for_testbench=do_testbench,
+            name,
+            sched_and_rewritten_mlir,
+            do_testbench,
         )
-        module = module.replace("%", "p_")
-        with open(f"{artifacts_dir}/{name}.sv", "w") as f:
-            f.write(module)
-
-        blackbox = blackbox.replace("%", "p_")
-        with open(f"{artifacts_dir}/{name}_blackbox.sv", "w") as f:
-            f.write(blackbox)
 
         # pblock_bridge = pblock_bridge.replace("%", "p_")
         # with open(f"{artifacts_dir}/{name}_pblock_bridge.sv", "w") as f:
@@ -232,6 +380,7 @@ def compile(
             f.write(clock_xdc_file)
 
         logger.info(f"Final FSM time step {max_fsm_stage}")
+        stage_times["verilog"] = time.perf_counter() - start
 
     logger.info(f"RTL top-level {name}")
 
@@ -251,16 +400,38 @@ def compile(
         if os.path.isfile(full_file_name):
             shutil.copy(full_file_name, f"{artifacts_dir}/")
 
+    cache.report()
+
+    if do_verilog or do_testbench:
+        write_stats(
+            artifacts_dir,
+            name,
+            stage_times,
+            width_exponent=width_exponent,
+            width_fraction=width_fraction,
+            fsm_stages=return_time + 1,
+            ii=achieved_ii,
+            n_pes=len([pe_idx for pe_idx in pe_idxs if pe_idx[0] >= 0]),
+            n_ops=len([op for _op_id, op in op_id_data if op != OpType.CST]),
+        )
+    else:
+        write_stats(artifacts_dir, name, stage_times)
+
     if do_testbench:
         logger.info("Running testbench")
+        start = time.perf_counter()
 
         max_fsm_stage = return_time + 1
+        # (the testbench pulls in cocotb and the flopoco converter; compiles without -b don't)
+        from openhls.testbench.tb_runner import testbench_runner
+
         testbench_runner(
             proj_path=f"{artifacts_dir}",
             module_fp=os.path.abspath(f"{artifacts_dir}/{name}_rewritten.py"),
             sv_file_name=f"{name}.sv",
             top_level=name,
             max_fsm_stage=max_fsm_stage,
+            ii=achieved_ii,
             output_map={
                 val_name.replace("%", "output_p_"): (arr_name, idx)
                 for val_name, (arr_name, idx) in output_map.items()
@@ -269,14 +440,23 @@ def compile(
             width_fraction=width_fraction,
             n_test_vectors=n_test_vectors,
             threshold=threshold,
+            simulator=simulator,
+            n_shards=tb_shards,
+            waves=waves,
+            waves_scope=waves_scope,
+        )
+        stage_times["testbench"] = time.perf_counter() - start
+        write_stats(
+            artifacts_dir, name, {"testbench": stage_times["testbench"]}
         )
         logger.info("Thank you, come again")
         os.remove(f"{artifacts_dir}/{name}_rewritten.mlir")
         sys.exit(0)
     os.remove(f"{artifacts_dir}/{name}_rewritten.mlir")
+    state.state = None
 
 
-def main():
+def make_arg_parser():
     parser = argparse.ArgumentParser("OpenHLS compiler driver")
     parser.add_argument("fp", help="Filepath of top-level MLIR file")
     parser.add_argument(
@@ -298,7 +478,25 @@ def main():
         "--schedule",
         default=False,
         action="store_true",
-        help="Schedule the model using CIRCT",
+        help="Schedule the model",
+    )
+    parser.add_argument(
+        "--scheduler",
+        default=SCHEDULER,
+        choices=["native", "circt", "crosscheck"],
+        help="Schedule in-process, with CIRCT, or in-process and compare against CIRCT",
+    )
+    parser.add_argument(
+        "--schedule_mode",
+        default=SCHEDULE_MODE,
+        choices=["list", "exact", "modulo"],
+        help="Native scheduler mode",
+    )
+    parser.add_argument(
+        "--ii",
+        default=II,
+        type=int,
+        help="Target initiation interval for the modulo mode (0 is the smallest the pes allow)",
     )
     parser.add_argument(
         "-v", "--verilog", default=False, action="store_true", help="Emit verilog"
@@ -322,6 +520,30 @@ def main():
         type=float,
         help="Test for average number of testbench failures instead of absolute",
     )
+    parser.add_argument(
+        "--simulator",
+        default=SIMULATOR,
+        choices=["icarus", "verilator"],
+        help="Simulate the testbench with icarus (through cocotb) or a compiled verilator harness",
+    )
+    parser.add_argument(
+        "--tb_shards",
+        default=TB_SHARDS,
+        type=int,
+        help="Split the (cocotb) testbench's vectors over this many simulator processes (0 is one per core)",
+    )
+    parser.add_argument(
+        "--waves",
+        default=WAVES,
+        choices=["off", "all", "failing"],
+        help="Dump the testbench's waves for every vector or only for (a re-run of) the first wrong ones",
+    )
+    parser.add_argument(
+        "--waves_scope",
+        default=WAVES_SCOPE,
+        nargs="*",
+        help="Only dump the signals matching these globs (e.g. one pe's *_0_0_0_0_1 *_0_0_0_0_1_?)",
+    )
     parser.add_argument(
         "-c",
         "--clock_period",
@@ -329,8 +551,17 @@ def main():
         default=10,
         help="Clock period (for synthesis)",
     )
-    args = parser.parse_args()
-    compile(
+    parser.add_argument(
+        "--no_cache",
+        default=False,
+        action="store_true",
+        help="Don't reuse (or store) cached stage artifacts",
+    )
+    return parser
+
+
+def compile_from_args(args, **kwargs):
+    return compile(
         args.fp,
         args.translate,
         args.rewrite,
@@ -342,8 +573,21 @@ def main():
         args.n_test_vectors,
         args.threshold,
         args.clock_period,
+        use_cache=USE_CACHE and not args.no_cache,
+        scheduler=args.scheduler,
+        schedule_mode=args.schedule_mode,
+        ii=args.ii,
+        simulator=args.simulator,
+        tb_shards=args.tb_shards,
+        waves=args.waves,
+        waves_scope=args.waves_scope,
+        **kwargs,
     )
 
 
+def main():
+    compile_from_args(make_arg_parser().parse_args())
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,113 @@
+import array
+
+import numpy as np
+
+
+class OpGraph:
+    # rows are indexed by op_id; op_ids that never become nodes (e.g. constants) are holes
+    HOLE = -1
+
+    def __init__(self):
+        self.op_types = []
+        self._op_type_codes = {}
+        self.pe_idxs = []
+        self._pe_codes = {}
+        self._opcodes = array.array("b")
+        self._pes = array.array("i")
+        self._n_args = array.array("i")
+        self._edge_src = array.array("q")
+        self._edge_dst = array.array("q")
+        self._aux_src = array.array("q")
+        self._aux_dst = array.array("q")
+        self._csr = {}
+
+    def __len__(self):
+        return len(self._opcodes)
+
+    def __contains__(self, op):
+        return op.op_id < len(self._opcodes) and self._opcodes[op.op_id] != self.HOLE
+
+    @staticmethod
+    def _intern(x, table, codes):
+        if x not in codes:
+            codes[x] = len(table)
+            table.append(x)
+        return codes[x]
+
+    def add_node(self, op):
+        assert op.op_id >= len(self._opcodes), f"op {op.op_id} added out of order"
+        n_holes = op.op_id - len(self._opcodes)
+        self._opcodes.extend([self.HOLE] * n_holes)
+        self._pes.extend([self.HOLE] * n_holes)
+        self._n_args.extend([0] * n_holes)
+
+        self._opcodes.append(
+            self._intern(op.type, self.op_types, self._op_type_codes)
+        )
+        self._pes.append(self._intern(op.pe_idx, self.pe_idxs, self._pe_codes))
+        self._n_args.append(len(op.args))
+
+    def add_edge(self, src, dst):
+        # src is either an op_id or a (negative) code for an argument/constant source
+        self._edge_src.append(src)
+        self._edge_dst.append(dst)
+        self._csr.clear()
+
+    def add_aux_edge(self, src, dst):
+        self._aux_src.append(src)
+        self._aux_dst.append(dst)
+
+    def pe_idx(self, op_id):
+        return self.pe_idxs[self._pes[op_id]]
+
+    @staticmethod
+    def _to_numpy(arr, dtype):
+        return np.frombuffer(arr, dtype=dtype).copy() if len(arr) else np.empty(0, dtype)
+
+    @property
+    def opcodes(self):
+        return self._to_numpy(self._opcodes, np.int8)
+
+    @property
+    def pes(self):
+        return self._to_numpy(self._pes, np.int32)
+
+    @property
+    def n_args(self):
+        return self._to_numpy(self._n_args, np.int32)
+
+    @property
+    def nodes(self):
+        return np.flatnonzero(self.opcodes != self.HOLE)
+
+    @property
+    def edges(self):
+        src = self._to_numpy(self._edge_src, np.int64)
+        dst = self._to_numpy(self._edge_dst, np.int64)
+        # only edges between ops (not from arguments/constants)
+        mask = src >= 0
+        return src[mask], dst[mask]
+
+    @property
+    def aux_edges(self):
+        return (
+            self._to_numpy(self._aux_src, np.int64),
+            self._to_numpy(self._aux_dst, np.int64),
+        )
+
+    def csr(self, reverse=False):
+        """(indptr, indices) such that indices[indptr[i]:indptr[i+1]] are the
+        successors (predecessors if reverse) of op i."""
+        if reverse not in self._csr:
+            src, dst = self.edges
+            if reverse:
+                src, dst = dst, src
+            order = np.argsort(src, kind="stable")
+            indptr = np.zeros(len(self) + 1, dtype=np.int64)
+            np.add.at(indptr, src + 1, 1)
+            self._csr[reverse] = np.cumsum(indptr), dst[order]
+        return self._csr[reverse]
+
+    @property
+    def num_unique_pes(self):
+        return len(np.unique(self.pes[self.nodes]))
@@ -1,6 +1,7 @@
 import inspect
 import io
 import itertools
+import json
 import os
 from textwrap import indent, dedent
 
@@ -8,6 +9,7 @@ import numpy as np
 
 from openhls.compiler import state
 from openhls.compiler.state import logger
+from openhls.config import TB_REFERENCE
 from openhls.flopoco.ops import (
     MemRef as FPMemRef,
     GlobalMemRef as FPGlobalMemRef,
@@ -69,21 +71,33 @@ def get_py_module_args_globals(args):
     return inputs, globals, outputs
 
 
+def bind_args_to_state(inputs, globals):
+    # the default args are built when the module is imported, i.e., possibly under a different state
+    # (the rest are made, and added to the state, on first use)
+    for inp in inputs.values():
+        for v in inp.materialized_vals():
+            state.state.add_memref_arg(v)
+    for glob in globals.values():
+        for v in glob.materialized_vals():
+            state.state.add_global_memref_arg(v)
+
+
 def Forward(forward):
     args = get_default_args(forward)
     inputs, globals, outputs = get_py_module_args_globals(args)
+    bind_args_to_state(inputs, globals)
 
     input_names = sorted(
-        [str(name) for inp in inputs.values() for name in inp.val_names_map.values()]
+        [name for inp in inputs.values() for _idx, name in inp.val_names_map]
     )
     global_names = sorted(
-        [str(name) for inp in globals.values() for name in inp.val_names_map.values()]
+        [name for inp in globals.values() for _idx, name in inp.val_names_map]
     )
     inps_globals = [f"{v}: {state.state.dtype}" for v in input_names + global_names]
 
     output_dtypes = []
     for output_arg in outputs.values():
-        output_dtypes += [state.state.dtype] * len(output_arg.val_names_map)
+        output_dtypes += [state.state.dtype] * output_arg.registers.size
     state.state.emit(
         f"func.func @forward({', '.join(inps_globals)}) -> ({', '.join(output_dtypes)})\n"
     )
@@ -103,7 +117,7 @@ def Forward(forward):
         output_names += sorted(
             [
                 (name, idx, val_name)
-                for idx, val_name in output_arg.val_names_map.items()
+                for idx, val_name in output_arg.val_names_map
             ]
         )
     for name, idx, val in output_names:
@@ -142,9 +156,44 @@ def make_output_file(fp=None):
         state.state = state.State(open(fp.replace(".py", ".mlir"), "w"))
 
 
+def reductions_fp(module_fp):
+    # the traced reduction trees, next to the module, e.g., lin_rewritten.py -> lin.reductions.json
+    return module_fp.replace("_rewritten.py", ".reductions.json")
+
+
+def rewritten_mlir_fp(module_fp):
+    # the traced ops, next to the module, e.g., lin_rewritten.py -> lin.rewritten.mlir
+    return module_fp.replace("_rewritten.py", ".rewritten.mlir")
+
+
+def load_reductions(mod):
+    module_fp = getattr(mod, "__file__", None)
+    if module_fp is None or not os.path.exists(reductions_fp(module_fp)):
+        return []
+    with open(reductions_fp(module_fp)) as f:
+        return json.load(f)
+
+
 def run_model_with_fp_number(mod, inputs, width_exponent, width_fraction):
+    # inputs can be stacked along a leading batch axis, in which case the model runs once
+    # for the whole batch and the outputs' registers hold tiles (one element per input vector)
     file = io.StringIO()
     state.state = state.State(file)
+    # the model has to add up in the same order as the hardware
+    state.state.reductions = load_reductions(mod)
+    test_args, outputs = make_fp_args(mod, inputs, width_exponent, width_fraction)
+
+    FPFMAC.width_exponent = width_exponent
+    FPFMAC.width_fraction = width_fraction
+    mod.FMAC = FPFMAC
+    mod.Div = FPDiv
+    mod.MemRef = FPMemRef
+    mod.GlobalMemRef = FPGlobalMemRef
+    mod.forward(**test_args)
+    return test_args, outputs
+
+
+def make_fp_args(mod, inputs, width_exponent, width_fraction):
     args = get_default_args(mod.forward)
     test_args = {}
     outputs = {}
@@ -163,12 +212,39 @@ def run_model_with_fp_number(mod, inputs, width_exponent, width_fraction):
             )
         else:
             raise Exception("neither a globalmemref nor a memref")
-
-    FPFMAC.width_exponent = width_exponent
-    FPFMAC.width_fraction = width_fraction
-    mod.FMAC = FPFMAC
-    mod.Div = FPDiv
-    mod.MemRef = FPMemRef
-    mod.GlobalMemRef = FPGlobalMemRef
-    mod.forward(**test_args)
     return test_args, outputs
+
+
+def make_test_vectors(
+    mod, n_test_vectors, width_exponent, width_fraction, reference=TB_REFERENCE
+):
+    args = get_default_args(mod.forward)
+    input_memrefs, *_ = get_py_module_args_globals(args)
+    test_inputs = {inp_name: [] for inp_name in input_memrefs}
+    # same draws (for the same seed) as generating one vector at a time
+    for _ in range(n_test_vectors):
+        for inp_name, inp_memref in input_memrefs.items():
+            test_inputs[inp_name].append(np.random.randn(*inp_memref.shape))
+    test_inputs = {
+        inp_name: np.stack(vecs) for inp_name, vecs in test_inputs.items()
+    }
+
+    module_fp = getattr(mod, "__file__", None)
+    if reference == "evaluator":
+        if module_fp is not None and os.path.exists(rewritten_mlir_fp(module_fp)):
+            # (the evaluator imports this module)
+            from openhls.ir.evaluate import evaluate_test_vectors
+
+            return evaluate_test_vectors(
+                mod,
+                test_inputs,
+                rewritten_mlir_fp(module_fp),
+                width_exponent,
+                width_fraction,
+            )
+        logger.warning(f"No traced ops next to {module_fp}, running the golden model")
+
+    # all the vectors in one pass through the model
+    return run_model_with_fp_number(
+        mod, test_inputs, width_exponent=width_exponent, width_fraction=width_fraction
+    )
@@ -0,0 +1,406 @@
+import ast
+import bisect
+import heapq
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from openhls.config import ADD_LATENCY, DTYPE, MUL_LATENCY
+from openhls.ir.ops import Op, OpType, LATENCIES
+from openhls.ir.parse import parse_mlir_module, ssa_names
+from openhls.rtl.emit_verilog import op_reads
+from openhls.rtl.fsm import mac_fsm_times
+
+logger = logging.getLogger(__name__)
+
+# ops that don't occupy an IP on their PE
+RESOURCE_FREE = {OpType.CST, OpType.COPY}
+
+
+def op_issues(op_type, pe_idx, n_args):
+    # the (ip, stage offset) pairs at which an op issues to its pe's (pipelined) ips
+    if op_type == OpType.FMAC:
+        fmul_times, fadd_times, _done_time = mac_fsm_times((n_args - 1) // 2, 0)
+        return tuple(((pe_idx, OpType.MUL.value), t) for t in fmul_times) + tuple(
+            ((pe_idx, OpType.ADD.value), t) for t in fadd_times
+        )
+    return (((pe_idx, op_type.value), 0),)
+
+
+@dataclass
+class ScheduleProblem:
+    latencies: dict = field(default_factory=dict)
+    preds: dict = field(default_factory=lambda: defaultdict(set))
+    pes: dict = field(default_factory=dict)
+    res_to_op_id: dict = field(default_factory=dict)
+    issues: dict = field(default_factory=dict)
+
+    def add_op(self, op: Op):
+        op_id = int(op.op_id)
+        self.latencies[op_id] = LATENCIES[op]
+        self.pes[op_id] = (
+            None if op.type in RESOURCE_FREE or op.pe_idx[0] < 0 else op.pe_idx
+        )
+        if self.pes[op_id] is not None:
+            self.issues[op_id] = op_issues(op.type, op.pe_idx, len(op.args))
+        self.res_to_op_id[str(op.res)] = op_id
+        self.preds[op_id]
+
+    def add_dep(self, src_op_id, dst_op_id):
+        self.preds[int(dst_op_id)].add(int(src_op_id))
+
+    @staticmethod
+    def from_state(state, include_aux_deps=True):
+        problem = ScheduleProblem()
+        op_graph = state.op_graph
+        lats = LATENCIES.for_graph(op_graph)
+        pes = op_graph.pes
+        free_codes = [
+            code
+            for code, op_type in enumerate(op_graph.op_types)
+            if op_type in RESOURCE_FREE
+        ]
+        opcodes = op_graph.opcodes
+        n_args = op_graph.n_args
+        free = np.isin(opcodes, free_codes)
+        for op_id in op_graph.nodes.tolist():
+            pe_idx = op_graph.pe_idxs[pes[op_id]]
+            problem.latencies[op_id] = int(lats[op_id])
+            problem.pes[op_id] = None if free[op_id] or pe_idx[0] < 0 else pe_idx
+            if problem.pes[op_id] is not None:
+                problem.issues[op_id] = op_issues(
+                    op_graph.op_types[opcodes[op_id]], pe_idx, int(n_args[op_id])
+                )
+            problem.preds[op_id]
+        # constants have op_ids (and get annotated) but aren't nodes
+        for op_id in np.flatnonzero(opcodes == op_graph.HOLE).tolist() + list(
+            range(len(op_graph), state.curr_op_id)
+        ):
+            problem.latencies[op_id] = 0
+            problem.pes[op_id] = None
+            problem.preds[op_id]
+        edges = [op_graph.edges]
+        if include_aux_deps:
+            edges.append(op_graph.aux_edges)
+        for src, dst in edges:
+            for s, d in zip(src.tolist(), dst.tolist()):
+                problem.add_dep(s, d)
+        problem.res_to_op_id = {
+            str(v): src for v, src in state.val_source.items() if isinstance(src, int)
+        }
+        return problem
+
+    @staticmethod
+    def from_module(module_str, include_aux_deps=True):
+        problem = ScheduleProblem()
+        op_id_data, *_ = parse_mlir_module(module_str)
+        for op in op_id_data.values():
+            problem.add_op(op)
+        for op in op_id_data.values():
+            for arg in op.args:
+                if arg in problem.res_to_op_id:
+                    problem.add_dep(problem.res_to_op_id[arg], op.op_id)
+        if include_aux_deps:
+            for src, dst in parse_aux_deps(module_str):
+                problem.add_dep(src, dst)
+        return problem
+
+
+def parse_aux_deps(module_str):
+    for line in module_str.splitlines():
+        line = line.strip()
+        if line.startswith("auxdeps"):
+            return ast.literal_eval(line.split("=", 1)[1].strip().rstrip(","))
+    return []
+
+
+def schedule_exact(problem: ScheduleProblem):
+    # ops are emitted in program order so op_id order is a topological order;
+    # with only precedence constraints the longest path is the LP optimum
+    start_times = {}
+    for op_id in sorted(problem.latencies):
+        start_times[op_id] = max(
+            (start_times[p] + problem.latencies[p] for p in problem.preds[op_id]),
+            default=0,
+        )
+    return start_times
+
+
+def op_heights(problem: ScheduleProblem):
+    succs = defaultdict(list)
+    for op_id, preds in problem.preds.items():
+        for p in preds:
+            succs[p].append(op_id)
+    heights = {}
+    for op_id in sorted(problem.latencies, reverse=True):
+        heights[op_id] = problem.latencies[op_id] + max(
+            (heights[s] for s in succs[op_id]), default=0
+        )
+    return heights, succs
+
+
+def schedule_list(problem: ScheduleProblem):
+    # each pe issues one op at a time; among ready ops the one with the longest
+    # path to the end of the schedule goes first
+    heights, succs = op_heights(problem)
+    n_preds = {op_id: len(preds) for op_id, preds in problem.preds.items()}
+    ready_time = defaultdict(int)
+    pe_free_at = defaultdict(int)
+    ready = [
+        (0, -heights[op_id], op_id) for op_id, n in n_preds.items() if n == 0
+    ]
+    heapq.heapify(ready)
+
+    start_times = {}
+    while ready:
+        t, neg_height, op_id = heapq.heappop(ready)
+        pe = problem.pes[op_id]
+        if pe is not None and pe_free_at[pe] > t:
+            heapq.heappush(ready, (pe_free_at[pe], neg_height, op_id))
+            continue
+
+        start_times[op_id] = t
+        end_time = t + problem.latencies[op_id]
+        if pe is not None:
+            pe_free_at[pe] = end_time
+        for s in succs[op_id]:
+            ready_time[s] = max(ready_time[s], end_time)
+            n_preds[s] -= 1
+            if n_preds[s] == 0:
+                heapq.heappush(ready, (ready_time[s], -heights[s], s))
+
+    assert len(start_times) == len(problem.latencies), "dependence cycle"
+    return start_times
+
+
+def schedule_modulo(problem: ScheduleProblem, ii=0):
+    # a new inference starts every ii cycles and the ips are pipelined (how long each result stays
+    # good is PipelineRegs' problem) so an op only takes its issue slots (mod ii) in its ips'
+    # reservation tables; ops go (in program order) to the first start after their preds whose
+    # slots are free and if some op doesn't fit within ii starts of that then ii grows
+    ip_issues = defaultdict(int)
+    for issues in problem.issues.values():
+        for ip, _offset in issues:
+            ip_issues[ip] += 1
+    res_mii = max(ip_issues.values(), default=0)
+    # a one stage fsm is no fsm at all
+    ii = max(ii, res_mii, 2)
+    while True:
+        start_times = place_modulo(problem, ii)
+        if start_times is not None:
+            break
+        ii += 1 + ii // 32
+    logger.info(f"Modulo schedule II {ii} (resource bound {res_mii})")
+    return start_times, ii
+
+
+def place_modulo(problem: ScheduleProblem, ii):
+    # the tables are doubled so that the next free slot (wrapping around) is a find
+    tables = defaultdict(lambda: bytearray(2 * ii))
+    start_times = {}
+    for op_id in sorted(problem.latencies):
+        t = max(
+            (start_times[p] + problem.latencies[p] for p in problem.preds[op_id]),
+            default=0,
+        )
+        issues = problem.issues.get(op_id, ())
+        if len(issues) == 1:
+            ((ip, offset),) = issues
+            table = tables[ip]
+            slot = (t + offset) % ii
+            free = table.find(0, slot, slot + ii)
+            if free == -1:
+                return None
+            t += free - slot
+        elif issues:
+            # an fmac's fmul and fadd stages
+            for t in range(t, t + ii):
+                slots = {(ip, (t + offset) % ii) for ip, offset in issues}
+                if len(slots) < len(issues):
+                    return None
+                if not any(tables[ip][slot] for ip, slot in slots):
+                    break
+            else:
+                return None
+        for ip, offset in issues:
+            slot = (t + offset) % ii
+            tables[ip][slot] = tables[ip][slot + ii] = 1
+        start_times[op_id] = t
+    return start_times
+
+
+SCHEDULERS = {
+    "exact": schedule_exact,
+    "list": schedule_list,
+}
+
+
+def return_time(problem: ScheduleProblem, start_times, returns):
+    return max(
+        start_times[problem.res_to_op_id[r]]
+        + problem.latencies[problem.res_to_op_id[r]]
+        for r in returns
+        if r in problem.res_to_op_id
+    )
+
+
+reg_op_id = re.compile(r'op_id = "(\d+)"')
+
+
+def annotate_schedule(module_str, start_times, ret_time, ii=None):
+    lines = [] if ii is None else [f"// ii = {ii}"]
+    for line in module_str.splitlines():
+        stripped = line.lstrip()
+        if not stripped.startswith("//"):
+            op_id = reg_op_id.search(line)
+            if op_id is not None:
+                line = line.replace(
+                    "{  ",
+                    f"{{  lpStartTime = {start_times[int(op_id.group(1))]}, ",
+                    1,
+                )
+            elif stripped.startswith("return"):
+                line = f"{line} {{lpStartTime = {ret_time} : i64}}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def copy_overwritten_results(module_str):
+    # an ip's result is only on its result wire until the ip's next result lands (which, e.g.,
+    # the list scheduler's reordering makes happen before everything has read it) so the ops
+    # (and the return) that read it any later read a copy made when it's done instead
+    op_id_data, _, returns, _, ret_time, *_ = parse_mlir_module(module_str)
+    changes = defaultdict(list)
+    results = {}
+    for op in op_id_data.values():
+        if op.type in RESOURCE_FREE or op.pe_idx[0] < 0:
+            continue
+        start_time = op.attrs["start_time"]
+        if op.type == OpType.FMAC:
+            fmul_times, fadd_times, _done_time = mac_fsm_times(
+                (len(op.args) - 1) // 2, start_time
+            )
+            changes[op.pe_idx, OpType.MUL.value].extend(
+                t + MUL_LATENCY for t in fmul_times
+            )
+            changes[op.pe_idx, OpType.ADD.value].extend(
+                t + ADD_LATENCY for t in fadd_times[:-1]
+            )
+            ip = op.pe_idx, OpType.ADD.value
+        else:
+            ip = op.pe_idx, op.type.value
+        results[op.res] = ip, start_time + LATENCIES[op]
+        changes[ip].append(start_time + LATENCIES[op])
+    for ts in changes.values():
+        ts.sort()
+
+    reads = [
+        (op.res, arg, fsm_stage)
+        for op in op_id_data.values()
+        if op.type != OpType.CST
+        for arg, fsm_stage in op_reads(op)
+    ]
+    reads += [("return", v, ret_time + 1) for v in returns]
+    copies = {}
+    readers = defaultdict(set)
+    for reader, v, fsm_stage in reads:
+        if v not in results:
+            continue
+        ip, done = results[v]
+        ts = changes[ip]
+        i = bisect.bisect_right(ts, done)
+        if i < len(ts) and ts[i] <= fsm_stage:
+            copies[v] = f"{v}_copy"
+            readers[reader].add(v)
+    if not copies:
+        return module_str
+    logger.info(f"Copying {len(copies)} results that are overwritten before they're read")
+
+    def rename(names, vs):
+        return [copies[v] if v in vs else v for v in names]
+
+    next_op_id = max(int(op.op_id) for op in op_id_data.values()) + 1
+    lines = []
+    for line in module_str.splitlines():
+        stripped = line.lstrip()
+        if stripped.startswith("// output_map;"):
+            prefix, _, rest = line.partition(";")
+            v, _, rest = rest.partition(":")
+            line = f"{prefix};{rename([v], readers['return'])[0]}:{rest}"
+        elif stripped.startswith("return") and "return" in readers:
+            vals, _, rest = line.partition(":")
+            rets = rename(ssa_names(vals), readers["return"])
+            line = f"{vals[: vals.index('%')]}{', '.join(rets)}:{rest}"
+        elif not stripped.startswith("//") and reg_op_id.search(line):
+            res = line.partition("=")[0].strip()
+            if res in readers:
+                head, _, rest = line.partition(" (")
+                args, _, rest = rest.partition(")")
+                args = ", ".join(rename(args.split(", "), readers[res]))
+                line = f"{head} ({args}){rest}"
+            if res in copies:
+                (pe_idx, _ip), done = results[res]
+                # the copy captures the result the stage it's done (start times are annotated
+                # one stage earlier than they're parsed)
+                lines.append(line)
+                line = (
+                    f'{copies[res]} = "{OpType.COPY.value}" ({res}) {{  lpStartTime = {done - 1}, '
+                    f'pe = "{pe_idx}", opr = "{OpType.COPY.value}", op_id = "{next_op_id}"  }} '
+                    f": ({DTYPE}) -> {DTYPE}"
+                )
+                next_op_id += 1
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def parse_ii(module_str):
+    # the initiation interval of a modulo scheduled module (None if it isn't one)
+    for line in module_str.splitlines():
+        line = line.strip()
+        if line.startswith("// ii ="):
+            return int(line.split("=", 1)[1])
+        if not line.startswith("//"):
+            return None
+    return None
+
+
+def native_schedule(
+    module_str, mode="list", state=None, include_aux_deps=True, ii=0
+):
+    # aux deps only serialize the ops on each pe, which the list (and modulo) scheduler's
+    # resource constraint already does (without pinning program order)
+    include_aux_deps = include_aux_deps and mode not in {"list", "modulo"}
+    if state is not None and state.curr_op_id > 0:
+        problem = ScheduleProblem.from_state(state, include_aux_deps)
+    else:
+        problem = ScheduleProblem.from_module(module_str, include_aux_deps)
+
+    if mode == "modulo":
+        start_times, ii = schedule_modulo(problem, ii)
+    else:
+        start_times, ii = SCHEDULERS[mode](problem), None
+    returns = next(
+        ssa_names(line)
+        for line in module_str.splitlines()
+        if line.lstrip().startswith("return")
+    )
+    ret_time = return_time(problem, start_times, returns)
+    logger.info(f"Native {mode} schedule length {ret_time}")
+    sched_str = annotate_schedule(module_str, start_times, ret_time, ii)
+    if ii is None:
+        sched_str = copy_overwritten_results(sched_str)
+    return sched_str
+
+
+def crosscheck_schedules(native_sched_str, circt_sched_str):
+    *_, native_return_time, _, _, _ = parse_mlir_module(native_sched_str)
+    *_, circt_return_time, _, _, _ = parse_mlir_module(circt_sched_str)
+    if native_return_time != circt_return_time:
+        logger.warning(
+            f"Native schedule length {native_return_time} differs from CIRCT's {circt_return_time}"
+        )
+    else:
+        logger.info(f"Native schedule length matches CIRCT's ({circt_return_time})")
@@ -0,0 +1,248 @@
+import argparse
+import contextlib
+import importlib
+import io
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.getenv("OPENHLS_SOCKET") or str(
+    Path(tempfile.gettempdir()) / f"openhls-{os.getuid()}.sock"
+)
+
+
+def send_msg(f, msg):
+    f.write(json.dumps(msg).encode() + b"\n")
+    f.flush()
+
+
+def recv_msg(f):
+    line = f.readline()
+    return json.loads(line) if line else None
+
+
+class Job:
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.request = request
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.result = None
+        self.done = threading.Event()
+
+    def summary(self):
+        return {"job": self.id, "fp": self.request["argv"][0]}
+
+
+def run_job(job, compile_mod, widths):
+    # jobs are the compiler driver's command line (fp first) and the mlir it names; a job runs
+    # exactly like openhls_compiler would (in this process, i.e., with everything already imported)
+    request = job.request
+    result = {"job": job.id, "queued_s": round(job.started - job.submitted, 3)}
+    stage_times = {}
+    log_handler = None
+    try:
+        # the widths (and so the ips' latencies) are fixed when the config is imported
+        for given, own in zip(request.get("widths", (None, None)), widths):
+            if given is not None and given != own:
+                raise ValueError(
+                    f"the server was started with (WIDTH_EXPONENT, WIDTH_FRACTION) = {widths}, "
+                    f"not {tuple(request['widths'])}"
+                )
+        usage = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(usage):
+                args = compile_mod.make_arg_parser().parse_args(request["argv"])
+        except SystemExit:
+            raise ValueError(usage.getvalue().strip())
+        fp = Path(args.fp).resolve()
+        if not fp.exists() or fp.read_text() != request["mlir"]:
+            os.makedirs(fp.parent, exist_ok=True)
+            fp.write_text(request["mlir"])
+        log_fp = fp.parent / f"{fp.stem}.compile.log"
+        log_handler = logging.FileHandler(log_fp, mode="w")
+        log_handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(levelname)s - %(module)s - %(message)s")
+        )
+        logging.getLogger().addHandler(log_handler)
+        result["log"] = str(log_fp)
+        try:
+            compile_mod.compile_from_args(args, stage_times=stage_times)
+        except SystemExit as e:
+            # the testbench path exits (0) when it's done
+            if e.code not in (None, 0):
+                raise
+        result["ok"] = True
+    except BaseException as e:
+        logger.exception(f"Job {job.id} failed")
+        result.update(ok=False, error=f"{type(e).__name__}: {e}")
+    finally:
+        if log_handler is not None:
+            logging.getLogger().removeHandler(log_handler)
+            log_handler.close()
+    result["stage_times"] = {k: round(v, 3) for k, v in stage_times.items()}
+    result["run_s"] = round(time.perf_counter() - job.started, 3)
+    return result
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = recv_msg(self.rfile)
+        if request is None:
+            return
+        cmd = request.get("cmd", "compile")
+        if cmd == "status":
+            send_msg(self.wfile, self.server.status())
+        elif cmd == "stop":
+            send_msg(self.wfile, {"ok": True})
+            threading.Thread(target=self.server.shutdown).start()
+        elif cmd == "compile":
+            job = Job(next(self.server.job_ids), request)
+            self.server.jobs.put(job)
+            send_msg(self.wfile, {"job": job.id, "ahead": self.server.jobs.qsize() - 1})
+            job.done.wait()
+            send_msg(self.wfile, job.result)
+        else:
+            send_msg(self.wfile, {"ok": False, "error": f"unknown command {cmd}"})
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # connections are handled concurrently but jobs run one at a time, in order, on one worker
+    # (compilation uses process wide state, e.g., state.state and the config)
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, JobHandler)
+        self.jobs = queue.Queue()
+        self.job_ids = itertools.count(1)
+        self.running = None
+        self.history = deque(maxlen=100)
+
+    def work(self, compile_mod, widths):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            job.started = time.perf_counter()
+            self.running = job
+            job.result = run_job(job, compile_mod, widths)
+            self.running = None
+            self.history.append(job.result)
+            logger.info(
+                f"Job {job.id} {'done' if job.result['ok'] else 'failed'} in {job.result['run_s']}s "
+                f"(queued {job.result['queued_s']}s) {job.result['stage_times']}"
+            )
+            job.done.set()
+
+    def status(self):
+        return {
+            "ok": True,
+            "running": self.running.summary() if self.running is not None else None,
+            "queued": self.jobs.qsize(),
+            "history": list(self.history)[-20:],
+        }
+
+
+def serve(socket_path=DEFAULT_SOCKET):
+    start = time.perf_counter()
+    # the expensive imports (and the config's parsing of the flopoco cores) happen once, here
+    from openhls.config import WIDTH_EXPONENT, WIDTH_FRACTION
+
+    # (openhls.compiler.compile the module, not the function openhls.compiler exports)
+    compile_mod = importlib.import_module("openhls.compiler.compile")
+    # (the testbench's imports are deferred by the compiler, but jobs with -b shouldn't pay for them)
+    with contextlib.suppress(ImportError):
+        importlib.import_module("openhls.testbench.tb_runner")
+
+    logger.info(f"Imported the compiler in {time.perf_counter() - start:.3f}s")
+
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(socket_path)
+                raise SystemExit(f"ERROR: a server is already listening on {socket_path}")
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+
+    server = CompileServer(socket_path)
+    worker = threading.Thread(
+        target=server.work, args=(compile_mod, (WIDTH_EXPONENT, WIDTH_FRACTION)), daemon=True
+    )
+    worker.start()
+    logger.info(f"Compile server listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        server.jobs.put(None)
+        worker.join()
+
+
+def request(socket_path, msg):
+    # yields the server's replies (a compile job's are its queue position, then its result)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        f = s.makefile("rwb")
+        send_msg(f, msg)
+        while (reply := recv_msg(f)) is not None:
+            yield reply
+
+
+def submit(socket_path, fp, compile_argv):
+    with open(fp) as f:
+        mlir = f.read()
+    widths = [
+        int(os.environ[w]) if os.getenv(w) else None
+        for w in ["WIDTH_EXPONENT", "WIDTH_FRACTION"]
+    ]
+    msg = {"argv": [os.path.abspath(fp)] + compile_argv, "mlir": mlir, "widths": widths}
+    result = None
+    for reply in request(socket_path, msg):
+        if "ahead" in reply:
+            print(f"job {reply['job']} queued ({reply['ahead']} ahead)", file=sys.stderr)
+        else:
+            result = reply
+    print(json.dumps(result, indent=2))
+    return result is not None and result["ok"]
+
+
+def main():
+    parser = argparse.ArgumentParser("OpenHLS compile server")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+    subparsers.add_parser("start", help="Run the server (in the foreground)")
+    submit_parser = subparsers.add_parser(
+        "submit", help="Compile on the server (takes openhls_compiler's arguments)"
+    )
+    submit_parser.add_argument("fp", help="Filepath of top-level MLIR file")
+    submit_parser.add_argument("compile_argv", nargs=argparse.REMAINDER)
+    subparsers.add_parser("status", help="Running and queued jobs and recent jobs' timings")
+    subparsers.add_parser("stop", help="Stop the server (once the queued jobs are done)")
+    args = parser.parse_args()
+
+    if args.cmd == "start":
+        serve(args.socket)
+    elif args.cmd == "submit":
+        sys.exit(0 if submit(args.socket, args.fp, args.compile_argv) else 1)
+    else:
+        for reply in request(args.socket, {"cmd": args.cmd}):
+            print(json.dumps(reply, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import logging
+from collections import Counter
 
-import networkx as nx
-
+from openhls.compiler.op_graph import OpGraph
 from openhls.config import VAL_PREFIX, DTYPE, DEBUG, INCLUDE_AUX_DEPS
 from openhls.util import extend_idx
 
@@ -12,26 +12,35 @@ INPUT_ARG = "INPUT_ARG"
 MEMREF_ARG = "MEMREF_ARG"
 GLOBAL_MEMREF_ARG = "GLOBAL_MEMREF_ARG"
 CONSTANT = "CONSTANT"
+# how non-op sources appear as edge sources in the op graph
+SOURCE_CODES = {INPUT_ARG: -2, MEMREF_ARG: -3, GLOBAL_MEMREF_ARG: -4, CONSTANT: -5}
 
 
 class State:
-    _var_count = 0
-    _op_call_count = 0
-    op_graph = nx.MultiDiGraph()
-    cst_map = {}
-    cst_count = 0
-    _pe_idx = (0,)
-    val_source = {}
-    val_to_pe_idx = {}
-    pe_idx_to_most_recent_op_id = {}
-    op_id_to_pe_idx = {}
-    pe_deps = set()
-
     def __init__(self, output_file):
-        self.op_graph.add_nodes_from(
-            [INPUT_ARG, MEMREF_ARG, GLOBAL_MEMREF_ARG, CONSTANT]
-        )
         self.output_file = output_file
+        self._var_count = 0
+        self._op_call_count = 0
+        self._pe_idx = (0,)
+        self.op_graph = OpGraph()
+        self.val_source = {}
+        self.pe_idx_to_most_recent_op_id = {}
+        self.constants = set()
+        self.already_copied = set()
+        self.fmacs = set()
+        self.known_values = {}
+        self.folded_ops = Counter()
+        # (op type, pe, args) -> res
+        self.cse_table = {}
+        # the keys whose res has been replaced (in cse_table) by a copy of it
+        self.cse_copied = set()
+        self.cse_ops = Counter()
+        # val -> when it's available, ignoring resource constraints (i.e., as soon as possible)
+        self.arrival = {}
+        # each reduction's tree, as (operand, operand) pairs, in the order they were traced;
+        # the golden model replays them (see openhls.flopoco.ops.replay_reduction)
+        self.reductions = []
+        self.n_reductions = 0
 
     def incr_var(self):
         self._var_count += 1
@@ -67,15 +76,15 @@ class State:
         self.val_source[v] = CONSTANT
 
     def add_op_res(self, v, op):
-        self.val_source[v] = op
+        self.val_source[v] = op.op_id
 
     def maybe_add_op(self, op):
-        if op not in self.op_graph.nodes:
+        if op not in self.op_graph:
             self.op_graph.add_node(op)
 
     def add_edge(self, op, arg, out_v):
         val_source = self.get_arg_src(arg)
-        self.op_graph.add_edge(val_source, op, input=arg, output=out_v, id=op.op_id)
+        self.op_graph.add_edge(SOURCE_CODES.get(val_source, val_source), op.op_id)
 
     def update_most_recent_pe_idx(self, pe_idx, op):
         self.pe_idx_to_most_recent_op_id[pe_idx] = op.op_id
@@ -86,7 +95,7 @@ class State:
     def maybe_add_aux_dep(self, pe_idx, op):
         if pe_idx in self.pe_idx_to_most_recent_op_id:
             prev_op_id = self.get_most_recent_op_id(pe_idx)
-            self.pe_deps.add((prev_op_id, op.op_id))
+            self.op_graph.add_aux_edge(prev_op_id, op.op_id)
         self.update_most_recent_pe_idx(pe_idx, op)
 
     def get_arg_src(self, arg):
@@ -102,7 +111,7 @@ class State:
                 if src in {MEMREF_ARG, GLOBAL_MEMREF_ARG}:
                     self.pe_idx = extend_idx(tuple(map(int, val.id.split("_"))))
             else:
-                self.pe_idx = src.pe_idx
+                self.pe_idx = self.op_graph.pe_idx(src)
         else:
             self.pe_idx = pe_idx
 
@@ -126,11 +135,20 @@ class State:
     def pe_idx(self, x):
         self._pe_idx = x
 
-    def map_val_to_pe(self, v, pe_idx):
-        self.val_to_pe_idx[v] = pe_idx
+    def next_reduction(self):
+        # the next traced reduction's tree (None if there isn't one, e.g., pairwise trees)
+        plan = None
+        if self.n_reductions < len(self.reductions):
+            plan = self.reductions[self.n_reductions]
+        self.n_reductions += 1
+        return plan
 
     def get_val_pe(self, v):
-        return self.val_to_pe_idx[v]
+        return self.op_graph.pe_idx(self.val_source[v])
+
+    @property
+    def pe_deps(self):
+        return list(zip(*(deps.tolist() for deps in self.op_graph.aux_edges)))
 
     def swap_output_file(self, new_file):
         old_file = self.output_file
@@ -143,7 +161,7 @@ class State:
 
     @property
     def num_unique_pes(self):
-        return len(set(self.val_to_pe_idx.values()))
+        return self.op_graph.num_unique_pes
 
     def __del__(self):
         self.output_file.close()
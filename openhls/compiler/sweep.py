@@ -0,0 +1,297 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+EXAMPLES_DIR = Path(__file__).parent.parent.parent / "examples"
+STAGES = ["translate", "rewrite", "trace", "schedule", "verilog", "testbench"]
+
+
+@dataclass(frozen=True)
+class DesignPoint:
+    design: str
+    mlir_fp: str
+    width_exponent: int
+    width_fraction: int
+    # rough cost used to start the biggest designs first
+    size: int = 0
+
+    @property
+    def name(self):
+        return f"{self.design}_{self.width_exponent}_{self.width_fraction}"
+
+
+def run_logged(cmd, log_fp, env=None, cwd=None, timeout=None):
+    logger.debug(" ".join(map(str, cmd)))
+    with open(log_fp, "a") as log:
+        log.write(" ".join(map(str, cmd)) + "\n")
+        log.flush()
+        try:
+            p = subprocess.run(
+                list(map(str, cmd)),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                env=env,
+                cwd=cwd,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            log.write(f"timed out after {timeout}s\n")
+            return None
+    return p.returncode
+
+
+def generate_simple_nn(net, size, out_dir):
+    # same layout as examples/simple_nns.py: {out_dir}/{net}_{size}/{net}.mlir
+    log_fp = out_dir / f"{net}_{size}.log"
+    returncode = run_logged(
+        [
+            sys.executable,
+            EXAMPLES_DIR / "simple_nns.py",
+            net,
+            "--size",
+            size,
+            "--out_dir",
+            out_dir,
+        ],
+        log_fp,
+    )
+    if returncode != 0:
+        raise Exception(f"generating {net} {size} failed; see {log_fp}")
+    return out_dir / f"{net}_{size}" / f"{net}.mlir"
+
+
+def compile_point(point: DesignPoint, out_dir, testbench, n_test_vectors, threshold, timeout):
+    # each design point gets its own artifacts dir and its own interpreter (and so its own State and
+    # config, since the widths are read from the environment when openhls.config is imported)
+    point_dir = out_dir / point.name
+    if point_dir.exists():
+        shutil.rmtree(point_dir)
+    os.makedirs(point_dir)
+    mlir_fp = point_dir / Path(point.mlir_fp).name
+    shutil.copy(point.mlir_fp, mlir_fp)
+
+    cmd = [
+        sys.executable,
+        "-m",
+        "openhls.compiler.compile",
+        mlir_fp,
+        "-t",
+        "-r",
+        "-s",
+        "-v",
+    ]
+    if testbench:
+        cmd += ["-b", "-n", n_test_vectors]
+        if threshold is not None:
+            cmd += ["--threshold", threshold]
+    env = dict(
+        os.environ,
+        WIDTH_EXPONENT=str(point.width_exponent),
+        WIDTH_FRACTION=str(point.width_fraction),
+    )
+    start = time.perf_counter()
+    returncode = run_logged(
+        cmd, point_dir / "compile.log", env=env, cwd=point_dir, timeout=timeout
+    )
+    wall_time = time.perf_counter() - start
+    return summarize_point(point, point_dir, returncode, wall_time)
+
+
+def summarize_point(point: DesignPoint, point_dir, returncode, wall_time):
+    row = {"name": point.name, **asdict(point)}
+    row.pop("size")
+    row.update(
+        status="ok" if returncode == 0 else "timeout" if returncode is None else "failed",
+        returncode=returncode,
+        wall_time=round(wall_time, 3),
+        artifacts_dir=str(point_dir),
+    )
+
+    stats_fp = point_dir / f"{Path(point.mlir_fp).stem}.stats.json"
+    if stats_fp.exists():
+        with open(stats_fp) as f:
+            stats = json.load(f)
+        for k in ["fsm_stages", "ii", "n_pes", "n_ops"]:
+            row[k] = stats.get(k)
+        for stage in STAGES:
+            row[f"{stage}_time"] = stats["stage_times"].get(stage)
+
+    tb_results_fp = point_dir / "tb_results.json"
+    if tb_results_fp.exists():
+        with open(tb_results_fp) as f:
+            tb_results = json.load(f)
+        row["tb_n_wrong"] = tb_results["n_wrong"]
+        row["tb_total"] = tb_results["total"]
+        row["tb_pass_rate"] = (
+            1 - tb_results["n_wrong"] / tb_results["total"]
+            if tb_results["total"]
+            else None
+        )
+
+    return row
+
+
+def write_summary(rows, out_dir):
+    rows = sorted(rows, key=lambda r: r["name"])
+    with open(out_dir / "sweep_summary.json", "w") as f:
+        json.dump(rows, f, indent=2)
+
+    fieldnames = []
+    for row in rows:
+        fieldnames += [k for k in row if k not in fieldnames]
+    with open(out_dir / "sweep_summary.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def load_matrix(args):
+    matrix = {}
+    if args.matrix is not None:
+        with open(args.matrix) as f:
+            matrix = json.load(f)
+    nets = args.nets or matrix.get("nets", [])
+    sizes = args.sizes or matrix.get("sizes", [])
+    mlir_fps = args.mlir or matrix.get("mlir", [])
+    widths = args.widths or [tuple(w) for w in matrix.get("widths", [])]
+    if not widths:
+        raise Exception("no widths to sweep over")
+    if not ((nets and sizes) or mlir_fps):
+        raise Exception("nothing to sweep over (need nets and sizes or mlir files)")
+    return nets, sizes, mlir_fps, widths, matrix
+
+
+def sweep(
+    nets,
+    sizes,
+    mlir_fps,
+    widths,
+    out_dir,
+    jobs=None,
+    testbench=True,
+    n_test_vectors=10,
+    threshold=None,
+    timeout=None,
+):
+    out_dir = Path(out_dir).resolve()
+    mlir_dir = out_dir / "mlir"
+    os.makedirs(mlir_dir, exist_ok=True)
+    jobs = jobs or os.cpu_count()
+
+    designs = {
+        Path(fp).stem: (Path(fp).resolve(), os.path.getsize(fp)) for fp in mlir_fps
+    }
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futs = {
+            pool.submit(generate_simple_nn, net, size, mlir_dir): (net, size)
+            for net in nets
+            for size in sizes
+        }
+        for fut in as_completed(futs):
+            net, size = futs[fut]
+            try:
+                fp = fut.result()
+                designs[f"{net}_{size}"] = (fp, os.path.getsize(fp))
+            except Exception as e:
+                logger.error(e)
+
+    points = sorted(
+        [
+            DesignPoint(design, str(fp), we, wf, size)
+            for design, (fp, size) in designs.items()
+            for we, wf in widths
+        ],
+        key=lambda p: -p.size,
+    )
+    logger.info(f"Sweeping {len(points)} design points with {jobs} workers")
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futs = {
+            pool.submit(
+                compile_point,
+                point,
+                out_dir,
+                testbench,
+                n_test_vectors,
+                threshold,
+                timeout,
+            ): point
+            for point in points
+        }
+        for fut in as_completed(futs):
+            row = fut.result()
+            logger.info(f"{row['name']}: {row['status']} in {row['wall_time']}s")
+            rows.append(row)
+            # keep the summary current so a long sweep can be inspected while it runs
+            write_summary(rows, out_dir)
+
+    return rows
+
+
+def parse_widths(s):
+    we, wf = s.split(",")
+    return int(we), int(wf)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser("OpenHLS sweep driver")
+    parser.add_argument("--matrix", help="JSON file with nets, sizes, mlir and widths")
+    parser.add_argument("--nets", nargs="*", help="examples/simple_nns.py nets")
+    parser.add_argument("--sizes", nargs="*", type=int)
+    parser.add_argument("--mlir", nargs="*", help="Already generated MLIR files")
+    parser.add_argument(
+        "--widths",
+        nargs="*",
+        type=parse_widths,
+        help="Width pairs, e.g., 5,4 5,5",
+    )
+    parser.add_argument("-o", "--out_dir", type=Path, default=Path("sweep"))
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Defaults to the number of cores"
+    )
+    parser.add_argument("--no_testbench", default=False, action="store_true")
+    parser.add_argument("-n", "--n_test_vectors", type=int, default=None)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="Per design point, in seconds"
+    )
+    args = parser.parse_args()
+
+    nets, sizes, mlir_fps, widths, matrix = load_matrix(args)
+    rows = sweep(
+        nets,
+        sizes,
+        mlir_fps,
+        widths,
+        args.out_dir,
+        jobs=args.jobs,
+        testbench=not args.no_testbench and matrix.get("testbench", True),
+        n_test_vectors=args.n_test_vectors or matrix.get("n_test_vectors", 10),
+        threshold=args.threshold
+        if args.threshold is not None
+        else matrix.get("threshold"),
+        timeout=args.timeout or matrix.get("timeout"),
+    )
+    n_failed = len([r for r in rows if r["status"] != "ok"])
+    logger.info(
+        f"{len(rows) - n_failed}/{len(rows)} design points ok; summary in {args.out_dir / 'sweep_summary.json'}"
+    )
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,9 @@
 import configparser
 import logging
 import os
-import re
 from pathlib import Path
 
-from openhls import ip_cores
+from openhls.ip_cores import latencies
 
 root_config_path = Path(__file__).parent.parent.resolve() / "openhls_config.ini"
 if os.path.exists(root_config_path):
@@ -29,43 +28,46 @@ WIDTH_FRACTION = int(os.getenv("WIDTH_FRACTION") or config["ip"].get("WidthFract
 
 USING_FLOPOCO = config["ip"].getboolean("UsingFlopoco")
 
+USE_CACHE = config.getboolean("cache", "Enabled", fallback=False)
+CACHE_DIR = os.getenv("OPENHLS_CACHE_DIR") or config.get(
+    "cache", "Dir", fallback=None
+) or str(Path.home() / ".cache" / "openhls")
+CACHE_MAX_SIZE_MB = config.getfloat("cache", "MaxSizeMB", fallback=1024)
+
+FOLD_CONSTANTS = config.getboolean("trace", "FoldConstants", fallback=True)
+CSE = config.getboolean("trace", "CSE", fallback=True)
+REDUCTION_TREE = config.get("trace", "ReductionTree", fallback="arrival")
+
+SCHEDULER = config.get("schedule", "Scheduler", fallback="native")
+SCHEDULE_MODE = config.get("schedule", "Mode", fallback="list")
+II = config.getint("schedule", "II", fallback=0)
+
+FSM_ENCODING = config.get("rtl", "FSMEncoding", fallback="onehot")
+
+SIMULATOR = config.get("testbench", "Simulator", fallback="icarus")
+VERILATOR_THREADS = config.getint("testbench", "VerilatorThreads", fallback=1)
+TB_SHARDS = config.getint("testbench", "Shards", fallback=1)
+WAVES = config.get("testbench", "Waves", fallback="off")
+WAVES_FORMAT = config.get("testbench", "WavesFormat", fallback="fst")
+WAVES_SCOPE = config.get("testbench", "WavesScope", fallback="").split()
+WAVES_MAX_VECTORS = config.getint("testbench", "WavesMaxVectors", fallback=1)
+TB_REFERENCE = config.get("testbench", "Reference", fallback="model")
+
+RESOURCE_LIMITS = {}
+if config.has_section("resources"):
+    RESOURCE_LIMITS = {
+        op: config.getint("resources", op) for op in config.options("resources")
+    }
+
 if USING_FLOPOCO:
-    pipeline_depth_re = re.compile(r"Pipeline depth: (\d+) cycles")
-    with open(
-        Path(ip_cores.__file__).parent
-        / "fmul"
-        / f"flopoco_fmul_{WIDTH_EXPONENT}_{WIDTH_FRACTION}.vhdl"
-    ) as f:
-        depths = pipeline_depth_re.findall(f.read())
-        MUL_PIPELINE_DEPTH = int(depths[-1])
-    with open(
-        Path(ip_cores.__file__).parent
-        / "fadd"
-        / f"flopoco_fadd_{WIDTH_EXPONENT}_{WIDTH_FRACTION}.vhdl"
-    ) as f:
-        depths = pipeline_depth_re.findall(f.read())
-        ADD_PIPELINE_DEPTH = int(depths[-1])
-    with open(
-        Path(ip_cores.__file__).parent
-        / "fsub"
-        / f"flopoco_fsub_{WIDTH_EXPONENT}_{WIDTH_FRACTION}.vhdl"
-    ) as f:
-        depths = pipeline_depth_re.findall(f.read())
-        SUB_PIPELINE_DEPTH = int(depths[-1])
-    with open(
-        Path(ip_cores.__file__).parent
-        / "fdiv"
-        / f"flopoco_fdiv_{WIDTH_EXPONENT}_{WIDTH_FRACTION}.vhdl"
-    ) as f:
-        depths = pipeline_depth_re.findall(f.read())
-        DIV_PIPELINE_DEPTH = int(depths[-1])
-    with open(
-        Path(ip_cores.__file__).parent
-        / "fsqrt"
-        / f"flopoco_fsqrt_{WIDTH_EXPONENT}_{WIDTH_FRACTION}.vhdl"
-    ) as f:
-        depths = pipeline_depth_re.findall(f.read())
-        SQRT_PIPELINE_DEPTH = int(depths[-1])
+    # from the manifest written alongside the cores (see openhls.ip_cores.latencies) rather than
+    # scanning the vhdl on every import
+    pipeline_depths = latencies.pipeline_depths(WIDTH_EXPONENT, WIDTH_FRACTION)
+    MUL_PIPELINE_DEPTH = pipeline_depths["fmul"]
+    ADD_PIPELINE_DEPTH = pipeline_depths["fadd"]
+    SUB_PIPELINE_DEPTH = pipeline_depths["fsub"]
+    DIV_PIPELINE_DEPTH = pipeline_depths["fdiv"]
+    SQRT_PIPELINE_DEPTH = pipeline_depths["fsqrt"]
 
 MUL_LATENCY = MUL_PIPELINE_DEPTH + 1
 DIV_LATENCY = DIV_PIPELINE_DEPTH + 1
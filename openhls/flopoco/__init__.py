@@ -1,6 +1,16 @@
+import importlib
+
 from openhls.flopoco import *
 
-try:
-    from . import flopoco_converter
-except:
-    import flopoco_converter
+
+def __getattr__(name):
+    # the converter (the FPNumber extension) is only needed by the golden model and the
+    # testbench, so it's imported on first use
+    if name == "flopoco_converter":
+        try:
+            flopoco_converter = importlib.import_module(f"{__name__}.flopoco_converter")
+        except ImportError:
+            flopoco_converter = importlib.import_module("flopoco_converter")
+        globals()[name] = flopoco_converter
+        return flopoco_converter
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
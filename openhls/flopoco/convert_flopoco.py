@@ -1,7 +1,4 @@
-try:
-    from . import flopoco_converter
-except:
-    import flopoco_converter
+from openhls import flopoco
 
 
 # def convert_float_to_flopoco_binary_str(f, width_exp, width_frac):
@@ -13,7 +10,7 @@ except:
 def convert_flopoco_binary_str_to_float(s, width_exp, width_frac):
     assert len(s) == width_exp + width_frac + 2 + 1
     return float(
-        flopoco_converter.bin2fp(width_exp, width_frac, s).strip().replace("\x01", "")
+        flopoco.flopoco_converter.bin2fp(width_exp, width_frac, s).strip().replace("\x01", "")
     )
 
 
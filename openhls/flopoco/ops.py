@@ -1,17 +1,14 @@
 import operator
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from dataclasses import dataclass
 from functools import reduce
 
 import numpy as np
 
-try:
-    from . import flopoco_converter
-except:
-    import flopoco_converter
-
+from openhls import flopoco
 from openhls.compiler import state
 from openhls.config import WIDTH_EXPONENT, WIDTH_FRACTION
+from openhls.flopoco.vectorized import FPArray
 from openhls.util import idx_to_str, chunks
 
 FPNUMBER = namedtuple("FPNUMBER", "pe_idx")(None)
@@ -25,20 +22,65 @@ def reducer(accum, val, reduce_op):
         return accum + val
 
 
-def ReduceAdd(vals):
-    pairs = list(chunks(list(vals), 2))
+def reduce_tree(val, reduce_op):
+    # the same pairing as the reducer below, one level at a time across the whole tile
+    while len(val.fp) > 1:
+        n = len(val.fp) // 2 * 2
+        res = reduce_op(val.at(slice(0, n, 2)), val.at(slice(1, n, 2)))
+        val = Val.concatenate([res, val.at(slice(n, None))]) if n < len(val.fp) else res
+    return val.at(0)
+
+
+def reduce_pairwise(vals, reduce_op):
+    if all(v.is_tile for v in vals):
+        return reduce_tree(Val.stack(vals), reduce_op)
+    pairs = list(chunks(vals, 2))
     while len(pairs) > 1:
-        pairs = list(
-            chunks(reduce(lambda x, y: reducer(x, y, operator.add), pairs, []), 2)
+        pairs = list(chunks(reduce(lambda x, y: reducer(x, y, reduce_op), pairs, []), 2))
+    return reduce_op(pairs[0][0], pairs[0][1])
+
+
+def apply_reduction_plan(vals, plan, reduce_op):
+    items = list(vals)
+    if not all(v.is_tile for v in items):
+        for i, j in plan:
+            items.append(reduce_op(items[i], items[j]))
+        return items[-1]
+    # the combines that only depend on earlier levels go across the whole tile at once
+    levels = [0] * len(items)
+    combines = defaultdict(list)
+    for k, (i, j) in enumerate(plan, start=len(items)):
+        levels.append(1 + max(levels[i], levels[j]))
+        combines[levels[-1]].append((k, i, j))
+    items.extend([None] * len(plan))
+    for level in sorted(combines):
+        res = reduce_op(
+            Val.stack([items[i] for _k, i, _j in combines[level]]),
+            Val.stack([items[j] for _k, _i, j in combines[level]]),
+        )
+        for n, (k, _i, _j) in enumerate(combines[level]):
+            items[k] = res.at(n)
+    return items[-1]
+
+
+def replay_reduction(vals, reduce_op, fallback):
+    # the same tree the reduction was traced (and so built in hardware) with
+    plan = state.state.next_reduction() if state.state is not None else None
+    if plan is None:
+        return fallback(vals, reduce_op)
+    if len(plan) != len(vals) - 1:
+        raise ValueError(
+            f"traced reduction of {len(plan) + 1} vals doesn't match the model's {len(vals)}"
         )
-    return pairs[0][0] + pairs[0][1]
+    return apply_reduction_plan(vals, plan, reduce_op)
+
+
+def ReduceAdd(vals):
+    return replay_reduction(list(vals), operator.add, reduce_pairwise)
 
 
 def ReduceMax(vals):
-    pairs = list(chunks(list(vals), 2))
-    while len(pairs) > 1:
-        pairs = list(chunks(reduce(lambda x, y: reducer(x, y, max), pairs, []), 2))
-    return max(pairs[0][0], pairs[0][1])
+    return replay_reduction(list(vals), maximum, reduce_pairwise)
 
 
 def check_make_val(v, width_exponent, width_fraction):
@@ -48,12 +90,36 @@ def check_make_val(v, width_exponent, width_fraction):
     return v
 
 
+def make_fp(ieee, width_exponent, width_fraction):
+    if np.ndim(ieee):
+        return FPArray.from_float(ieee, width_exponent, width_fraction)
+    return flopoco.flopoco_converter.FPNumber(
+        float(ieee), width_exponent, width_fraction
+    )
+
+
+def as_fparray(v):
+    if isinstance(v.fp, FPArray):
+        return v.fp
+    return FPArray.from_fpnumber(v.fp, v.width_exponent, v.width_fraction)
+
+
+def fp_operands(x, y):
+    assert x.width_exponent == y.width_exponent
+    assert x.width_fraction == y.width_fraction
+    # scalars (e.g. weights) meeting tiles get promoted
+    if x.is_tile or y.is_tile:
+        return as_fparray(x), as_fparray(y)
+    return x.fp, y.fp
+
+
 @dataclass(frozen=True)
 class Val:
+    # ieee (and fp) is either a scalar (fp is a FPNumber) or a whole tile (fp is a FPArray)
     ieee: float
     width_exponent: int
     width_fraction: int
-    fp: flopoco_converter.FPNumber = None
+    fp: "flopoco.flopoco_converter.FPNumber" = None
     name: str = None
 
     def __post_init__(self):
@@ -61,11 +127,39 @@ class Val:
             object.__setattr__(
                 self,
                 "fp",
-                flopoco_converter.FPNumber(
-                    self.ieee, self.width_exponent, self.width_fraction
-                ),
+                make_fp(self.ieee, self.width_exponent, self.width_fraction),
             )
-        object.__setattr__(self, "name", str(self))
+        if not self.is_tile:
+            object.__setattr__(self, "name", str(self))
+
+    @property
+    def is_tile(self):
+        return isinstance(self.fp, FPArray)
+
+    @staticmethod
+    def stack(vals):
+        vals = list(vals)
+        return Val(
+            np.stack([v.ieee for v in vals]),
+            vals[0].width_exponent,
+            vals[0].width_fraction,
+            FPArray.stack([as_fparray(v) for v in vals]),
+        )
+
+    @staticmethod
+    def concatenate(vals):
+        return Val(
+            np.concatenate([v.ieee for v in vals]),
+            vals[0].width_exponent,
+            vals[0].width_fraction,
+            FPArray.concatenate([v.fp for v in vals]),
+        )
+
+    def at(self, index):
+        assert self.is_tile
+        return Val(
+            self.ieee[index], self.width_exponent, self.width_fraction, self.fp[index]
+        )
 
     def __mul__(self, other):
         other = check_make_val(other, self.width_exponent, self.width_fraction)
@@ -79,13 +173,13 @@ class Val:
 
     def __eq__(self, other):
         other = check_make_val(other, self.width_exponent, self.width_fraction)
-        return self.fp == other.fp
+        x, y = fp_operands(self, other)
+        return x == y
 
     def __lt__(self, other):
         other = check_make_val(other, self.width_exponent, self.width_fraction)
-        # print(self.fp, other.fp, self.fp - other.fp, (self.fp - other.fp).sign())
-        # print((self.fp - other.fp).sign())
-        return (self.fp - other.fp).sign() == 1
+        x, y = fp_operands(self, other)
+        return (x - y).sign() == 1
 
     def __add__(self, other):
         other = check_make_val(other, self.width_exponent, self.width_fraction)
@@ -103,44 +197,80 @@ class Val:
     def copy(self):
         return self
 
+    def max(self, other):
+        other = check_make_val(other, self.width_exponent, self.width_fraction)
+        return maximum(self, other)
+
+    def sqrt(self):
+        # FPNumber has no sqrt
+        return Val(
+            np.sqrt(self.ieee),
+            self.width_exponent,
+            self.width_fraction,
+            as_fparray(self).sqrt(),
+        )
+
     def relu(self):
+        if self.is_tile:
+            positive = self.fp.sign() == 0
+            return Val(
+                np.where(positive, self.ieee, 0.0),
+                self.width_exponent,
+                self.width_fraction,
+                self.fp.relu(),
+            )
         if self.fp.sign() == 0:
             return self
         else:
             return Val(0, self.width_exponent, self.width_fraction)
 
     def __repr__(self):
+        if self.is_tile:
+            return str(
+                f"<IEEE {self.ieee}> {self.fp} {self.width_exponent} {self.width_fraction}"
+            )
         return str(
             f"<IEEE {self.ieee:.5e}> {self.fp} {self.width_exponent} {self.width_fraction}"
         )
 
     @property
     def fp_float(self):
+        if self.is_tile:
+            return self.fp.to_float()
         return float(f"{str(self.fp).split(':')[0].split(' ')[1]}")
 
 
 def mul(x: Val, y: Val):
-    assert x.width_exponent == y.width_exponent
-    assert x.width_fraction == y.width_fraction
-    return Val(x.ieee * y.ieee, x.width_exponent, x.width_fraction, x.fp * y.fp)
+    x_fp, y_fp = fp_operands(x, y)
+    return Val(x.ieee * y.ieee, x.width_exponent, x.width_fraction, x_fp * y_fp)
 
 
 def div(x: Val, y: Val):
-    assert x.width_exponent == y.width_exponent
-    assert x.width_fraction == y.width_fraction
-    return Val(x.ieee / y.ieee, x.width_exponent, x.width_fraction, x.fp / y.fp)
+    x_fp, y_fp = fp_operands(x, y)
+    return Val(x.ieee / y.ieee, x.width_exponent, x.width_fraction, x_fp / y_fp)
 
 
 def add(x: Val, y: Val):
-    assert x.width_exponent == y.width_exponent
-    assert x.width_fraction == y.width_fraction
-    return Val(x.ieee + y.ieee, x.width_exponent, x.width_fraction, x.fp + y.fp)
+    x_fp, y_fp = fp_operands(x, y)
+    return Val(x.ieee + y.ieee, x.width_exponent, x.width_fraction, x_fp + y_fp)
 
 
 def sub(x: Val, y: Val):
-    assert x.width_exponent == y.width_exponent
-    assert x.width_fraction == y.width_fraction
-    return Val(x.ieee - y.ieee, x.width_exponent, x.width_fraction, x.fp - y.fp)
+    x_fp, y_fp = fp_operands(x, y)
+    return Val(x.ieee - y.ieee, x.width_exponent, x.width_fraction, x_fp - y_fp)
+
+
+def maximum(x: Val, y: Val):
+    lt = x < y
+    if not (x.is_tile or y.is_tile):
+        return y if lt else x
+    x_fp, y_fp = fp_operands(x, y)
+    return Val(
+        np.where(lt, y.ieee, x.ieee),
+        x.width_exponent,
+        x.width_fraction,
+        FPArray.where(lt, y_fp, x_fp),
+    )
 
 
 class MemRef:
@@ -212,10 +342,18 @@ class MemRef:
     def from_memref(memref, width_exponent, width_fraction, vals: np.ndarray = None):
         registers = None
         if vals is not None:
-            assert vals.shape == memref.shape
+            # with a leading batch axis every register holds the whole batch
+            batched = vals.ndim == len(memref.shape) + 1
+            assert vals.shape[int(batched) :] == memref.shape
             registers = np.empty(memref.shape, dtype=object)
-            for idx, x in np.ndenumerate(vals):
-                v = Val(x, width_exponent, width_fraction)
+            if batched:
+                vals = np.moveaxis(vals, 0, -1)
+                fps = FPArray.from_float(vals, width_exponent, width_fraction)
+            for idx in np.ndindex(*memref.shape):
+                if batched:
+                    v = Val(vals[idx], width_exponent, width_fraction, fps[idx])
+                else:
+                    v = Val(vals[idx], width_exponent, width_fraction)
                 try:
                     state.state.add_val_source(v, FPNUMBER)
                 except:
@@ -227,6 +365,8 @@ class MemRef:
             input=memref.input,
             output=memref.output,
             registers=registers,
+            width_exponent=width_exponent,
+            width_fraction=width_fraction,
         )
 
     def __repr__(self):
@@ -334,8 +474,8 @@ def main():
     print(a - a)
     print(a, b)
     print(a - b)
-    a = flopoco_converter.FPNumber(2, 4, 4)
-    b = flopoco_converter.FPNumber(1, 4, 4)
+    a = flopoco.flopoco_converter.FPNumber(2, 4, 4)
+    b = flopoco.flopoco_converter.FPNumber(1, 4, 4)
     print(a + a)
     print(a - a)
     print(a - b)
@@ -0,0 +1,380 @@
+import math
+
+import numpy as np
+
+# FloPoCo exception field
+ZERO, NORMAL, INF, NAN = 0, 1, 2, 3
+
+
+def int_dtype(width_fraction):
+    # the widest intermediate is the sqrt radicand (~2 * wF + 8 bits);
+    # past int64 fall back to python ints in object arrays
+    return np.int64 if 2 * width_fraction + 8 < 63 else object
+
+
+_py_bit_length = np.frompyfunc(int.bit_length, 1, 1)
+_py_isqrt = np.frompyfunc(math.isqrt, 1, 1)
+
+
+def bit_length(m):
+    if m.dtype == object:
+        return _py_bit_length(m).astype(np.int64)
+    _, n = np.frexp(m.astype(np.float64))
+    n = n.astype(np.int64)
+    # the float conversion can round up to the next power of two
+    return np.where((n > 0) & ((m >> np.maximum(n - 1, 0)) == 0), n - 1, n)
+
+
+def isqrt(n):
+    if n.dtype == object:
+        return _py_isqrt(n)
+    r = np.sqrt(n.astype(np.float64)).astype(np.int64)
+    for _ in range(2):
+        r = np.where(r * r > n, r - 1, r)
+        r = np.where((r + 1) * (r + 1) <= n, r + 1, r)
+    return r
+
+
+def round_nearest_even(m, e, p, sticky=False):
+    """Round (m + sticky) * 2**e to p significant bits; sticky means there's
+    a nonzero remainder below the lsb of m. Returns (q, e) with
+    2**(p-1) <= q < 2**p (or q == 0 when m == 0)."""
+    dtype = m.dtype
+    shift = bit_length(m) - p
+    right = np.maximum(shift, 0).astype(dtype)
+    left = np.maximum(-shift, 0).astype(dtype)
+    q = m >> right
+    rem = m - (q << right)
+    half = (np.ones_like(m) << right) >> 1
+    up = (shift > 0) & ((rem > half) | ((rem == half) & (((q & 1) == 1) | sticky)))
+    q = q + up.astype(dtype)
+    carry = q >> p > 0
+    q = np.where(carry, q >> 1, q)
+    return q << left, e + shift + carry
+
+
+class FPArray:
+    """Arrays of FloPoCo floating point numbers, bit-exact with
+    flopoco_converter.FPNumber (MPFR round to nearest even, no subnormals).
+
+    Stored packed, i.e., exception(2) | sign(1) | exponent(wE) | fraction(wF)."""
+
+    __array_priority__ = 1000
+
+    def __init__(self, bits, width_exponent, width_fraction):
+        self.width_exponent = width_exponent
+        self.width_fraction = width_fraction
+        self.dtype = int_dtype(width_fraction)
+        self.bits = np.asarray(bits, dtype=self.dtype)
+
+    @property
+    def bias(self):
+        return (1 << (self.width_exponent - 1)) - 1
+
+    @property
+    def shape(self):
+        return self.bits.shape
+
+    @property
+    def ndim(self):
+        return self.bits.ndim
+
+    def __len__(self):
+        return len(self.bits)
+
+    def __getitem__(self, index):
+        return FPArray(self.bits[index], self.width_exponent, self.width_fraction)
+
+    def reshape(self, *shape):
+        return FPArray(
+            self.bits.reshape(*shape), self.width_exponent, self.width_fraction
+        )
+
+    @staticmethod
+    def stack(fps, axis=0):
+        fps = list(fps)
+        we, wf = fps[0].width_exponent, fps[0].width_fraction
+        assert all(fp.width_exponent == we and fp.width_fraction == wf for fp in fps)
+        return FPArray(np.stack([fp.bits for fp in fps], axis=axis), we, wf)
+
+    @staticmethod
+    def concatenate(fps, axis=0):
+        fps = list(fps)
+        we, wf = fps[0].width_exponent, fps[0].width_fraction
+        return FPArray(np.concatenate([fp.bits for fp in fps], axis=axis), we, wf)
+
+    def unpack(self):
+        we, wf = self.width_exponent, self.width_fraction
+        b = self.bits
+        frac = b & ((1 << wf) - 1)
+        exp = ((b >> wf) & ((1 << we) - 1)).astype(np.int64)
+        sign = ((b >> (we + wf)) & 1).astype(np.int64)
+        exc = ((b >> (we + wf + 1)) & 3).astype(np.int64)
+        return exc, sign, exp, frac
+
+    @classmethod
+    def pack(cls, exc, sign, exp, frac, width_exponent, width_fraction):
+        dtype = int_dtype(width_fraction)
+        top = (np.asarray(exc) * 2 + np.asarray(sign)).astype(dtype)
+        exp = np.asarray(exp).astype(dtype)
+        bits = (top << (width_exponent + width_fraction)) | (exp << width_fraction)
+        return cls(bits | np.asarray(frac).astype(dtype), width_exponent, width_fraction)
+
+    def significand(self):
+        # normal numbers as m * 2**e with m < 2**(wF + 1)
+        exc, sign, exp, frac = self.unpack()
+        m = frac | (1 << self.width_fraction)
+        e = exp - self.bias - self.width_fraction
+        return exc, sign, m, e
+
+    @classmethod
+    def from_exact(
+        cls, sign, m, e, width_exponent, width_fraction, sticky=False, precision=None
+    ):
+        """What FPNumber(wE, wF, mpfr_t) makes of the mpfr result (-1)**sign * m * 2**e
+        rounded to precision bits (1 + wF, same as FPNumber's arithmetic, by default)."""
+        if precision is None:
+            precision = width_fraction + 1
+        q, e = round_nearest_even(m, e, precision, sticky)
+        biased = e + precision - 1 + ((1 << (width_exponent - 1)) - 1)
+        exc = np.where(
+            (m == 0) | (biased < 0),
+            ZERO,
+            np.where(biased >= (1 << width_exponent), INF, NORMAL),
+        )
+        normal = exc == NORMAL
+        frac = (q << (width_fraction + 1 - precision)) - (1 << width_fraction)
+        return cls.pack(
+            exc,
+            sign,
+            np.where(normal, biased, 0),
+            np.where(normal, frac, 0),
+            width_exponent,
+            width_fraction,
+        )
+
+    @classmethod
+    def from_float(cls, x, width_exponent, width_fraction):
+        # FPNumber(double, wE, wF) rounds to wF (not 1 + wF) bits first
+        x = np.asarray(x, dtype=np.float64)
+        dtype = int_dtype(width_fraction)
+        nan = np.isnan(x)
+        inf = np.isinf(x)
+        zero = x == 0
+        sign = np.signbit(x).astype(np.int64)
+        f, e = np.frexp(np.where(nan | inf | zero, 1.0, np.abs(x)))
+        m = np.ldexp(f, 53).astype(np.int64).astype(dtype)
+        fp = cls.from_exact(
+            sign,
+            m,
+            e.astype(np.int64) - 53,
+            width_exponent,
+            width_fraction,
+            precision=max(width_fraction, 1),
+        )
+        return fp.where_special(
+            [nan, inf, zero], [NAN, INF, ZERO], [np.zeros_like(sign), sign, sign]
+        )
+
+    @classmethod
+    def from_fpnumber(cls, fp, width_exponent, width_fraction):
+        # binstr drops the sign of zeros, which FPNumber.sign still has
+        bits = int(fp.binstr(), 2)
+        if bits >> (width_exponent + width_fraction + 1) == ZERO:
+            bits |= fp.sign() << (width_exponent + width_fraction)
+        return cls(bits, width_exponent, width_fraction)
+
+    @classmethod
+    def full(cls, shape, x, width_exponent, width_fraction):
+        return cls.from_float(np.full(shape, x, dtype=np.float64), width_exponent, width_fraction)
+
+    def where_special(self, masks, excs, signs):
+        # overwrite elements with special values (exponent and fraction are zeroed, as FPNumber does)
+        exc, sign, exp, frac = self.unpack()
+        for mask, e, s in zip(masks, excs, signs):
+            exc = np.where(mask, e, exc)
+            sign = np.where(mask, s, sign)
+            exp = np.where(mask, 0, exp)
+            frac = np.where(mask, 0, frac)
+        return FPArray.pack(
+            exc, sign, exp, frac, self.width_exponent, self.width_fraction
+        )
+
+    def check_widths(self, other):
+        if not isinstance(other, FPArray):
+            other = FPArray.from_float(other, self.width_exponent, self.width_fraction)
+        assert self.width_exponent == other.width_exponent
+        assert self.width_fraction == other.width_fraction
+        return other
+
+    def _add(self, other, negate_other):
+        we, wf = self.width_exponent, self.width_fraction
+        ex_x, sx, mx, ex = self.significand()
+        ex_y, sy, my, ey = other.significand()
+        if negate_other:
+            sy = 1 - sy
+        mx, my = np.broadcast_arrays(mx, my)
+        ex, ey, ex_x, ex_y, sx, sy = np.broadcast_arrays(ex, ey, ex_x, ex_y, sx, sy)
+
+        # align the smaller operand to the larger one, keeping enough guard bits that the
+        # bits shifted out only matter as a sticky bit
+        swap = ey > ex
+        ma, mb = np.where(swap, my, mx), np.where(swap, mx, my)
+        ea, eb = np.where(swap, ey, ex), np.where(swap, ex, ey)
+        sa, sb = np.where(swap, sy, sx), np.where(swap, sx, sy)
+        guard = wf + 4
+        d = np.minimum(ea - eb, wf + guard + 2).astype(self.dtype)
+        ma = ma << guard
+        mb_full = mb << guard
+        mb = mb_full >> d
+        mb = mb | ((mb << d) != mb_full).astype(self.dtype)
+        s = np.where(sa == 1, -ma, ma) + np.where(sb == 1, -mb, mb)
+        # an exact zero is +0 under round to nearest unless both operands are negative
+        sign = np.where(s == 0, sa & sb, (s < 0).astype(np.int64))
+        res = FPArray.from_exact(sign, np.abs(s), ea - guard, we, wf)
+
+        x_zero, y_zero = ex_x == ZERO, ex_y == ZERO
+        x_inf, y_inf = ex_x == INF, ex_y == INF
+        res = FPArray.where(y_zero & (ex_x == NORMAL), self, res)
+        y = FPArray.pack(ex_y, sy, *other.unpack()[2:], we, wf)
+        res = FPArray.where(x_zero & (ex_y == NORMAL), y, res)
+        return res.where_special(
+            [
+                x_zero & y_zero,
+                x_inf & ~y_inf,
+                y_inf & ~x_inf,
+                x_inf & y_inf,
+                (x_inf & y_inf & (sx != sy)) | (ex_x == NAN) | (ex_y == NAN),
+            ],
+            [ZERO, INF, INF, INF, NAN],
+            [sx & sy, sx, sy, sx, 0],
+        )
+
+    def __add__(self, other):
+        return self._add(self.check_widths(other), negate_other=False)
+
+    def __sub__(self, other):
+        return self._add(self.check_widths(other), negate_other=True)
+
+    def __mul__(self, other):
+        other = self.check_widths(other)
+        we, wf = self.width_exponent, self.width_fraction
+        ex_x, sx, mx, ex = self.significand()
+        ex_y, sy, my, ey = other.significand()
+        sign = sx ^ sy
+        res = FPArray.from_exact(sign, mx * my, ex + ey, we, wf)
+        zero = (ex_x == ZERO) | (ex_y == ZERO)
+        inf = (ex_x == INF) | (ex_y == INF)
+        return res.where_special(
+            [zero, inf, (zero & inf) | (ex_x == NAN) | (ex_y == NAN)],
+            [ZERO, INF, NAN],
+            [sign, sign, 0],
+        )
+
+    def __truediv__(self, other):
+        other = self.check_widths(other)
+        we, wf = self.width_exponent, self.width_fraction
+        ex_x, sx, mx, ex = self.significand()
+        ex_y, sy, my, ey = other.significand()
+        sign = sx ^ sy
+        # mx / my > 1/2 so the quotient has at least wF + 3 bits (i.e., a guard bit and a sticky bit)
+        shift = wf + 3
+        n = mx << shift
+        q = n // my
+        res = FPArray.from_exact(sign, q, ex - ey - shift, we, wf, sticky=(q * my) != n)
+        x_zero, y_zero = ex_x == ZERO, ex_y == ZERO
+        x_inf, y_inf = ex_x == INF, ex_y == INF
+        return res.where_special(
+            [
+                x_zero | y_inf,
+                x_inf | y_zero,
+                (x_zero & y_zero) | (x_inf & y_inf) | (ex_x == NAN) | (ex_y == NAN),
+            ],
+            [ZERO, INF, NAN],
+            [sign, sign, 0],
+        )
+
+    def __neg__(self):
+        exc, sign, exp, frac = self.unpack()
+        return FPArray.pack(
+            exc, 1 - sign, exp, frac, self.width_exponent, self.width_fraction
+        )
+
+    def sqrt(self):
+        we, wf = self.width_exponent, self.width_fraction
+        exc, sign, m, e = self.significand()
+        odd = (e & 1) == 1
+        m = np.where(odd, m << 1, m)
+        e = np.where(odd, e - 1, e)
+        # enough bits that the root has wF + 3 bits
+        shift = wf // 2 + 3
+        n = m << (2 * shift)
+        r = isqrt(n)
+        res = FPArray.from_exact(
+            np.zeros_like(sign), r, e // 2 - shift, we, wf, sticky=(r * r) != n
+        )
+        return res.where_special(
+            [exc == ZERO, exc == INF, (exc == NAN) | ((sign == 1) & (exc != ZERO))],
+            [ZERO, INF, NAN],
+            [sign, sign, 0],
+        )
+
+    def sign(self):
+        return self.unpack()[1]
+
+    def __lt__(self, other):
+        # flopoco.ops.Val.__lt__
+        return (self - self.check_widths(other)).sign() == 1
+
+    def __eq__(self, other):
+        # flopoco_converter.FPNumber.__eq__ (the difference has zero exponent and fraction)
+        _, _, exp, frac = (self - self.check_widths(other)).unpack()
+        return (exp == 0) & (frac == 0)
+
+    __hash__ = object.__hash__
+
+    @staticmethod
+    def where(cond, x, y):
+        y = x.check_widths(y)
+        return FPArray(
+            np.where(cond, x.bits, y.bits), x.width_exponent, x.width_fraction
+        )
+
+    def maximum(self, other):
+        # max(self, other) as python does it, i.e., through Val.__lt__
+        return FPArray.where(self < other, other, self)
+
+    def relu(self):
+        return FPArray.where(self.sign() == 0, self, 0.0)
+
+    def canonical_bits(self):
+        # what fp2binstr prints: zeros are always positive, NaNs have no sign
+        we, wf = self.width_exponent, self.width_fraction
+        exc, sign, exp, frac = self.unpack()
+        return FPArray.pack(
+            exc,
+            np.where((exc == ZERO) | (exc == NAN), 0, sign),
+            np.where(exc == NORMAL, exp, 0),
+            np.where(exc == NORMAL, frac, 0),
+            we,
+            wf,
+        ).bits
+
+    def binstr(self):
+        width = self.width_exponent + self.width_fraction + 3
+        strs = np.frompyfunc(lambda b: format(int(b), f"0{width}b"), 1, 1)(
+            self.canonical_bits()
+        )
+        return strs if self.ndim else str(strs)
+
+    def to_float(self):
+        exc, sign, m, e = self.significand()
+        x = np.ldexp(m.astype(np.float64), e)
+        x = np.where(exc == ZERO, 0.0, np.where(exc == INF, np.inf, x))
+        x = np.where(exc == NAN, np.nan, np.where(sign == 1, -x, x))
+        return x if self.ndim else float(x)
+
+    def __repr__(self):
+        if self.ndim:
+            return f"<FPArray {self.shape} {self.width_exponent} {self.width_fraction}>"
+        return f"<FPNumber {self.to_float()!r}:{self.binstr()}>"
@@ -0,0 +1,70 @@
+import argparse
+import json
+import re
+from pathlib import Path
+
+IP_CORES_DIR = Path(__file__).parent.resolve()
+MANIFEST_FP = IP_CORES_DIR / "latencies.json"
+PIPELINED_OPS = ["fmul", "fadd", "fsub", "fdiv", "fsqrt"]
+
+pipeline_depth_re = re.compile(r"Pipeline depth: (\d+) cycles")
+
+
+def vhdl_fp(op, width_exponent, width_fraction):
+    return IP_CORES_DIR / op / f"flopoco_{op}_{width_exponent}_{width_fraction}.vhdl"
+
+
+def scan_pipeline_depth(op, width_exponent, width_fraction):
+    # the last one reported is the top-level operator's (the sub-components' come first)
+    with open(vhdl_fp(op, width_exponent, width_fraction)) as f:
+        depths = pipeline_depth_re.findall(f.read())
+    return int(depths[-1])
+
+
+def read_manifest():
+    if not MANIFEST_FP.exists():
+        return {}
+    with open(MANIFEST_FP) as f:
+        return json.load(f)
+
+
+def pipeline_depths(width_exponent, width_fraction):
+    # pipeline depths from the manifest, falling back to scanning the cores for widths (or ops)
+    # that were generated after the manifest was last written
+    depths = read_manifest().get(f"{width_exponent}_{width_fraction}", {})
+    return {
+        op: depths[op]
+        if op in depths
+        else scan_pipeline_depth(op, width_exponent, width_fraction)
+        for op in PIPELINED_OPS
+    }
+
+
+def write_manifest():
+    manifest = {}
+    for op in PIPELINED_OPS:
+        for fp in sorted((IP_CORES_DIR / op).glob(f"flopoco_{op}_*_*.vhdl")):
+            width_exponent, width_fraction = fp.stem.split("_")[-2:]
+            manifest.setdefault(f"{width_exponent}_{width_fraction}", {})[
+                op
+            ] = scan_pipeline_depth(op, width_exponent, width_fraction)
+    manifest = dict(
+        sorted(manifest.items(), key=lambda kv: tuple(map(int, kv[0].split("_"))))
+    )
+    with open(MANIFEST_FP, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "Write the FloPoCo cores' pipeline depths (per width) to latencies.json"
+    )
+    parser.parse_args()
+    manifest = write_manifest()
+    print(f"Wrote {len(manifest)} widths to {MANIFEST_FP}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import operator
+from collections import defaultdict
+
+import numpy as np
+
+from openhls.compiler.runner import (
+    get_default_args,
+    get_py_module_args_globals,
+    make_fp_args,
+)
+from openhls.flopoco.ops import Val
+from openhls.flopoco.vectorized import FPArray, int_dtype
+from openhls.ir.ops import OpType
+from openhls.ir.parse import parse_mlir_module
+from openhls.util import idx_to_str
+
+FLOPOCO_OPS = {
+    OpType.ADD: operator.add,
+    OpType.SUB: operator.sub,
+    OpType.MUL: operator.mul,
+    OpType.DIV: operator.truediv,
+    OpType.MAX: FPArray.maximum,
+    OpType.NEG: operator.neg,
+    OpType.RELU: FPArray.relu,
+    OpType.SQRT: FPArray.sqrt,
+    OpType.COPY: lambda x: x,
+}
+
+IEEE_OPS = {
+    OpType.ADD: operator.add,
+    OpType.SUB: operator.sub,
+    OpType.MUL: operator.mul,
+    OpType.DIV: operator.truediv,
+    # same as flopoco.ops.maximum, i.e., through <
+    OpType.MAX: lambda x, y: np.where(x < y, y, x),
+    OpType.NEG: operator.neg,
+    OpType.RELU: lambda x: np.where(np.signbit(x), np.float32(0), x),
+    OpType.SQRT: np.sqrt,
+    OpType.COPY: lambda x: x,
+}
+
+
+def fmac(ops, init, *args):
+    # same order as the fmac ips (and FMAC.__call__): acc = a * b + acc
+    acc = init
+    for a, b in zip(args[::2], args[1::2]):
+        acc = ops[OpType.MUL](a, b) + acc
+    return acc
+
+
+class Evaluator:
+    # evaluates a (parsed) module's ops for many input vectors at once: the ops are levelized once
+    # (an op's level is one more than its args') and each level's ops of the same kind are one
+    # vectorized op over a (n ops, n vectors) array
+    def __init__(self, op_id_data, func_args, returns, csts):
+        self.func_args = list(func_args)
+        self.returns = list(returns)
+        self.csts = dict(csts)
+        val_idxs = {v: i for i, v in enumerate(self.func_args + list(self.csts))}
+        levels = defaultdict(int)
+        batches = defaultdict(list)
+        for op in op_id_data.values():
+            if op.type == OpType.CST:
+                continue
+            if op.type not in FLOPOCO_OPS and op.type != OpType.FMAC:
+                raise NotImplementedError(f"can't evaluate {op}")
+            for arg in op.args:
+                if arg not in val_idxs:
+                    raise KeyError(f"{op} uses {arg} before it's defined")
+            level = 1 + max((levels[arg] for arg in op.args), default=0)
+            levels[op.res] = level
+            val_idxs[op.res] = len(val_idxs)
+            batches[level, op.type, len(op.args)].append(
+                [val_idxs[op.res]] + [val_idxs[arg] for arg in op.args]
+            )
+        self.val_idxs = val_idxs
+        self.n_levels = max(levels.values(), default=0)
+        self.batches = [
+            (op_type, np.array(idxs, dtype=np.int64))
+            for (_level, op_type, _n_args), idxs in sorted(
+                batches.items(), key=lambda b: (b[0][0], b[0][1].value, b[0][2])
+            )
+        ]
+
+    def run(self, inputs, width_exponent=None, width_fraction=None):
+        # inputs are the func args' values, scalars or (n vectors,) arrays; the returns' values are
+        # float32 arrays or, given widths, FPArrays (bit accurate flopoco arithmetic)
+        missing = [v for v in self.func_args if v not in inputs]
+        if missing:
+            raise KeyError(f"no values for {missing[:10]}")
+        n_vectors = max((np.size(inputs[v]) for v in self.func_args), default=1)
+        init = np.empty((len(self.func_args) + len(self.csts), n_vectors))
+        init[: len(self.func_args)] = [
+            np.broadcast_to(inputs[v], (n_vectors,)) for v in self.func_args
+        ]
+        init[len(self.func_args) :] = np.array(list(self.csts.values()))[:, None]
+
+        flopoco = width_exponent is not None
+        if flopoco:
+            values = np.empty(
+                (len(self.val_idxs), n_vectors), dtype=int_dtype(width_fraction)
+            )
+            values[: len(init)] = FPArray.from_float(
+                init, width_exponent, width_fraction
+            ).bits
+            wrap = lambda bits: FPArray(bits, width_exponent, width_fraction)
+            unwrap = lambda fp: fp.bits
+            ops = FLOPOCO_OPS
+        else:
+            values = np.empty((len(self.val_idxs), n_vectors), dtype=np.float32)
+            values[: len(init)] = init
+            wrap = unwrap = lambda x: x
+            ops = IEEE_OPS
+
+        with np.errstate(all="ignore"):
+            for op_type, idxs in self.batches:
+                args = [wrap(values[idxs[:, i]]) for i in range(1, idxs.shape[1])]
+                if op_type == OpType.FMAC:
+                    res = fmac(ops, *args)
+                else:
+                    res = ops[op_type](*args)
+                values[idxs[:, 0]] = unwrap(res)
+
+        return {v: wrap(values[self.val_idxs[v]]) for v in self.returns}
+
+
+def module_inputs(mod, test_inputs):
+    # the func args' values for a rewritten module's forward and its inputs stacked along a leading
+    # (vector) axis, e.g., make_test_vectors'
+    args = get_default_args(mod.forward)
+    input_memrefs, globals, _outputs = get_py_module_args_globals(args)
+    inputs = {}
+    for name, memref in input_memrefs.items():
+        vecs = np.moveaxis(np.asarray(test_inputs[name]), 0, -1)
+        for idx in np.ndindex(*memref.shape):
+            inputs[f"%{memref.arr_name}_{idx_to_str(idx)}"] = vecs[idx]
+    for glob in globals.values():
+        for idx, v in np.ndenumerate(glob.global_array):
+            inputs[f"%{glob.name}_{idx_to_str(idx)}"] = v
+    return inputs
+
+
+def module_outputs(results, output_map):
+    # {output memref: {index: value}} from the returns' values
+    outputs = defaultdict(dict)
+    for v, (arr_name, idx) in output_map.items():
+        outputs[arr_name][idx] = results[v]
+    return dict(outputs)
+
+
+def evaluate_test_vectors(mod, test_inputs, mlir_fp, width_exponent, width_fraction):
+    # make_test_vectors' (fp args, fp outputs), i.e., what run_model_with_fp_number returns, with
+    # the outputs' registers holding the evaluated (traced) ops' results
+    with open(mlir_fp) as f:
+        op_id_data, func_args, returns, output_map, _, _, csts, _ = parse_mlir_module(f)
+    results = Evaluator(op_id_data, func_args, returns, csts).run(
+        module_inputs(mod, test_inputs), width_exponent, width_fraction
+    )
+    test_args, outputs = make_fp_args(
+        mod, test_inputs, width_exponent, width_fraction
+    )
+    for v, (arr_name, idx) in output_map.items():
+        fp = results[v]
+        outputs[arr_name].registers[idx] = Val(
+            fp.to_float(), width_exponent, width_fraction, fp
+        )
+    return test_args, outputs
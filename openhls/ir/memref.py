@@ -5,7 +5,8 @@ from typing import Tuple
 import numpy as np
 
 from openhls.compiler import state
-from openhls.ir.ops import Val, make_constant, ReduceAdd, ReduceMax
+from openhls.config import FOLD_CONSTANTS
+from openhls.ir.ops import Val, make_constant, ReduceAdd, ReduceMax, flopoco_zeros
 from openhls.util import idx_to_str
 
 MemRefIndex = Tuple[int, ...]
@@ -23,16 +24,49 @@ class MemRefVal(Val):
         return f"%{self.name}_{self.id}"
 
 
+def make_memref_vals(vals, name, add_arg, index=None):
+    # materialize (in place) the vals at index, or all of them
+    if index is None:
+        for idx in zip(*np.nonzero(np.equal(vals, None))):
+            make_memref_vals(vals, name, add_arg, tuple(map(int, idx)))
+        return vals
+    v = vals[index]
+    if isinstance(v, np.ndarray):
+        return make_memref_vals(vals, name, add_arg)[index]
+    if v is None:
+        # names are computed from the (non-negative) index, i.e., they match the signature
+        index = tuple(int(i) % s for i, s in zip(index, vals.shape))
+        v = MemRefVal(name, index)
+        add_arg(v, index)
+        vals[index] = v
+    return v
+
+
 class MemRef:
     def __init__(self, name, *shape, input=False, output=False):
         self.arr_name = name
         self.shape = shape
-        self.registers = np.empty(shape, dtype=object)
+        # input vals are only made when they're first used
+        self._registers = np.empty(shape, dtype=object)
         self.input = input
         self.output = output
+
+    @property
+    def registers(self):
         if self.input:
-            for idx, v in np.ndenumerate(self.registers):
-                self[idx]
+            make_memref_vals(self._registers, self.arr_name, self.add_arg)
+        return self._registers
+
+    @registers.setter
+    def registers(self, registers):
+        self._registers = registers
+
+    @staticmethod
+    def add_arg(v, _index):
+        state.state.add_memref_arg(v)
+
+    def materialized_vals(self):
+        return (v for v in self._registers.flat if v is not None)
 
     def __setitem__(self, index, value):
         assert not self.input
@@ -45,14 +79,13 @@ class MemRef:
             self.registers[idx] = make_constant(0.0)
 
     def __getitem__(self, index: MemRefIndex):
-        if self.registers[index] is None:
-            assert self.input
-            v = MemRefVal(self.arr_name, index)
-            state.state.add_memref_arg(v)
-            self.registers[index] = v
-
-        v = self.registers[index]
-        return v
+        if self.input:
+            if isinstance(index, int):
+                index = (index,)
+            return make_memref_vals(
+                self._registers, self.arr_name, self.add_arg, index
+            )
+        return self.registers[index]
 
     def reshape(self, *shape):
         self.registers = self.registers.reshape(shape)
@@ -61,16 +94,12 @@ class MemRef:
     @property
     def val_names_map(self):
         assert self.input or self.output
-        val_names = {}
         if self.input:
             for idx in np.ndindex(*self.shape):
-                val_names[idx] = f"%{self.arr_name}_{idx_to_str(idx)}"
+                yield idx, f"%{self.arr_name}_{idx_to_str(idx)}"
         elif self.output:
             assert len(self.registers)
-            for idx, val in np.ndenumerate(self.registers):
-                val_names[idx] = val
-
-        return val_names
+            yield from np.ndenumerate(self.registers)
 
     @property
     def numel(self):
@@ -101,24 +130,38 @@ class GlobalMemRef:
         self.name = global_name
         self.global_array = global_array
         self.shape = global_array.shape
-        self.vals = np.empty(self.shape, dtype=object)
-        for idx, v in np.ndenumerate(global_array):
-            v = MemRefVal(f"{self.name}", idx)
-            state.state.add_global_memref_arg(v)
-            self.vals[idx] = v
+        # weights that are never used (e.g. pruned) never get vals
+        self._vals = np.empty(self.shape, dtype=object)
+        self._zeros = None
 
     @property
-    def val_names_map(self):
-        val_names = {}
-        for idx, val in np.ndenumerate(self.vals):
-            val_names[idx] = val
+    def zeros(self):
+        # the weights that are zero once they're flopoco numbers
+        if self._zeros is None:
+            self._zeros = flopoco_zeros(self.global_array)
+        return self._zeros
+
+    def add_arg(self, v, index):
+        state.state.add_global_memref_arg(v)
+        if FOLD_CONSTANTS and self.zeros[index]:
+            state.state.known_values[v] = 0.0
+
+    @property
+    def vals(self):
+        return make_memref_vals(self._vals, self.name, self.add_arg)
 
-        return val_names
+    def materialized_vals(self):
+        return (v for v in self._vals.flat if v is not None)
+
+    @property
+    def val_names_map(self):
+        for idx in np.ndindex(*self.shape):
+            yield idx, f"%{self.name}_{idx_to_str(idx)}"
 
     def __getitem__(self, index: MemRefIndex):
         if isinstance(index, int):
             index = (index,)
-        return self.vals[index]
+        return make_memref_vals(self._vals, self.name, self.add_arg, index)
 
     @property
     def numel(self):
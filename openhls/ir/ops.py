@@ -1,5 +1,8 @@
+import functools
+import heapq
 import math
 import operator
+from collections import defaultdict
 from dataclasses import dataclass
 from enum import Enum
 from functools import reduce
@@ -21,7 +24,13 @@ from openhls.config import (
     NEG_LATENCY,
     RELU_LATENCY,
     SQRT_LATENCY,
+    FOLD_CONSTANTS,
+    CSE,
+    REDUCTION_TREE,
+    WIDTH_EXPONENT,
+    WIDTH_FRACTION,
 )
+from openhls.flopoco.vectorized import FPArray, ZERO
 from openhls.util import extend_idx, chunks, is_val
 
 
@@ -136,7 +145,10 @@ class Latencies:
         OpType.COPY: 1,
         OpType.FMAC: -1,
     }
-    fmacs = set()
+
+    @property
+    def fmacs(self):
+        return state.state.fmacs
 
     def __getitem__(self, op: Op):
         if op.type == OpType.FMAC:
@@ -144,6 +156,17 @@ class Latencies:
         else:
             return self.latencies[op.type]
 
+    def for_graph(self, op_graph):
+        lats = np.zeros(len(op_graph), dtype=np.int64)
+        opcodes = op_graph.opcodes
+        for code, op_type in enumerate(op_graph.op_types):
+            mask = opcodes == code
+            if op_type == OpType.FMAC:
+                lats[mask] = FMAC_LATENCY((op_graph.n_args[mask] - 1) // 2)
+            else:
+                lats[mask] = self.latencies[op_type]
+        return lats
+
     def add(self, op):
         assert (
             isinstance(op, tuple)
@@ -162,16 +185,15 @@ class Latencies:
 
 LATENCIES = Latencies()
 
-CONSTANTS = set()
-
 
 def make_constant(arg):
     assert isinstance(arg, (float, bool, int)), arg
+    value = float(arg)
     arg = f"{arg:.25f}"
     cst_v = Val(
         id=f'cst_{arg.replace(".", "_point_").replace("+", "_plus_")}'
     )
-    if cst_v not in CONSTANTS:
+    if cst_v not in state.state.constants:
         cst_op = Op(
             OpType.CST,
             pe_idx=(-1,),
@@ -181,16 +203,124 @@ def make_constant(arg):
         )
         state.state.val_source[cst_v] = CONSTANT
         state.state.emit(cst_op.emit())
-        CONSTANTS.add(cst_v)
+        state.state.constants.add(cst_v)
+        state.state.known_values[cst_v] = value
     # TODO
     # state.state.add_op_res(cst_v, cst_op)
     # state.state.add_edge(cst_op, "CONSTANT", cst_v)
     return cst_v
 
 
+@functools.lru_cache(maxsize=None)
+def flopoco_value(x):
+    # what the golden model makes of x
+    return FPArray.from_float(x, WIDTH_EXPONENT, WIDTH_FRACTION)
+
+
+def flopoco_zeros(arr):
+    return FPArray.from_float(arr, WIDTH_EXPONENT, WIDTH_FRACTION).unpack()[0] == ZERO
+
+
+def is_known(x, value):
+    return x is not None and int(flopoco_value(x).canonical_bits()) == int(
+        flopoco_value(value).canonical_bits()
+    )
+
+
+FOLD_CONSTANT_OPS = {
+    OpType.ADD: operator.add,
+    OpType.SUB: operator.sub,
+    OpType.MUL: operator.mul,
+    OpType.DIV: operator.truediv,
+    OpType.NEG: operator.neg,
+    OpType.RELU: FPArray.relu,
+    OpType.SQRT: FPArray.sqrt,
+}
+
+
+def fold_constants(op_type, values):
+    res = FOLD_CONSTANT_OPS[op_type](*map(flopoco_value, values))
+    value = res.to_float()
+    if not math.isfinite(value):
+        return None
+    # the constant has to come back out of the (f32) MLIR exactly
+    if int(flopoco_value(float(np.float32(f"{value:.25f}"))).canonical_bits()) != int(
+        res.canonical_bits()
+    ):
+        return None
+    return make_constant(value)
+
+
+def fold(op_type, args):
+    # algebraic simplification/constant propagation (in flopoco arithmetic, i.e., the results
+    # match the golden model, up to the sign of zeros)
+    if op_type not in FOLD_CONSTANT_OPS:
+        return None
+    known = [state.state.known_values.get(arg) for arg in args]
+    if all(k is not None for k in known):
+        return fold_constants(op_type, known)
+    if len(args) != 2:
+        return None
+    (x, y), (kx, ky) = args, known
+    if op_type == OpType.MUL:
+        if is_known(kx, 0.0) or is_known(ky, 0.0):
+            return make_constant(0.0)
+        if is_known(ky, 1.0):
+            return x
+        if is_known(kx, 1.0):
+            return y
+    elif op_type == OpType.ADD:
+        if is_known(ky, 0.0):
+            return x
+        if is_known(kx, 0.0):
+            return y
+    elif op_type == OpType.SUB:
+        if is_known(ky, 0.0):
+            return x
+    elif op_type == OpType.DIV:
+        if is_known(ky, 1.0):
+            return x
+    return None
+
+
+def fold_fmac_terms(mul_vals):
+    terms = []
+    for a, b in chunks(mul_vals, 2):
+        if is_known(state.state.known_values.get(a), 0.0) or is_known(
+            state.state.known_values.get(b), 0.0
+        ):
+            state.state.folded_ops[f"{OpType.FMAC.value}_term"] += 1
+        else:
+            terms.extend((a, b))
+    return terms
+
+
+# ops that only depend on their args (copies are explicitly new registers)
+CSE_OPS = {
+    OpType.ADD,
+    OpType.SUB,
+    OpType.MUL,
+    OpType.DIV,
+    OpType.MAX,
+    OpType.GT,
+    OpType.NEG,
+    OpType.RELU,
+    OpType.SQRT,
+    OpType.FMAC,
+}
+COMMUTATIVE_OPS = {OpType.ADD, OpType.MUL}
+
+
+def cse_key(op_type, pe_idx, args, op_overload):
+    if op_type in COMMUTATIVE_OPS:
+        args = sorted(args, key=str)
+    return op_type, pe_idx, tuple(args), op_overload
+
+
 def create_new_op(op_type: OpType, args, *, pe_idx=None, res=None, op_overload=None):
     if pe_idx is None:
         pe_idx = state.state.pe_idx
+    fresh = res is None
     if res is None:
         res = Val()
 
@@ -200,6 +330,26 @@ def create_new_op(op_type: OpType, args, *, pe_idx=None, res=None, op_overload=N
             assert isinstance(arg, (float, bool, int)), arg
             args[i] = make_constant(arg)
 
+    if FOLD_CONSTANTS and fresh:
+        folded = fold(op_type, args)
+        if folded is not None:
+            state.state.folded_ops[op_type.value] += 1
+            return folded
+
+    key = None
+    if CSE and fresh and op_type in CSE_OPS:
+        key = cse_key(op_type, pe_idx, args, op_overload)
+        if key in state.state.cse_table:
+            state.state.cse_ops[op_type.value] += 1
+            if key not in state.state.cse_copied:
+                # the earlier result is only on its ip's result wire until the ip's next result
+                # so it's reused through a copy (made when it's done)
+                state.state.cse_copied.add(key)
+                state.state.cse_table[key] = create_new_op(
+                    OpType.COPY, (state.state.cse_table[key],), pe_idx=pe_idx
+                )
+            return state.state.cse_table[key]
+
     op = Op(
         op_type,
         pe_idx=pe_idx,
@@ -218,8 +368,12 @@ def create_new_op(op_type: OpType, args, *, pe_idx=None, res=None, op_overload=N
 
     state.state.maybe_add_aux_dep(pe_idx, op)
     state.state.maybe_add_op(op)
-    state.state.map_val_to_pe(res, pe_idx)
     state.state.add_op_res(res, op)
+    state.state.arrival[res] = LATENCIES[op] + max(
+        (state.state.arrival.get(arg, 0) for arg in args), default=0
+    )
+    if key is not None:
+        state.state.cse_table[key] = res
 
     return res
 
@@ -249,8 +403,14 @@ class FMAC:
     def Result(self):
         init_val = [v for v in self.add_vals if "FMAC" not in v.name]
         assert len(init_val) == 1
-        args = init_val + self.mul_vals
-        op_res = FMACOp(len(args), self.pe_idx)(*args)
+        mul_vals = self.mul_vals
+        if FOLD_CONSTANTS:
+            mul_vals = fold_fmac_terms(mul_vals)
+        if mul_vals:
+            args = init_val + mul_vals
+            op_res = FMACOp(len(args), self.pe_idx)(*args)
+        else:
+            op_res = init_val[0]
         op_res = op_res.copy()
         state.state.debug_print(f"MAC {self.pe_idx} ends")
         return op_res
@@ -279,9 +439,6 @@ def reduce_perfect_tree(vals, reduce_op):
     return reduce_op(pairs[0][0], pairs[0][1])
 
 
-ALREADY_COPIED = set()
-
-
 def recursive(vals, reduce_op):
     if len(vals) == 1:
         return vals[0]
@@ -298,29 +455,90 @@ def recursive(vals, reduce_op):
         smaller_sum = recursive(vals, reduce_op)
         if (
             isinstance(smaller_sum, Val)
-            and smaller_sum not in ALREADY_COPIED
+            and smaller_sum not in state.state.already_copied
             and is_val(smaller_sum)
         ):
-            ALREADY_COPIED.add(smaller_sum)
+            state.state.already_copied.add(smaller_sum)
             smaller_sum = smaller_sum.copy()
         if (
             isinstance(perfect_sum, Val)
-            and perfect_sum not in ALREADY_COPIED
+            and perfect_sum not in state.state.already_copied
             and is_val(perfect_sum)
         ):
-            ALREADY_COPIED.add(perfect_sum)
+            state.state.already_copied.add(perfect_sum)
             perfect_sum = perfect_sum.copy()
         return reduce_op(perfect_sum, smaller_sum)
     else:
         return perfect_sum
 
 
+def reduce_by_arrival(vals, reduce_op, op_type):
+    # huffman style: the two operands available earliest are combined first, so late operands
+    # (e.g. longer fmacs) join close to the root. availability accounts for the op latency and
+    # for this reduction's ops sharing a pe
+    latency = LATENCIES.latencies[op_type]
+    items = list(vals)
+    heap = [(state.state.arrival.get(v, 0), i) for i, v in enumerate(items)]
+    heapq.heapify(heap)
+    pe_free = defaultdict(int)
+    # pe -> the item that's (only) in that pe's ip output, i.e., that its next op would overwrite
+    pending = {}
+    plan = []
+    while len(heap) > 1:
+        ta, i = heapq.heappop(heap)
+        tb, j = heapq.heappop(heap)
+        for pe, k in list(pending.items()):
+            if k in (i, j):
+                del pending[pe]
+        # on the pe that produced the later operand (which is then likely done with its work,
+        # unlike, e.g., the pe a weight's index maps to)
+        for v in (items[j], items[i]):
+            if isinstance(state.state.val_source.get(v), int):
+                state.state.update_current_pe_idx(val=v)
+                break
+        else:
+            if isinstance(items[i], Val):
+                state.state.update_current_pe_idx(val=items[i])
+        pe = state.state.pe_idx
+        if pe in pending:
+            held = pending.pop(pe)
+            items[held] = items[held].copy()
+            heap = [(t + 1 if k == held else t, k) for t, k in heap]
+            heapq.heapify(heap)
+        res = reduce_op(items[i], items[j])
+        fresh = state.state.val_source.get(res) == state.state.curr_op_id - 1
+        if isinstance(res, Val) and fresh:
+            t = max(ta, tb, pe_free[pe]) + latency
+            pe_free[pe] = t
+            pending[pe] = len(items)
+        else:
+            # folded or reused
+            t = state.state.arrival.get(res, 0)
+        plan.append((i, j))
+        heapq.heappush(heap, (t, len(items)))
+        items.append(res)
+    state.state.reductions.append(plan)
+    return items[heap[0][1]]
+
+
+def reduce_vals(vals, reduce_op, op_type):
+    vals = list(vals)
+    if not any(isinstance(v, Val) for v in vals):
+        # the golden model's vals (e.g. through ReduceTiling) go through the traced tree
+        from openhls.flopoco.ops import replay_reduction
+
+        return replay_reduction(vals, reduce_op, recursive)
+    if REDUCTION_TREE == "arrival":
+        return reduce_by_arrival(vals, reduce_op, op_type)
+    return recursive(vals, reduce_op)
+
+
 def ReduceAdd(vals):
-    return recursive(vals, operator.add)
+    return reduce_vals(vals, operator.add, OpType.ADD)
 
 
 def ReduceMax(vals):
-    return recursive(vals, lambda x, y: x.max(y))
+    return reduce_vals(vals, lambda x, y: x.max(y), OpType.MAX)
 
 
 def Copy(dst, src):
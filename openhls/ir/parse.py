@@ -1,11 +1,10 @@
 import ast
 import logging
 import re
+import struct
 from dataclasses import dataclass
 from typing import Tuple, Any
 
-from torch_mlir._mlir_libs._mlir.ir import Context, Module
-
 from openhls.ir.ops import OpType, OPS, Op, LATENCIES
 
 logger = logging.getLogger(__name__)
@@ -34,10 +33,6 @@ def parse_attrs_to_dict(attrs):
 
 
 reg_idents = re.compile(r"(%[\da-z_]*|([0-9]+\.[0-9]*))")
-reg_start_time = re.compile(r"lpStartTime = (\d+)")
-reg_opr = re.compile(r'opr = "(.*?)"')
-reg_pe = re.compile(r'pe = "(.*?)"')
-reg_op_id = re.compile(r'op_id = "(.*?)"')
 
 
 def module_ops_iter(module_str):
@@ -75,89 +70,147 @@ class OpIdData:
         return tuple(self)[item]
 
 
-def parse_mlir_module(module_str):
-    vals = set()
-    csts = {}
-    pe_idxs = set()
-    op_id_data = {}
-    val_to_op = {}
-    output_map = {}
-    func_args = None
-    returns = None
-    for line in module_str.splitlines():
-        idents = reg_idents.findall(line)
-        if "op_id" in line:
-            op_id = reg_op_id.findall(line)[0]
-            opr = reg_opr.findall(line)[0]
-            pe_idx = ast.literal_eval(reg_pe.findall(line)[0])
-            pe_idxs.add(pe_idx)
-
-            res_val = idents[0][0]
-            args = tuple([inp[0] for inp in idents[1:]])
+_SEPARATORS = str.maketrans("(),:{}", "      ")
+
+
+def ssa_names(segment):
+    return [tok for tok in segment.translate(_SEPARATORS).split() if tok[0] == "%"]
+
+
+# `key = "string"` or `key = bare : type`
+reg_attr = re.compile(r'(\w+) = (?:"([^"]*)"|([^,:\s]+))')
+
+
+def parse_attr_dict(attrs_str):
+    return {k: quoted or bare for k, quoted, bare in reg_attr.findall(attrs_str)}
+
+
+def parse_int_tuple(tuple_str):
+    return tuple(int(i) for i in tuple_str.strip("() ").split(",") if i.strip())
+
+
+def decode_f32(value_str):
+    if value_str.startswith("0x"):
+        f = struct.unpack("<f", struct.pack("<I", int(value_str, 16)))[0]
+    else:
+        f = struct.unpack("<f", struct.pack("<f", float(value_str)))[0]
+    # mirror how MLIR prints f32 attrs: 7 significant digits if that round trips,
+    # otherwise the exact (hex) value
+    short = float(f"{f:.6e}")
+    if struct.pack("<f", short) == struct.pack("<f", f):
+        return short
+    return f
+
+
+def tokenize_mlir_module(module):
+    """Lazily yields ("op", Op), ("cst", (val, value)), ("func", args),
+    ("output_map", (val, name, idx)) and ("return", (vals, start_time)) records."""
+    lines = module.splitlines() if isinstance(module, str) else module
+    pe_idxs = {}
+    for line in lines:
+        stripped = line.lstrip()
+        if stripped.startswith("//"):
+            if "output_map" in stripped:
+                val, name, idx = stripped.split(";")[1].strip().split(":")
+                yield "output_map", (val, name, parse_int_tuple(idx))
+        elif "op_id" in line:
+            attrs_start = line.index("{")
+            attrs_end = line.index("}", attrs_start)
+            res_val, _, opr_operands = line[:attrs_start].partition("=")
+            res_val = res_val.strip()
+            attrs = parse_attr_dict(line[attrs_start + 1 : attrs_end])
+
+            opr = attrs["opr"]
+            pe_str = attrs["pe"]
+            if pe_str not in pe_idxs:
+                pe_idxs[pe_str] = parse_int_tuple(pe_str)
+            pe_idx = pe_idxs[pe_str]
+            start_time = attrs.get("lpStartTime")
             if opr == "arith.constant":
-                op = parse_mlir_module_using_mlir(line)
-                cst_op = op.regions[0].blocks[0].operations[0]
-                value = cst_op.attributes["value"]
-                # '5.000000e-01 : f32'
-                value_float = float(str(value).split(":")[0])
-                csts[res_val] = value_float
+                # either generic (`value` in the attr dict) or pretty (value after it)
+                value = attrs.get("value") or line[attrs_end + 1 :].split(":")[0]
+                yield "cst", (res_val, decode_f32(value.strip()))
+                args = ()
             else:
-                vals.update(set(args))
+                args = tuple(ssa_names(opr_operands))
+                if "." in opr:
+                    opr, _overload = opr.split(".")
 
-            start_time = reg_start_time.findall(line)
-            if start_time:
-                start_time = int(start_time[0])
-            else:
-                start_time = None
-            if opr != "arith.constant" and "." in opr:
-                opr, _overload = opr.split(".")
-            opr = OPS[opr]
             op = Op(
-                opr,
+                OPS[opr],
                 pe_idx,
-                op_id,
+                attrs["op_id"],
                 args,
                 res_val,
-                attrs={"start_time": start_time + 1}
+                attrs={"start_time": int(start_time) + 1}
                 if start_time is not None
                 else None,
             )
             # super ugly hack but otherwise the op_ids don't match the emitted mlir
-            object.__setattr__(op, "op_id", op_id)
-            val_to_op[res_val] = op_id_data[op_id, opr] = op
+            object.__setattr__(op, "op_id", attrs["op_id"])
+            yield "op", op
+        elif "func.func" in line:
+            yield "func", ssa_names(line)
+        elif "return" in line:
+            start_time = None
+            if "lpStartTime" in line:
+                attrs_start = line.index("{")
+                attrs = parse_attr_dict(line[attrs_start + 1 : line.index("}", attrs_start)])
+                start_time = int(attrs["lpStartTime"])
+            yield "return", (ssa_names(line), start_time)
+
+
+def parse_mlir_module(module):
+    vals = set()
+    csts = {}
+    pe_idxs = set()
+    op_id_data = {}
+    val_to_op = {}
+    output_map = {}
+    func_args = None
+    returns = None
+    return_time = None
+    for kind, record in tokenize_mlir_module(module):
+        if kind == "op":
+            op = record
+            pe_idxs.add(op.pe_idx)
+            if op.type != OpType.CST:
+                vals.update(op.args)
+            val_to_op[op.res] = op_id_data[op.op_id, op.type] = op
             # patch the start time incase the scheduler messed up
-            if opr == OpType.COPY and op.attrs is not None:
-                src_op = val_to_op[args[0]]
+            # (copies of arguments, e.g. of folded fmacs, have nothing to wait for)
+            if (
+                op.type == OpType.COPY
+                and op.attrs is not None
+                and op.args[0] in val_to_op
+            ):
+                src_op = val_to_op[op.args[0]]
                 correct_start_time = src_op.attrs["start_time"] + LATENCIES[src_op]
                 if op.attrs["start_time"] != correct_start_time:
                     logger.warning(
                         f"overriding start time of {op} from {op.attrs['start_time']} to {correct_start_time}"
                     )
                     op.attrs["start_time"] = correct_start_time
-        elif "func.func" in line:
-            assert idents
-            func_args = [idn[0] for idn in idents]
-        elif "output_map" in line:
-            val, name, idx = line.split(";")[1].split(":")
-            idx = ast.literal_eval(idx)
+        elif kind == "cst":
+            res_val, value = record
+            csts[res_val] = value
+        elif kind == "func":
+            assert record
+            func_args = record
+        elif kind == "output_map":
+            val, name, idx = record
             output_map[val] = name, idx
-        elif "return" in line:
-            start_time = reg_start_time.findall(line)
-            if start_time:
-                start_time = int(start_time[0])
-            else:
-                start_time = None
-            returns, return_time = [idn[0] for idn in idents], start_time
-            for r in returns:
-                vals.add(r)
-        else:
-            continue
+        elif kind == "return":
+            returns, return_time = record
+            vals.update(returns)
     assert func_args and returns
     vals -= set(func_args)
     return op_id_data, func_args, returns, output_map, return_time, vals, csts, pe_idxs
 
 
 def parse_mlir_module_using_mlir(module_str):
+    from torch_mlir._mlir_libs._mlir.ir import Context, Module
+
     ctx = Context()
     ctx.allow_unregistered_dialects = True
     module = Module.parse(module_str, ctx)
@@ -15,8 +15,6 @@ from _ast import (
 )
 from ast import Assign, Mult, Add, BinOp, Name, Call, IfExp, Compare, Num
 
-import astor
-
 from openhls.config import LOOP_TILING_FACTOR
 from openhls.ir.parse import parse_mlir_module, reg_idents
 
@@ -24,13 +22,16 @@ logger = logging.getLogger(__name__)
 
 
 def stringify_node(node):
+    import astor
+
     return str(astor.code_gen.to_source(node))
 
 
 class RemoveMAC(ast.NodeTransformer):
-    body_args = []
-    has_fma = False
-    final_assign = None
+    def __init__(self):
+        self.body_args = []
+        self.has_fma = False
+        self.final_assign = None
 
     def visit_body(self, node):
         assigns = [b for b in node.body if isinstance(b, Assign)]
@@ -85,9 +86,10 @@ class RemoveMAC(ast.NodeTransformer):
 
 
 class RemoveIfExp(ast.NodeTransformer):
-    subs = {}
-    dels = set()
-    body_args = []
+    def __init__(self):
+        self.subs = {}
+        self.dels = set()
+        self.body_args = []
 
     def visit_FunctionDef(self, node):
         if node.name == "body":
@@ -317,10 +319,9 @@ class RemoveMax(ast.NodeTransformer):
 
 
 class TileLoops(ast.NodeTransformer):
-    loops_to_tile = []
-
     def __init__(self, tile_factor=2):
         self.tile_factor = tile_factor
+        self.loops_to_tile = []
 
     def tile_loop(self, parfor, memrefs, top_level):
         first_for_loop = parfor.body[0]
@@ -480,6 +481,8 @@ def transform_forward(new_tree):
 
 
 def transform_forward_py(fp):
+    import astor
+
     tree = astor.parse_file(fp)
     new_tree = transform_forward(tree)
     new_fp = f"{fp.replace('.py', '_rewritten.py')}"
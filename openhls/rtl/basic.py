@@ -91,11 +91,11 @@ def make_fmac_branches(pe, fmul_states, fadd_states, init_val, args, comb_or_seq
             "\n".join(
                 [
                     f"""\
-        if (1'b1 == {fsm_state}) begin
+        if ({fsm_state}) begin
             {pe.fmul.x} {'=' if comb_or_seq == CombOrSeq.COMB else '<='} {args[2 * i]};
             {pe.fmul.y} {'=' if comb_or_seq == CombOrSeq.COMB else '<='} {args[2 * i + 1]};
         end
-        if (1'b1 == {fadd_states[i]}) begin
+        if ({fadd_states[i]}) begin
             {pe.fadd.x} {'=' if comb_or_seq == CombOrSeq.COMB else '<='} {init_val if i == 0 else pe.fadd.r};
             {pe.fadd.y} {'=' if comb_or_seq == CombOrSeq.COMB else '<='} {pe.fmul.r};
         end
@@ -1,9 +1,19 @@
+import bisect
+import heapq
+import itertools
 import logging
+import math
 from collections import defaultdict
 from io import StringIO
 from textwrap import dedent, indent
 
-from openhls.config import DEBUG, USING_FLOPOCO
+from openhls.config import (
+    DEBUG,
+    USING_FLOPOCO,
+    FSM_ENCODING,
+    MUL_LATENCY,
+    ADD_LATENCY,
+)
 from openhls.ir.ops import Op, OpType, LATENCIES
 from openhls.rtl.basic import (
     Wire,
@@ -14,17 +24,21 @@ from openhls.rtl.basic import (
     make_fmac_branches,
     CombOrSeq,
 )
-from openhls.rtl.fsm import FSM
-from openhls.rtl.ip import FAdd, FMul, FDiv, ReLU, Neg, PE, FMax, FSub, Sqrt
+from openhls.rtl.fsm import FSMS, mac_fsm_times
+from openhls.rtl.ip import PE
 
 logger = logging.getLogger(__name__)
 
+# the testbench sets it (when built with OPENHLS_WAVES) to window the waves dump
+WAVES_ON_REG = "openhls_waves_on"
+
 
 def build_ip_res_val_map(pe, op_datas: list[Op], vals):
     ip_res_val_map = {}
     for op in op_datas:
         res_val = vals.get(op.res, op.res)
-        assert res_val not in ip_res_val_map
+        # copies share registers
+        assert res_val not in ip_res_val_map or op.type == OpType.COPY
         if op.type in {
             OpType.ADD,
             OpType.DIV,
@@ -48,7 +62,9 @@ def build_ip_res_val_map(pe, op_datas: list[Op], vals):
     return ip_res_val_map
 
 
-def make_pe_always(fsm, pe, op_datas: list[Op], vals, input_wires, ip_res_val_map):
+def make_pe_always(
+    fsm, pe, op_datas: list[Op], vals, input_wires, ip_res_val_map, read=None
+):
     tree_conds = []
     not_latches = set()
     for op in op_datas:
@@ -59,12 +75,18 @@ def make_pe_always(fsm, pe, op_datas: list[Op], vals, input_wires, ip_res_val_ma
         start_time = op.attrs["start_time"]
         end_time = start_time + LATENCIES[op]
         res_val = vals.get(op.res, op.res)
-        in_a = vals.get(args[0], input_wires.get(args[0], args[0]))
-        in_a = ip_res_val_map.get(in_a, in_a)
+        if read is not None:
+            in_a = read(args[0], start_time)
+        else:
+            in_a = vals.get(args[0], input_wires.get(args[0], args[0]))
+            in_a = ip_res_val_map.get(in_a, in_a)
 
         if op.type in {OpType.ADD, OpType.SUB, OpType.MUL, OpType.DIV, OpType.MAX}:
-            in_b = vals.get(args[1], input_wires.get(args[1], args[1]))
-            in_b = ip_res_val_map.get(in_b, in_b)
+            if read is not None:
+                in_b = read(args[1], start_time)
+            else:
+                in_b = vals.get(args[1], input_wires.get(args[1], args[1]))
+                in_b = ip_res_val_map.get(in_b, in_b)
 
             tree_conds.append(
                 make_always_branch(
@@ -91,9 +113,17 @@ def make_pe_always(fsm, pe, op_datas: list[Op], vals, input_wires, ip_res_val_ma
             fmul_states, fadd_states, done_state = fsm.generate_mac_fsm_states(
                 (len(args) - 1) // 2, start_time
             )
+            fmul_times, fadd_times, _done_time = mac_fsm_times(
+                (len(args) - 1) // 2, start_time
+            )
+            if read is not None:
+                in_a = read(args[0], fadd_times[0])
             args = []
-            for arg in op.args[1:]:
-                arg = vals.get(arg, input_wires.get(arg, ip_res_val_map.get(arg)))
+            for i, arg in enumerate(op.args[1:]):
+                if read is not None:
+                    arg = read(arg, fmul_times[i // 2])
+                else:
+                    arg = vals.get(arg, input_wires.get(arg, ip_res_val_map.get(arg)))
                 assert arg is not None
                 args.append(arg)
             tree_conds.append(
@@ -108,6 +138,141 @@ def make_pe_always(fsm, pe, op_datas: list[Op], vals, input_wires, ip_res_val_ma
     return make_always_tree(tree_conds, not_latches)
 
 
+def op_reads(op: Op):
+    # the (arg, fsm stage) pairs at which the op reads its args
+    start_time = op.attrs["start_time"]
+    if op.type == OpType.FMAC:
+        fmul_times, fadd_times, _done_time = mac_fsm_times(
+            (len(op.args) - 1) // 2, start_time
+        )
+        return [(op.args[0], fadd_times[0])] + [
+            (arg, fmul_times[i // 2]) for i, arg in enumerate(op.args[1:])
+        ]
+    return [(arg, start_time) for arg in op.args]
+
+
+def share_copy_registers(op_datas, returns, return_time):
+    # copies are the only ops that write registers; a copy's register is live from the stage after
+    # the copy until its last read, so (left edge) each copy goes to the first register on its pe
+    # whose last read is no later than the copy. returns the register each copy result ends up in
+    # (named for the first value that's in it)
+    last_reads = {}
+    for op in op_datas:
+        if op.type != OpType.CST:
+            for arg, fsm_stage in op_reads(op):
+                last_reads[arg] = max(last_reads.get(arg, 0), fsm_stage)
+    for v in returns:
+        last_reads[v] = max(last_reads.get(v, 0), return_time + 1)
+
+    copies = defaultdict(list)
+    for op in op_datas:
+        if op.type == OpType.COPY:
+            start_time = op.attrs["start_time"]
+            copies[op.pe_idx].append(
+                (start_time, last_reads.get(op.res, start_time + 1), op.res)
+            )
+
+    shared = {}
+    for pe_idx, live_ranges in copies.items():
+        free_at = []
+        for start_time, last_read, res in sorted(live_ranges):
+            if free_at and free_at[0][0] <= start_time:
+                _, reg_val = heapq.heappop(free_at)
+            else:
+                reg_val = res
+            shared[res] = reg_val
+            heapq.heappush(free_at, (last_read, reg_val))
+    return shared
+
+
+class PipelineRegs:
+    # with a new inference every ii stages an ip's result is only good until the ip's next result
+    # (of this inference or the next one) so values read later than that go through a chain of
+    # registers, one per ii stages, that's shifted whenever the value is produced
+    def __init__(
+        self, ii, signal_width, op_datas, vals, input_wires, ip_res_val_map, pes
+    ):
+        self.ii = ii
+        self.signal_width = signal_width
+        self.vals = vals
+
+        # the (folded) stages at which each ip's result changes
+        changes = defaultdict(list)
+        for op in op_datas:
+            start_time = op.attrs["start_time"] if op.type != OpType.CST else None
+            if op.type == OpType.FMAC:
+                pe = pes[op.pe_idx]
+                fmul_times, fadd_times, _done_time = mac_fsm_times(
+                    (len(op.args) - 1) // 2, start_time
+                )
+                changes[str(pe.fmul.r)].extend(t + MUL_LATENCY for t in fmul_times)
+                changes[str(pe.fadd.r)].extend(t + ADD_LATENCY for t in fadd_times)
+            elif op.type != OpType.CST:
+                res_val = vals.get(op.res, op.res)
+                changes[str(ip_res_val_map[res_val])].append(
+                    start_time + LATENCIES[op]
+                )
+        changes = {
+            ip_r: sorted({(t - 1) % ii + 1 for t in ts}) for ip_r, ts in changes.items()
+        }
+
+        # (source, fsm stage it's good from, number of stages it's good for) for everything
+        # that isn't a constant
+        self.srcs = {}
+        for v, wire in input_wires.items():
+            # inputs are held for the first ii stages and captured at the end of them
+            self.srcs[v] = wire, ii, 1
+        for op in op_datas:
+            if op.type == OpType.CST:
+                continue
+            src = ip_res_val_map[vals.get(op.res, op.res)]
+            good_at = op.attrs["start_time"] + LATENCIES[op]
+            ts = changes[str(src)]
+            folded = (good_at - 1) % ii + 1
+            i = bisect.bisect_right(ts, folded)
+            next_change = ts[i] if i < len(ts) else ts[0] + ii
+            self.srcs[op.res] = src, good_at, next_change - folded
+        self.depths = defaultdict(int)
+
+    def reg(self, v, i):
+        return Reg(f"{v}_d{i}", self.signal_width)
+
+    def read(self, v, fsm_stage):
+        if v not in self.srcs:
+            return self.vals[v]
+        src, good_at, good_for = self.srcs[v]
+        if fsm_stage - good_at < good_for:
+            return src
+        i = math.ceil((fsm_stage - good_at) / self.ii) - 1
+        self.depths[v] = max(self.depths[v], i + 1)
+        return self.reg(v, i)
+
+    def instantiate(self):
+        return "\n".join(
+            self.reg(v, i).instantiate()
+            for v, depth in sorted(self.depths.items())
+            for i in range(depth)
+        )
+
+    def make_always(self, fsm):
+        chains = defaultdict(list)
+        for v, depth in sorted(self.depths.items()):
+            src, good_at, _good_for = self.srcs[v]
+            regs = [self.reg(v, i) for i in range(depth)]
+            chains[fsm.fold(good_at)].extend(zip(regs, [src] + regs[:-1]))
+        return make_always_tree(
+            [
+                make_always_branch(
+                    [left for left, _right in chain],
+                    [right for _left, right in chain],
+                    fsm.make_fsm_conditions([fsm_stage]),
+                )
+                for fsm_stage, chain in sorted(chains.items())
+            ],
+            set(),
+        )
+
+
 def make_pblock_bridge(ip_name, input_wires, output_wires, width_exp, width_frac):
     if USING_FLOPOCO:
         signal_width = width_exp + width_frac + 3
@@ -182,6 +347,15 @@ def make_top_module_decl(ip_name, input_wires, output_wires, width_exp, width_fr
     return "\n".join([mod_top, mod_inner])
 
 
+def make_emitter(f):
+    # identifiers are sanitized as they're written, i.e., the module is never held in memory
+    def emit(*args):
+        f.write(" ".join(map(str, args)).replace("%", "p_"))
+        f.write("\n\n")
+
+    return emit
+
+
 def emit_verilog(
     ip_name,
     width_exp,
@@ -193,7 +367,10 @@ def emit_verilog(
     vals,
     csts,
     pe_idxs,
+    module_f,
+    blackbox_f,
     for_testbench=False,
+    ii=None,
 ):
     if USING_FLOPOCO:
         signal_width = width_exp + width_frac + 3
@@ -208,6 +385,7 @@ def emit_verilog(
 
     output_wires = {v: Wire(v, signal_width) for v in returns}
 
+    n_vals = len(vals)
     vals = {v: Reg(v, signal_width) for v in vals}
     if not for_testbench:
         for v in func_args:
@@ -215,12 +393,7 @@ def emit_verilog(
                 vals[v] = Reg(v, signal_width)
                 csts[v] = None
 
-    s = StringIO()
-
-    def emit(*args):
-        print(*args, file=s)
-        print(file=s)
-
+    emit = make_emitter(module_f)
     emit(
         make_top_module_decl(
             ip_name,
@@ -231,7 +404,26 @@ def emit_verilog(
         )
     )
 
-    for name, val_reg in sorted(vals.items()):
+    # only constants and copies' results are actually registers (everything else is read off of
+    # the ips) and in a modulo schedule every value's lifetime is handled by PipelineRegs
+    copy_regs = {
+        op.res: op.res for op in op_id_data.values() if op.type == OpType.COPY
+    }
+    if ii is None:
+        copy_regs = share_copy_registers(op_id_data.values(), returns, return_time)
+    for v, reg_val in copy_regs.items():
+        vals[v] = vals[reg_val]
+    # fmacs read their args off of vals directly
+    fmac_args = {
+        arg
+        for op in op_id_data.values()
+        if op.type == OpType.FMAC
+        for arg in op.args[1:]
+        if arg in vals
+    }
+    regs = set(csts) | set(copy_regs.values()) | fmac_args
+    for name in sorted(regs & vals.keys()):
+        val_reg = vals[name]
         if name in csts:
             cst = csts[name]
             emit(
@@ -239,38 +431,27 @@ def emit_verilog(
                 "=",
                 f"{make_constant(cst, width_exp, width_frac)}; // {cst}",
             )
-        else:
+        elif name not in copy_regs or copy_regs[name] == name:
             emit(val_reg.instantiate())
+    logger.info(
+        f"{len(set(vals[v] for v in regs & vals.keys()))} registers for {n_vals} values "
+        f"({len(set(copy_regs.values()))} for {len(copy_regs)} copies)"
+    )
 
-    fsm = FSM(50, max_fsm_stage=return_time + 1)
+    if ii is None:
+        fsm = FSMS[FSM_ENCODING](50, max_fsm_stage=return_time + 1)
+    else:
+        # the fsm only counts out the ii stages; every op runs (for some inference) every ii stages
+        fsm = FSMS[FSM_ENCODING](50, max_fsm_stage=ii, modulo=True)
     emit(fsm.make_fsm_params())
     emit(fsm.make_fsm_wires())
 
     pes = {}
+    ip_ids = itertools.count(1, PE.n_ips)
     for pe_idx in pe_idxs:
         if pe_idx[0] < 0:
             continue
-
-        # TODO: don't emit ip for pes that don't use (like eg div, of which there's only one)
-        fadd = FAdd(pe_idx, signal_width)
-        fdiv = FDiv(pe_idx, signal_width)
-        fmul = FMul(pe_idx, signal_width)
-        fsub = FSub(pe_idx, signal_width)
-        fmax = FMax(pe_idx, signal_width)
-        frelu = ReLU(pe_idx, signal_width)
-        fsqrt = Sqrt(pe_idx, signal_width)
-        fneg = Neg(pe_idx, signal_width)
-        pes[pe_idx] = PE(
-            fadd=fadd,
-            fdiv=fdiv,
-            fmul=fmul,
-            fsub=fsub,
-            fmax=fmax,
-            frelu=frelu,
-            fsqrt=fsqrt,
-            fneg=fneg,
-            idx=pe_idx,
-        )
+        pes[pe_idx] = PE(pe_idx, signal_width, first_id=next(ip_ids))
 
     ips_to_instantiate = defaultdict(set)
     pe_to_ops = defaultdict(list)
@@ -296,38 +477,67 @@ def emit_verilog(
     ip_res_val_map = {}
     for pe, op_datas in pe_to_ops.items():
         ip_res_val_map.update(build_ip_res_val_map(pe, op_datas, vals))
+
+    read = pipeline_regs = None
+    if ii is not None:
+        pipeline_regs = PipelineRegs(
+            ii,
+            signal_width,
+            op_id_data.values(),
+            vals,
+            input_wires,
+            ip_res_val_map,
+            pes,
+        )
+        # the chains have to be declared before they're used, so a pass just for their depths
+        for op in op_id_data.values():
+            if op.type != OpType.CST:
+                for arg, fsm_stage in op_reads(op):
+                    pipeline_regs.read(arg, fsm_stage)
+        for v in returns:
+            pipeline_regs.read(v, return_time + 1)
+        emit(pipeline_regs.instantiate())
+        read = pipeline_regs.read
+
     for pe, op_datas in pe_to_ops.items():
-        emit(make_pe_always(fsm, pe, op_datas, vals, input_wires, ip_res_val_map))
+        emit(
+            make_pe_always(fsm, pe, op_datas, vals, input_wires, ip_res_val_map, read)
+        )
+    if pipeline_regs is not None and pipeline_regs.depths:
+        emit(pipeline_regs.make_always(fsm))
+        logger.info(
+            f"Pipeline registers for {len(pipeline_regs.depths)} values "
+            f"({sum(pipeline_regs.depths.values())} registers)"
+        )
     emit(fsm.make_fsm())
 
     output_wire_names = []
     for v, wire in output_wires.items():
         reg = Reg(wire.id, wire.signal_width)
         output_wire_name = f"output_{wire}"
-        emit(f"assign {output_wire_name} = {ip_res_val_map[reg]};")
+        if read is not None:
+            # read when the testbench reads them, i.e., at the end of the inference's stages
+            src = read(v, return_time + 1)
+        else:
+            # folded outputs might be constants or inputs rather than ip results
+            src = ip_res_val_map.get(reg, vals.get(v, input_wires.get(v)))
+        assert src is not None, v
+        emit(f"assign {output_wire_name} = {src};")
         output_wire_names.append(output_wire_name)
 
+    # waves are dumped (opt in) by a separate module, see openhls.testbench.waves
     emit(
         dedent(
             f"""\
-            `ifdef COCOTB_SIM
-            initial begin
-              $dumpfile ("{ip_name}.vcd");
-              $dumpvars (0, {ip_name});
-              #1;
-            end
+            `ifdef OPENHLS_WAVES
+            reg {WAVES_ON_REG} = 0;
             `endif
             """
         )
     )
     emit("endmodule")
 
-    s.seek(0)
-    module = s.read()
-
-    s.seek(0)
-    s.truncate()
-
+    emit = make_emitter(blackbox_f)
     emit(
         make_top_module_decl(
             ip_name,
@@ -338,8 +548,5 @@ def emit_verilog(
         )
     )
     emit("endmodule")
-    s.seek(0)
-
-    blackbox = s.read()
 
-    return module, blackbox, input_wires, output_wire_names, fsm.max_fsm_stage
+    return input_wires, output_wire_names, fsm.max_fsm_stage
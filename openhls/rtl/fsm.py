@@ -8,20 +8,62 @@ def get_fsm_idx_width(max_fsm_stage):
     return math.ceil(math.log10(max_fsm_stage))
 
 
+def contiguous_ranges(fsm_states):
+    ranges = []
+    for s in sorted(set(fsm_states)):
+        if ranges and ranges[-1][1] == s - 1:
+            ranges[-1][1] = s
+        else:
+            ranges.append([s, s])
+    return ranges
+
+
+def mac_fsm_times(n_elements, start_time):
+    fmul_states = [start_time]
+    fadd_states = [start_time + MUL_LATENCY]
+    for i in range(n_elements - 1):
+        fadd_states.append(fadd_states[-1] + ADD_LATENCY)
+        fmul_states.append(fadd_states[-1] - MUL_LATENCY)
+    done_state = fadd_states[-1] + ADD_LATENCY
+    return fmul_states, fadd_states, done_state
+
+
 class FSM:
-    def __init__(self, max_fanout, max_fsm_stage):
+    # shortest run of stages that's tested as a range rather than stage by stage
+    min_range_len = 3
+
+    def __init__(self, max_fanout, max_fsm_stage, modulo=False):
         self.max_fanout = max_fanout
         self.max_fsm_stage = max_fsm_stage
         self.fsm_idx_width = math.ceil(math.log10(max_fsm_stage))
+        # schedule times wrap around every max_fsm_stage stages (i.e., the ii of a modulo schedule)
+        self.modulo = modulo
+
+    def fold(self, fsm_state):
+        if self.modulo:
+            return (fsm_state - 1) % self.max_fsm_stage + 1
+        return fsm_state
+
+    def make_state_condition(self, fsm_state):
+        return f"1'b1 == current_fsm_state{str(fsm_state).zfill(self.fsm_idx_width)}"
+
+    def make_range_condition(self, first, last):
+        # one hot so any of the bits
+        return f"(|current_fsm[{last - 1}:{first - 1}])"
+
+    def make_fsm_condition(self, fsm_state):
+        return self.make_state_condition(self.fold(fsm_state))
 
     def make_fsm_conditions(self, fsm_states):
-        s = " | ".join(
-            [
-                f"(1'b1 == current_fsm_state{str(i).zfill(self.fsm_idx_width)})"
-                for i in fsm_states
-            ]
-        )
-        return s
+        conds = []
+        for first, last in contiguous_ranges(map(self.fold, fsm_states)):
+            if last - first + 1 >= self.min_range_len:
+                conds.append(self.make_range_condition(first, last))
+            else:
+                conds.extend(
+                    f"({self.make_state_condition(i)})" for i in range(first, last + 1)
+                )
+        return " | ".join(conds)
 
     def make_fsm_params(self):
         params = "\n".join(
@@ -112,18 +154,123 @@ class FSM:
         return fsm
 
     def generate_mac_fsm_states(self, n_elements, start_time):
-        fmul_states = [start_time]
-        fadd_states = [start_time + MUL_LATENCY]
-        for i in range(n_elements - 1):
-            fadd_states.append(fadd_states[-1] + ADD_LATENCY)
-            fmul_states.append(fadd_states[-1] - MUL_LATENCY)
-        done_state = fadd_states[-1] + ADD_LATENCY
-        fmul_states = [
-            f"current_fsm_state{str(s).zfill(self.fsm_idx_width)}"
-            for s in sorted(fmul_states)
-        ]
-        fadd_states = [
-            f"current_fsm_state{str(s).zfill(self.fsm_idx_width)}"
-            for s in sorted(fadd_states)
-        ]
+        fmul_states, fadd_states, done_state = mac_fsm_times(n_elements, start_time)
+        fmul_states = [self.make_fsm_condition(s) for s in sorted(fmul_states)]
+        fadd_states = [self.make_fsm_condition(s) for s in sorted(fadd_states)]
         return fmul_states, fadd_states, done_state
+
+
+class BinaryFSM(FSM):
+    # a counter (that wraps around from the last stage to the first) instead of a bit per stage
+    min_range_len = 2
+
+    def __init__(self, max_fanout, max_fsm_stage, modulo=False):
+        super().__init__(max_fanout, max_fsm_stage, modulo)
+        self.width = max(max_fsm_stage.bit_length(), 1)
+
+    def state(self, i):
+        return f"{self.width}'d{i}"
+
+    def make_state_condition(self, fsm_state):
+        return f"current_fsm == {self.state(fsm_state)}"
+
+    def make_range_condition(self, first, last):
+        return f"(current_fsm >= {self.state(first)} && current_fsm <= {self.state(last)})"
+
+    def make_fsm_params(self):
+        return dedent(
+            f"""\
+            (* max_fanout = {self.max_fanout} *) reg [{self.width - 1}:0] current_fsm;
+            reg [{self.width - 1}:0] next_state_fsm;"""
+        )
+
+    def make_fsm_wires(self):
+        return ""
+
+    def make_fsm(self):
+        return dedent(
+            f"""\
+            always @ (posedge clk) begin
+                if (rst == 1'b1) begin
+                    current_fsm <= {self.state(1)};
+                end else begin
+                    current_fsm <= next_state_fsm;
+                end
+            end
+
+            always @ (*) begin
+                if (current_fsm == {self.state(self.max_fsm_stage)}) begin
+                    next_state_fsm = {self.state(1)};
+                end else begin
+                    next_state_fsm = current_fsm + {self.state(1)};
+                end
+            end
+            """
+        )
+
+
+class SegmentedFSM(FSM):
+    # one hot over segments of stages and one hot over the stages within a segment, i.e., about
+    # 2 * sqrt(max_fsm_stage) flops instead of max_fsm_stage
+    min_range_len = 2
+
+    def __init__(self, max_fanout, max_fsm_stage, modulo=False):
+        super().__init__(max_fanout, max_fsm_stage, modulo)
+        self.segment_len = max(math.ceil(math.sqrt(max_fsm_stage)), 2)
+        self.n_segments = max(math.ceil(max_fsm_stage / self.segment_len), 2)
+
+    def seg_pos(self, fsm_state):
+        return divmod(fsm_state - 1, self.segment_len)
+
+    def make_state_condition(self, fsm_state):
+        seg, pos = self.seg_pos(fsm_state)
+        return f"current_fsm_seg[{seg}] & current_fsm_pos[{pos}]"
+
+    def make_range_condition(self, first, last):
+        conds = []
+        for seg in range(self.seg_pos(first)[0], self.seg_pos(last)[0] + 1):
+            seg_first = max(first, seg * self.segment_len + 1)
+            seg_last = min(last, (seg + 1) * self.segment_len)
+            if seg_last - seg_first + 1 == self.segment_len:
+                conds.append(f"current_fsm_seg[{seg}]")
+            else:
+                conds.append(
+                    f"(current_fsm_seg[{seg}] & (|current_fsm_pos[{self.seg_pos(seg_last)[1]}:{self.seg_pos(seg_first)[1]}]))"
+                )
+        return f"({' | '.join(conds)})"
+
+    def make_fsm_params(self):
+        return dedent(
+            f"""\
+            (* max_fanout = {self.max_fanout}, fsm_encoding = "none" *) reg [{self.n_segments - 1}:0] current_fsm_seg;
+            (* max_fanout = {self.max_fanout}, fsm_encoding = "none" *) reg [{self.segment_len - 1}:0] current_fsm_pos;"""
+        )
+
+    def make_fsm_wires(self):
+        return ""
+
+    def make_fsm(self):
+        last_seg, last_pos = self.seg_pos(self.max_fsm_stage)
+        seg, pos = self.n_segments, self.segment_len
+        return dedent(
+            f"""\
+            always @ (posedge clk) begin
+                if (rst == 1'b1 || (current_fsm_seg[{last_seg}] & current_fsm_pos[{last_pos}])) begin
+                    current_fsm_seg <= {seg}'d1;
+                    current_fsm_pos <= {pos}'d1;
+                end else begin
+                    current_fsm_pos <= {{current_fsm_pos[{pos - 2}:0], current_fsm_pos[{pos - 1}]}};
+                    if (current_fsm_pos[{pos - 1}] == 1'b1) begin
+                        current_fsm_seg <= {{current_fsm_seg[{seg - 2}:0], current_fsm_seg[{seg - 1}]}};
+                    end
+                end
+            end
+            """
+        )
+
+
+FSMS = {
+    "onehot": FSM,
+    "binary": BinaryFSM,
+    "segmented": SegmentedFSM,
+}
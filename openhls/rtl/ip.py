@@ -1,4 +1,3 @@
-from dataclasses import dataclass
 from textwrap import dedent
 from typing import Tuple
 
@@ -35,17 +34,16 @@ def generate_flopoco_fp(op_type, instance_name, id, signal_width, x, y, r, keep)
 #             """
 
 
-IP_ID = 0
-
-
 class IP:
     def __init__(
-        self, op_type: OpType, pe_idx: Tuple[int, ...], signal_width: int, keep=KEEP_IPS
+        self,
+        op_type: OpType,
+        pe_idx: Tuple[int, ...],
+        signal_width: int,
+        keep=KEEP_IPS,
+        id=1,
     ):
-        global IP_ID
-        IP_ID += 1
-
-        self.id = IP_ID
+        self.id = id
         self.op_type = op_type
         self.pe_idx_str = "_".join(map(str, pe_idx))
         self.signal_width = signal_width
@@ -55,9 +53,14 @@ class IP:
 
 class BinOpIp(IP):
     def __init__(
-        self, op_type: OpType, pe_idx: Tuple[int, ...], signal_width: int, keep=KEEP_IPS
+        self,
+        op_type: OpType,
+        pe_idx: Tuple[int, ...],
+        signal_width: int,
+        keep=KEEP_IPS,
+        id=1,
     ):
-        super().__init__(op_type, pe_idx, signal_width, keep)
+        super().__init__(op_type, pe_idx, signal_width, keep, id)
         self.x = Reg(f"{self.instance_name}_x", signal_width)
         self.y = Reg(f"{self.instance_name}_y", signal_width)
         self.r = Wire(f"{self.instance_name}_r", signal_width)
@@ -84,28 +87,28 @@ class BinOpIp(IP):
 
 
 class FAdd(BinOpIp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.ADD, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.ADD, pe_idx, signal_width, id=id)
 
 
 class FSub(BinOpIp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.SUB, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.SUB, pe_idx, signal_width, id=id)
 
 
 class FMul(BinOpIp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.MUL, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.MUL, pe_idx, signal_width, id=id)
 
 
 class FDiv(BinOpIp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.DIV, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.DIV, pe_idx, signal_width, id=id)
 
 
 class FMax(BinOpIp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.MAX, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.MAX, pe_idx, signal_width, id=id)
 
 
 def generate_unary(op_type, id, signal_width, instance_name, x, r):
@@ -123,9 +126,14 @@ def generate_unary(op_type, id, signal_width, instance_name, x, r):
 
 class UnaryOp(IP):
     def __init__(
-        self, op_type: OpType, pe_idx: Tuple[int, ...], signal_width: int, keep=True
+        self,
+        op_type: OpType,
+        pe_idx: Tuple[int, ...],
+        signal_width: int,
+        keep=True,
+        id=1,
     ):
-        super().__init__(op_type, pe_idx, signal_width, keep)
+        super().__init__(op_type, pe_idx, signal_width, keep, id)
         self.x = Reg(f"{self.instance_name}_x", signal_width)
         self.r = Wire(f"{self.instance_name}_r", signal_width)
 
@@ -148,31 +156,54 @@ class UnaryOp(IP):
 
 
 class ReLU(UnaryOp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.RELU, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.RELU, pe_idx, signal_width, id=id)
 
 
 class Sqrt(UnaryOp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.SQRT, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.SQRT, pe_idx, signal_width, id=id)
 
 
 class Neg(UnaryOp):
-    def __init__(self, pe_idx, signal_width):
-        super().__init__(OpType.NEG, pe_idx, signal_width)
+    def __init__(self, pe_idx, signal_width, id=1):
+        super().__init__(OpType.NEG, pe_idx, signal_width, id=id)
+
+
+# in the order their ids are assigned
+PE_IPS = {
+    "fadd": FAdd,
+    "fdiv": FDiv,
+    "fmul": FMul,
+    "fsub": FSub,
+    "fmax": FMax,
+    "frelu": ReLU,
+    "fsqrt": Sqrt,
+    "fneg": Neg,
+}
 
 
-@dataclass(frozen=True)
 class PE:
-    fadd: FAdd
-    fdiv: FDiv
-    fmul: FMul
-    fsub: FSub
-    fmax: FMax
-    frelu: ReLU
-    fsqrt: Sqrt
-    fneg: Neg
-    idx: Tuple[int, ...]
+    # ips are made on first use; ids are reserved for all of them so they don't depend on which
+    # ones a pe uses
+    n_ips = len(PE_IPS)
+
+    def __init__(self, idx: Tuple[int, ...], signal_width, first_id=1):
+        self.idx = idx
+        self.signal_width = signal_width
+        self.first_id = first_id
+        self._ips = {}
+
+    def __getattr__(self, name):
+        if name not in PE_IPS:
+            raise AttributeError(name)
+        if name not in self._ips:
+            self._ips[name] = PE_IPS[name](
+                self.idx,
+                self.signal_width,
+                id=self.first_id + list(PE_IPS).index(name),
+            )
+        return self._ips[name]
 
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import abc
+import hashlib
 import os
 import re
 import shutil
@@ -59,8 +60,8 @@ class Simulator(abc.ABC):
     def set_env(self) -> None:
         """Set environment variables for sub-processes."""
 
-        for e in os.environ:
-            self.env[e] = os.environ[e]
+        # the test's own env (e.g. a shard's TB_RANDOM) goes on top of the inherited one
+        self.env = {**os.environ, **self.env}
 
         if "LIBPYTHON_LOC" not in self.env:
             self.env["LIBPYTHON_LOC"] = cocotb._vendor.find_libpython.find_libpython()
@@ -88,6 +89,11 @@ class Simulator(abc.ABC):
 
         raise NotImplementedError()
 
+    def build_output(self) -> Optional[PathLike]:
+        """Return the file the build produces (if the simulator has a single one)."""
+
+        return None
+
     def build(
         self,
         library_name: str = "work",
@@ -123,8 +129,36 @@ class Simulator(abc.ABC):
         for e in os.environ:
             self.env[e] = os.environ[e]
 
+        # compile() rewrites the generated sources (and copies the cores) every time, so
+        # their mtimes say nothing; the build is skipped only if what goes into it is unchanged
+        build_hash = sources_hash(
+            self.verilog_sources + self.vhdl_sources,
+            type(self).__name__,
+            self.library_name,
+            self.includes,
+            self.defines,
+            sorted(self.parameters.items()),
+            self.compile_args,
+            self.hdl_toplevel,
+        )
+        stamp_file = os.path.join(self.build_dir, "build.sha256")
+        build_output = self.build_output()
+        if (
+            not self.always
+            and (build_output is None or os.path.isfile(build_output))
+            and read_stamp(stamp_file) == build_hash
+        ):
+            print(f"INFO: Skipping build, sources unchanged: {self.build_dir}")
+            return
+        # i.e., no mtime based skipping in build_command either
+        self.always = True
+
+        with suppress(OSError):
+            os.remove(stamp_file)
         cmds = self.build_command()
         self.execute(cmds, cwd=self.build_dir)
+        with open(stamp_file, "w") as f:
+            f.write(build_hash)
 
     def test(
         self,
@@ -199,8 +233,9 @@ class Simulator(abc.ABC):
             self.current_test_name = "test"
             results_xml_name = "results.xml"
 
+        # in the sim dir so that runs sharing a build don't clobber each other's results
         results_xml_file = os.getenv(
-            "COCOTB_RESULTS_FILE", os.path.join(self.build_dir, results_xml_name)
+            "COCOTB_RESULTS_FILE", os.path.join(self.sim_dir, results_xml_name)
         )
 
         self.env["COCOTB_RESULTS_FILE"] = results_xml_file
@@ -302,6 +337,38 @@ def outdated(output: PathLike, dependencies: Sequence[PathLike]) -> bool:
     return False
 
 
+def sources_hash(sources: Sequence[PathLike], *inputs: object) -> str:
+    """Return a hash of the contents of *sources* (in order) and of *inputs*."""
+
+    h = hashlib.sha256()
+
+    def update(b: bytes) -> None:
+        h.update(len(b).to_bytes(8, "little"))
+        h.update(b)
+
+    for source in sources:
+        update(os.fsencode(source))
+        source_h = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                source_h.update(block)
+        update(source_h.digest())
+    for inp in inputs:
+        update(repr(inp).encode())
+
+    return h.hexdigest()
+
+
+def read_stamp(stamp_file: PathLike) -> Optional[str]:
+    """Return the hash recorded by the last successful build, if any."""
+
+    try:
+        with open(stamp_file) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
 def get_abs_paths(paths: Sequence[PathLike]) -> List[str]:
     """Return list of *paths* in absolute form."""
 
@@ -349,6 +416,9 @@ class Icarus(Simulator):
     def sim_file(self) -> PathLike:
         return os.path.join(self.build_dir, "sim.vvp")
 
+    def build_output(self) -> PathLike:
+        return self.sim_file
+
     def test_command(self) -> List[Command]:
 
         return [
@@ -792,6 +862,9 @@ class Verilator(Simulator):
 
         return cmd
 
+    def build_output(self) -> PathLike:
+        return os.path.join(self.build_dir, self.hdl_toplevel)
+
     def test_command(self) -> List[Command]:
         out_file = os.path.join(self.build_dir, self.sim_toplevel)
         return [[out_file] + self.plus_args]
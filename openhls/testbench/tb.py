@@ -14,13 +14,8 @@ from cocotb.handle import ModifiableObject
 from cocotb.triggers import FallingEdge
 from cocotb.triggers import Timer
 
-from openhls.compiler.runner import (
-    get_default_args,
-    get_py_module_args_globals,
-    run_model_with_fp_number,
-)
+from openhls.compiler.runner import make_test_vectors
 from openhls.flopoco.convert_flopoco import convert_flopoco_binary_str_to_float
-from openhls.flopoco.ops import MemRef as FPMemRef
 from openhls.util import import_module_from_fp
 
 logger = logging.getLogger(__file__)
@@ -38,37 +33,58 @@ async def reset_dut(dut, duration_ns):
 FIXED = np.linspace(0, 0.1, 11)
 
 
-def set_inputs(mod, width_exponent, width_fraction, dut=None):
-    args = get_default_args(mod.forward)
-    input_memrefs, *_ = get_py_module_args_globals(args)
-    test_inputs = {}
-    for inp_name, inp_memref in input_memrefs.items():
-        test_inputs[inp_name] = np.random.randn(*inp_memref.shape)
-        # test_inputs[inp_name] = np.random.random(inp_memref.shape)
-        # test_inputs[inp_name][test_inputs[inp_name] < -1] = -1
-        # test_inputs[inp_name][test_inputs[inp_name] > 1] = 1
-        # test_inputs[inp_name] = np.random.randint(-10, 10, (inp_memref.shape))
-        # test_inputs[inp_name] = np.ones(inp_memref.shape) * 1
-
-    test_inputs, outputs = run_model_with_fp_number(
-        mod, test_inputs, width_exponent=width_exponent, width_fraction=width_fraction
-    )
+def vector_at(val, i):
+    return val.at(i) if val.is_tile else val
+
+
+def binstrs(val, n_test_vectors):
+    return np.broadcast_to(val.fp.binstr(), (n_test_vectors,))
+
+
+def set_inputs(dut, input_binstrs, i):
+    for inp_name, bstrs in input_binstrs.items():
+        mod_obj = getattr(dut, inp_name)
+        vec = BinaryValue(
+            value=bstrs[i],
+            n_bits=None,
+            bigEndian=True,
+            binaryRepresentation=BinaryRepresentation.UNSIGNED,
+        )
+        mod_obj.setimmediatevalue(vec)
 
-    if dut is not None:
-        for _, inp_memref in test_inputs.items():
-            for inp_name, fpval in inp_memref.val_names_map.items():
-                inp_name = inp_name.replace("%", "p_")
-                if hasattr(dut, inp_name):
-                    mod_obj = getattr(dut, inp_name)
-                    vec = BinaryValue(
-                        value=fpval.fp.binstr(),
-                        n_bits=None,
-                        bigEndian=True,
-                        binaryRepresentation=BinaryRepresentation.UNSIGNED,
-                    )
-                    mod_obj.setimmediatevalue(vec)
 
-    return test_inputs, outputs
+def check_outputs(outputs, output_binstrs, vec_idx, debug, width_exponent, width_fraction):
+    n_wrong = 0
+    for (output_wire, output), expected_binstrs in zip(outputs, output_binstrs):
+        measured_output = output_wire.value.binstr
+        if measured_output != expected_binstrs[vec_idx]:
+            n_wrong += 1
+
+        if debug:
+            output = vector_at(output, vec_idx)
+            try:
+                measured_output_str = f"{convert_flopoco_binary_str_to_float(measured_output, width_exponent, width_fraction)}:{measured_output}"
+            except:
+                measured_output_str = f"UNICODE_ERROR:{measured_output}"
+            expected_output_str = f"{output.fp}"
+            print(output_wire._name)
+            print("equal", measured_output == expected_binstrs[vec_idx])
+            print("measured output", measured_output_str)
+            print(
+                "expected output fp", expected_output_str.replace("<FPNumber ", "").replace(">", "")
+            )
+            print(
+                "expected output ieee", output.ieee
+            )
+            print("*" * 10)
+    return n_wrong
+
+
+def set_waves(dut, waves_windows, i, waves_on):
+    on = any(start <= i <= end for start, end in waves_windows)
+    if on != waves_on:
+        dut.openhls_waves_on.value = int(on)
+    return on
 
 
 def get_tolerance(width_exponent, width_fraction):
@@ -82,6 +98,7 @@ def get_tolerance(width_exponent, width_fraction):
 async def test_tb(dut):
     MAX_FSM_STAGE = int(os.getenv("MAX_FSM_STAGE"))  # 16
     LATENCY = MAX_FSM_STAGE + 1
+    II = int(os.getenv("II", "0"))
     TEST_VECTORS = int(os.getenv("N_TEST_VECTORS"))
     WIDTH_EXPONENT = int(os.getenv("WIDTH_EXPONENT"))
     WIDTH_FRACTION = int(os.getenv("WIDTH_FRACTION"))
@@ -89,6 +106,8 @@ async def test_tb(dut):
     THRESHOLD = float(os.getenv("THRESHOLD", "0"))
     TB_RANDOM = int(os.getenv("TB_RANDOM", "1"))
     DEBUG = bool(int(os.getenv("DEBUG", "0")))
+    # only these vectors' cycles are dumped (when the waves are windowed)
+    WAVES_VECTORS = {int(k) for k in os.getenv("WAVES_VECTORS", "").split(",") if k}
     OUTPUT_MAP = {
         val_name: (arr_name, tuple(idx))
         for val_name, (arr_name, idx) in json.loads(
@@ -100,6 +119,9 @@ async def test_tb(dut):
     np.random.seed(TB_RANDOM)
 
     module = import_module_from_fp("test_module", MODULE_FP)
+    test_inputs, expected_outputs = make_test_vectors(
+        module, TEST_VECTORS, WIDTH_EXPONENT, WIDTH_FRACTION
+    )
 
     clock = Clock(dut.clk, 2, units="ns")  # Create a 2ns period clock on port clk
     cocotb.start_soon(clock.start())  # Start the clock
@@ -109,75 +131,111 @@ async def test_tb(dut):
     output_wires = {
         name: mod_obj for name, mod_obj in dut._sub_handles.items() if "output" in name
     }
+    input_binstrs = {}
+    for _, inp_memref in test_inputs.items():
+        for inp_name, fpval in inp_memref.val_names_map.items():
+            inp_name = inp_name.replace("%", "p_")
+            if hasattr(dut, inp_name):
+                input_binstrs[inp_name] = binstrs(fpval, TEST_VECTORS)
+    outputs = [
+        (
+            wire,
+            expected_outputs[OUTPUT_MAP[wire_name][0]].registers[
+                OUTPUT_MAP[wire_name][1]
+            ],
+        )
+        for wire_name, wire in sorted(
+            output_wires.items(),
+            key=lambda wire_name_: int(wire_name_[0].split("_")[-1]),
+        )
+    ]
+    output_binstrs = [binstrs(output, TEST_VECTORS) for _, output in outputs]
 
     await FallingEdge(dut.clk)
     await FallingEdge(dut.clk)
 
     n_wrong = 0
-
-    for i in range(LATENCY * TEST_VECTORS):
-        if i % LATENCY == 0:
-            test_inputs, expected_outputs = set_inputs(
-                module, WIDTH_EXPONENT, WIDTH_FRACTION, dut
-            )
-            if DEBUG:
-                for arr_name, input in test_inputs.items():
-                    if hasattr(input, "input") and input.input:
+    wrong_vectors = []
+    if II:
+        waves_windows = [(k * II + 1, k * II + MAX_FSM_STAGE) for k in WAVES_VECTORS]
+    else:
+        waves_windows = [(k * LATENCY, (k + 1) * LATENCY - 1) for k in WAVES_VECTORS]
+    waves_on = False
+
+    # pipelined (modulo scheduled) modules take a vector every II cycles (and aren't reset in
+    # between); vector k's inputs go in at i = k * II + 1 and its outputs are checked at
+    # i = k * II + MAX_FSM_STAGE, i.e., at the same point of its stages as when not pipelined
+    if II:
+        for i in range(II * (TEST_VECTORS - 1) + MAX_FSM_STAGE + 1):
+            waves_on = set_waves(dut, waves_windows, i, waves_on)
+            if i >= MAX_FSM_STAGE and (i - MAX_FSM_STAGE) % II == 0:
+                vec_idx = (i - MAX_FSM_STAGE) // II
+                vec_wrong = check_outputs(
+                    outputs, output_binstrs, vec_idx, DEBUG, WIDTH_EXPONENT, WIDTH_FRACTION
+                )
+                n_wrong += vec_wrong
+                if vec_wrong:
+                    wrong_vectors.append([TB_RANDOM, vec_idx])
+                print("click", i)
+            if i == 0:
+                dut.rst.value = 1
+            elif i == 1:
+                dut.rst.value = 0
+            if i >= 1 and (i - 1) % II == 0 and (i - 1) // II < TEST_VECTORS:
+                set_inputs(dut, input_binstrs, (i - 1) // II)
+
+            await FallingEdge(dut.clk)
+    else:
+        for i in range(LATENCY * TEST_VECTORS):
+            waves_on = set_waves(dut, waves_windows, i, waves_on)
+            vec_idx = i // LATENCY
+            if i % LATENCY == 0:
+                set_inputs(dut, input_binstrs, vec_idx)
+                if DEBUG:
+                    for arr_name, input in test_inputs.items():
+                        if hasattr(input, "input") and input.input:
+                            print(
+                                "input",
+                                arr_name,
+                                [
+                                    vector_at(v, vec_idx)
+                                    for v in input.registers.flatten()
+                                ],
+                            )
+                    for arr_name, expected_output in expected_outputs.items():
                         print(
-                            "input",
+                            "expected output",
                             arr_name,
-                            list(input.registers.flatten() if isinstance(input, FPMemRef) else input.global_array.flatten()),
+                            [
+                                vector_at(v, vec_idx)
+                                for v in expected_output.registers.flatten()
+                            ],
                         )
-                for arr_name, expected_output in expected_outputs.items():
-                    print(
-                        "expected output",
-                        arr_name,
-                        list(expected_output.registers.flatten()),
-                    )
-            dut.rst.value = 1
-        elif i % LATENCY == 1:
-            dut.rst.value = 0
-        elif i % LATENCY == LATENCY - 1:
-            for output_wire, output in [
-                (
-                    wire,
-                    expected_outputs[OUTPUT_MAP[wire_name][0]].registers[
-                        OUTPUT_MAP[wire_name][1]
-                    ],
-                )
-                for wire_name, wire in sorted(
-                    output_wires.items(),
-                    key=lambda wire_name_: int(wire_name_[0].split("_")[-1]),
+                dut.rst.value = 1
+            elif i % LATENCY == 1:
+                dut.rst.value = 0
+            elif i % LATENCY == LATENCY - 1:
+                vec_wrong = check_outputs(
+                    outputs, output_binstrs, vec_idx, DEBUG, WIDTH_EXPONENT, WIDTH_FRACTION
                 )
-            ]:
-                measured_output = output_wire.value.binstr
-                expected_output = output.fp
-                if measured_output != expected_output.binstr():
-                    n_wrong += 1
-
-                if DEBUG:
-                    try:
-                        measured_output_str = f"{convert_flopoco_binary_str_to_float(measured_output, WIDTH_EXPONENT, WIDTH_FRACTION)}:{measured_output}"
-                    except:
-                        measured_output_str = f"UNICODE_ERROR:{measured_output}"
-                    expected_output_str = f"{expected_output}"
-                    print(output_wire._name)
-                    print("equal", measured_output == expected_output.binstr())
-                    print("measured output", measured_output_str)
-                    print(
-                        "expected output fp", expected_output_str.replace("<FPNumber ", "").replace(">", "")
-                    )
-                    print(
-                        "expected output ieee", output.ieee
-                    )
-                    print("*" * 10)
-
-            print("click", i)
-
-        await FallingEdge(dut.clk)
+                n_wrong += vec_wrong
+                if vec_wrong:
+                    wrong_vectors.append([TB_RANDOM, vec_idx])
+                print("click", i)
+
+            await FallingEdge(dut.clk)
+
+    total = TEST_VECTORS * len(output_wires)
+    RESULTS_FP = os.getenv("RESULTS_FP")
+    if RESULTS_FP:
+        with open(RESULTS_FP, "w") as f:
+            # (seed, vector) of the first few wrong vectors, e.g., to dump just their waves
+            json.dump(
+                {"n_wrong": n_wrong, "total": total, "wrong_vectors": wrong_vectors[:100]},
+                f,
+            )
 
     if THRESHOLD:
-        total = TEST_VECTORS * len(output_wires)
         num_all_vals = n_wrong / total
         print(
             "threshold",
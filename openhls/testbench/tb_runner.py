@@ -4,11 +4,23 @@ import logging
 import os
 import os.path
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from xml.etree import ElementTree as ET
 
 import numpy as np
 
+from openhls.config import (
+    SIMULATOR,
+    TB_SHARDS,
+    WAVES,
+    WAVES_FORMAT,
+    WAVES_MAX_VECTORS,
+    WAVES_SCOPE,
+)
 from openhls.testbench.cocotb_runner import get_runner
+from openhls.testbench.verilator_tb import verilator_testbench_runner
+from openhls.testbench.waves import write_waves_module
 
 logger = logging.getLogger(__file__)
 
@@ -24,6 +36,13 @@ def testbench_runner(
     width_fraction,
     n_test_vectors=10,
     threshold=None,
+    ii=None,
+    simulator=SIMULATOR,
+    n_shards=TB_SHARDS,
+    waves=WAVES,
+    waves_scope=WAVES_SCOPE,
+    waves_format=WAVES_FORMAT,
+    waves_max_vectors=WAVES_MAX_VECTORS,
 ):
     proj_path = Path(proj_path).resolve()
     verilog_sources = [
@@ -38,9 +57,45 @@ def testbench_runner(
         proj_path / "flopoco_relu.sv",
         proj_path / "flopoco_neg.sv",
     ]
-    runner = get_runner("icarus")()
+    if simulator == "verilator":
+        if waves != "off":
+            logger.warning("The verilator harness doesn't dump waves; use icarus for those")
+        return verilator_testbench_runner(
+            proj_path,
+            module_fp,
+            verilog_sources,
+            sv_file_name,
+            top_level,
+            max_fsm_stage,
+            output_map,
+            width_exponent,
+            width_fraction,
+            n_test_vectors=n_test_vectors,
+            threshold=threshold,
+            ii=ii,
+        )
+    defines = []
+    plus_args = []
+    if waves != "off":
+        defines.append("OPENHLS_WAVES")
+        if waves_format == "fst" and simulator == "icarus":
+            plus_args.append("-fst")
+    if waves == "all":
+        waves_fp = write_waves_module(
+            proj_path,
+            top_level,
+            proj_path / sv_file_name,
+            waves_scope,
+            waves_format,
+            windowed=False,
+        )
+        build_sources = verilog_sources + [waves_fp]
+    else:
+        build_sources = verilog_sources
+    runner = get_runner(simulator)()
     runner.build(
-        verilog_sources=verilog_sources,
+        verilog_sources=build_sources,
+        defines=defines if waves == "all" else [],
         toplevel=top_level,
         build_dir=proj_path,
         # extra_args=[
@@ -51,27 +106,202 @@ def testbench_runner(
         #     "--trace",
         # ],
     )
+    env = {
+        "VIRTUAL_ENV": (Path(sys.executable) / "../..").resolve(),
+        "WIDTH_EXPONENT": str(width_exponent),
+        "WIDTH_FRACTION": str(width_fraction),
+        "MAX_FSM_STAGE": str(max_fsm_stage),
+        # streams a vector every II cycles (for modulo scheduled modules)
+        "II": str(ii or 0),
+        "N_TEST_VECTORS": str(n_test_vectors),
+        "MODULE_FP": module_fp,
+        "THRESHOLD": str(threshold if threshold is not None else 0),
+        "TB_RANDOM": os.getenv("TB_RANDOM", f"{np.random.randint(1, 100)}"),
+        "OUTPUT_MAP": json.dumps({str(k): v for k, v in output_map.items()}),
+        "RESULTS_FP": str(proj_path / "tb_results.json"),
+    }
+    n_shards = min(n_shards or os.cpu_count(), n_test_vectors)
+    try:
+        if n_shards <= 1:
+            runner.test(
+                toplevel=top_level,
+                python_search=[Path(__file__).parent.resolve()],
+                py_module="tb",
+                extra_env=env,
+                plus_args=plus_args if waves == "all" else [],
+                build_dir=proj_path,
+                sim_dir=proj_path,
+                waves=waves == "all",
+            )
+        else:
+            run_shards(
+                simulator,
+                proj_path,
+                top_level,
+                env,
+                n_test_vectors,
+                n_shards,
+                threshold,
+                plus_args if waves == "all" else [],
+                waves == "all",
+            )
+    finally:
+        # also (especially) when the wrong vectors failed the testbench
+        if waves == "failing":
+            dump_failing_waves(
+                simulator,
+                proj_path,
+                verilog_sources,
+                sv_file_name,
+                top_level,
+                env,
+                defines,
+                plus_args,
+                waves_scope,
+                waves_format,
+                waves_max_vectors,
+            )
+
+
+def run_shards(
+    simulator,
+    proj_path,
+    top_level,
+    env,
+    n_test_vectors,
+    n_shards,
+    threshold,
+    plus_args,
+    waves,
+):
+    # every shard runs the same elaborated design (the build above) in its own simulator process,
+    # with its own seed and sim dir (for its results.xml, tb_results.json and waves); the
+    # threshold is checked against the merged counts
+    def run_shard(shard_idx, n_shard_vectors):
+        shard_dir = proj_path / f"tb_shard_{shard_idx}"
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_runner = get_runner(simulator)()
+        try:
+            shard_runner.test(
+                toplevel=top_level,
+                python_search=[Path(__file__).parent.resolve()],
+                py_module="tb",
+                extra_env={
+                    **env,
+                    "N_TEST_VECTORS": str(n_shard_vectors),
+                    "THRESHOLD": "0",
+                    "TB_RANDOM": str(int(env["TB_RANDOM"]) + shard_idx),
+                    "RESULTS_FP": str(shard_dir / "tb_results.json"),
+                },
+                plus_args=plus_args,
+                build_dir=proj_path,
+                sim_dir=shard_dir,
+                waves=waves,
+            )
+        except SystemExit as e:
+            logger.error(f"Testbench shard {shard_idx} failed: {e}")
+        return shard_dir
+
+    logger.info(f"Running {n_test_vectors} test vectors in {n_shards} shards")
+    shard_sizes = [len(idxs) for idxs in np.array_split(range(n_test_vectors), n_shards)]
+    with ThreadPoolExecutor(n_shards) as pool:
+        shard_dirs = list(pool.map(run_shard, range(n_shards), shard_sizes))
+    merge_shard_results(proj_path, shard_dirs, threshold)
+
+
+def dump_failing_waves(
+    simulator,
+    proj_path,
+    verilog_sources,
+    sv_file_name,
+    top_level,
+    env,
+    defines,
+    plus_args,
+    waves_scope,
+    waves_format,
+    waves_max_vectors,
+):
+    # re-runs (the first few of) the wrong vectors, i.e., the vectors up to the last of them with
+    # the seed they were made with, with the waves dumped only while those are in flight; in its
+    # own build and sim dir so the plain build is still reused
+    try:
+        with open(proj_path / "tb_results.json") as f:
+            wrong_vectors = json.load(f).get("wrong_vectors", [])
+    except OSError:
+        logger.warning("No testbench results, so no waves for the wrong vectors")
+        return
+    if not wrong_vectors:
+        logger.info("No wrong vectors, so no waves")
+        return
+
+    seed = wrong_vectors[0][0]
+    vec_idxs = [k for s, k in wrong_vectors if s == seed][:waves_max_vectors]
+    waves_dir = proj_path / "waves"
+    os.makedirs(waves_dir, exist_ok=True)
+    waves_fp = write_waves_module(
+        waves_dir, top_level, proj_path / sv_file_name, waves_scope, waves_format, windowed=True
+    )
+    logger.info(f"Dumping waves for vectors {vec_idxs} (TB_RANDOM={seed}) in {waves_dir}")
+    runner = get_runner(simulator)()
+    runner.build(
+        verilog_sources=verilog_sources + [waves_fp],
+        defines=defines,
+        toplevel=top_level,
+        build_dir=waves_dir,
+    )
     runner.test(
         toplevel=top_level,
         python_search=[Path(__file__).parent.resolve()],
         py_module="tb",
         extra_env={
-            "VIRTUAL_ENV": (Path(sys.executable) / "../..").resolve(),
-            "WIDTH_EXPONENT": str(width_exponent),
-            "WIDTH_FRACTION": str(width_fraction),
-            "MAX_FSM_STAGE": str(max_fsm_stage),
-            "N_TEST_VECTORS": str(n_test_vectors),
-            "MODULE_FP": module_fp,
-            "THRESHOLD": str(threshold if threshold is not None else 0),
-            "TB_RANDOM": os.getenv("TB_RANDOM", f"{np.random.randint(1, 100)}"),
-            "OUTPUT_MAP": json.dumps({str(k): v for k, v in output_map.items()}),
+            **env,
+            "N_TEST_VECTORS": str(max(vec_idxs) + 1),
+            "THRESHOLD": "0",
+            "TB_RANDOM": str(seed),
+            "RESULTS_FP": str(waves_dir / "tb_results.json"),
+            "WAVES_VECTORS": ",".join(map(str, vec_idxs)),
         },
-        build_dir=proj_path,
-        sim_dir=proj_path,
+        plus_args=plus_args,
+        build_dir=waves_dir,
+        sim_dir=waves_dir,
         waves=True,
     )
 
 
+def merge_shard_results(proj_path, shard_dirs, threshold):
+    n_wrong = total = 0
+    wrong_vectors = []
+    failed = []
+    merged = ET.Element("testsuites", name="results")
+    for shard_dir in shard_dirs:
+        try:
+            with open(shard_dir / "tb_results.json") as f:
+                results = json.load(f)
+            shard_suites = ET.parse(shard_dir / "results.xml").getroot()
+        except (OSError, ET.ParseError):
+            failed.append(shard_dir.name)
+            continue
+        n_wrong += results["n_wrong"]
+        total += results["total"]
+        wrong_vectors += results.get("wrong_vectors", [])
+        for suite in shard_suites.iter("testsuite"):
+            suite.set("name", f"{suite.get('name', 'all')}.{shard_dir.name}")
+            merged.append(suite)
+    ET.ElementTree(merged).write(proj_path / "results.xml")
+    with open(proj_path / "tb_results.json", "w") as f:
+        json.dump(
+            {"n_wrong": n_wrong, "total": total, "wrong_vectors": wrong_vectors[:100]}, f
+        )
+
+    logger.info(f"{n_wrong}/{total} outputs wrong over {len(shard_dirs)} shards")
+    if failed:
+        raise SystemExit(f"ERROR: testbench shards {failed} terminated abnormally")
+    if threshold and total and n_wrong / total > threshold:
+        raise SystemExit(
+            f"ERROR: {n_wrong}/{total} outputs wrong (threshold {threshold})"
+        )
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("proj_path")
@@ -0,0 +1,357 @@
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+from openhls.compiler.runner import make_test_vectors
+from openhls.config import VERILATOR_THREADS
+from openhls.flopoco.convert_flopoco import convert_flopoco_binary_str_to_float
+from openhls.testbench.cocotb_runner import read_stamp, sources_hash
+from openhls.util import import_module_from_fp
+
+logger = logging.getLogger(__name__)
+
+port_re = re.compile(r"(input|output) wire \[\d+:0\] (\w+);")
+
+# flat designs are one huge eval function so the c++ is split up (so make -j has something to
+# do) and only lightly optimized (gcc's -O2 and up are superlinear in function size); x's are
+# two state anyway so assigning them whatever is fastest is safe
+VERILATOR_ARGS = [
+    "-O3",
+    "--x-assign",
+    "fast",
+    "--x-initial",
+    "fast",
+    "--noassert",
+    "-Wno-fatal",
+    "-Wno-lint",
+    "-Wno-style",
+    "--output-split",
+    "20000",
+    "--output-split-cfuncs",
+    "20000",
+    "-CFLAGS",
+    "-O1 -fno-var-tracking-assignments",
+]
+
+HARNESS = """\
+#include <cstdint>
+#include <cstdio>
+#include <memory>
+#include <vector>
+
+#include "verilated.h"
+#include "V{top_level}.h"
+
+static const uint64_t MAX_FSM_STAGE = {max_fsm_stage};
+static uint64_t II = {ii};
+static const uint64_t N_INPUTS = {n_inputs};
+static const uint64_t N_OUTPUTS = {n_outputs};
+
+static void set_inputs(V{top_level} *top, const uint64_t *in) {{
+{set_inputs}
+}}
+
+static void get_outputs(V{top_level} *top, uint64_t *out) {{
+{get_outputs}
+}}
+
+// the tb's clock starts high, i.e., its edges are falling then rising
+static void next_falling_edge(V{top_level} *top) {{
+  top->clk = 1;
+  top->eval();
+  top->clk = 0;
+  top->eval();
+}}
+
+int main(int argc, char **argv) {{
+  if (argc != 3) {{
+    fprintf(stderr, "usage: %s VECTORS_FP REPORT_FP\\n", argv[0]);
+    return 2;
+  }}
+  FILE *vectors_f = fopen(argv[1], "rb");
+  uint64_t header[3];
+  if (!vectors_f || fread(header, sizeof(uint64_t), 3, vectors_f) != 3 ||
+      header[1] != N_INPUTS || header[2] != N_OUTPUTS) {{
+    fprintf(stderr, "bad test vectors %s\\n", argv[1]);
+    return 2;
+  }}
+  const uint64_t n_vectors = header[0];
+  std::vector<uint64_t> inputs(n_vectors * N_INPUTS), expected(n_vectors * N_OUTPUTS);
+  if (fread(inputs.data(), sizeof(uint64_t), inputs.size(), vectors_f) != inputs.size() ||
+      fread(expected.data(), sizeof(uint64_t), expected.size(), vectors_f) != expected.size()) {{
+    fprintf(stderr, "truncated test vectors %s\\n", argv[1]);
+    return 2;
+  }}
+  fclose(vectors_f);
+
+  // (vector, output, measured) per wrong output
+  FILE *report_f = fopen(argv[2], "wb");
+  uint64_t n_wrong = 0;
+  std::vector<uint64_t> measured(N_OUTPUTS);
+
+  Verilated::commandArgs(argc, argv);
+  std::unique_ptr<V{top_level}> top(new V{top_level});
+  auto check = [&](uint64_t vec_idx) {{
+    get_outputs(top.get(), measured.data());
+    for (uint64_t j = 0; j < N_OUTPUTS; j++) {{
+      if (measured[j] != expected[vec_idx * N_OUTPUTS + j]) {{
+        uint64_t record[3] = {{vec_idx, j, measured[j]}};
+        fwrite(record, sizeof(uint64_t), 3, report_f);
+        n_wrong++;
+      }}
+    }}
+  }};
+
+  // the tb's first falling edge and then the two it waits out before starting
+  top->clk = 1;
+  top->rst = 0;
+  top->eval();
+  top->clk = 0;
+  top->eval();
+  next_falling_edge(top.get());
+  next_falling_edge(top.get());
+
+  // same stimulus, cycle for cycle, as tb.py
+  if (II) {{
+    for (uint64_t i = 0; i < II * (n_vectors - 1) + MAX_FSM_STAGE + 1; i++) {{
+      if (i >= MAX_FSM_STAGE && (i - MAX_FSM_STAGE) % II == 0)
+        check((i - MAX_FSM_STAGE) / II);
+      if (i == 0)
+        top->rst = 1;
+      else if (i == 1)
+        top->rst = 0;
+      if (i >= 1 && (i - 1) % II == 0 && (i - 1) / II < n_vectors)
+        set_inputs(top.get(), &inputs[(i - 1) / II * N_INPUTS]);
+      top->eval();
+      next_falling_edge(top.get());
+    }}
+  }} else {{
+    const uint64_t latency = MAX_FSM_STAGE + 1;
+    for (uint64_t i = 0; i < latency * n_vectors; i++) {{
+      const uint64_t vec_idx = i / latency;
+      if (i % latency == 0) {{
+        set_inputs(top.get(), &inputs[vec_idx * N_INPUTS]);
+        top->rst = 1;
+      }} else if (i % latency == 1) {{
+        top->rst = 0;
+      }} else if (i % latency == latency - 1) {{
+        check(vec_idx);
+      }}
+      top->eval();
+      next_falling_edge(top.get());
+    }}
+  }}
+
+  top->final();
+  fclose(report_f);
+  printf("n_wrong %lu total %lu\\n", (unsigned long)n_wrong,
+         (unsigned long)(n_vectors * N_OUTPUTS));
+  return 0;
+}}
+"""
+
+
+def verilator_name(name):
+    # the c++ name verilator gives a port (AstNode::encodeName), e.g., p__arg0 is p___05Farg0
+    out = []
+    i = 0
+    while i < len(name):
+        c = name[i]
+        if c.isalnum() and not (i == 0 and c.isdigit()):
+            out.append(c)
+        elif c == "_":
+            if name[i + 1 : i + 2] == "_":
+                out.append("___05F")
+                i += 1
+            elif i == len(name) - 1:
+                out.append("__05F")
+            else:
+                out.append(c)
+        else:
+            out.append(f"__0{ord(c):02X}")
+        i += 1
+    return "".join(out)
+
+
+def read_ports(sv_fp):
+    # the top module's (data) ports, in declaration order
+    inputs, outputs = [], []
+    with open(sv_fp) as f:
+        for line in f:
+            port = port_re.search(line)
+            if port is not None:
+                (inputs if port.group(1) == "input" else outputs).append(port.group(2))
+            elif outputs:
+                break
+    return inputs, outputs
+
+
+def make_harness(top_level, inputs, outputs, max_fsm_stage, ii):
+    return HARNESS.format(
+        top_level=top_level,
+        max_fsm_stage=max_fsm_stage,
+        ii=ii or 0,
+        n_inputs=len(inputs),
+        n_outputs=len(outputs),
+        set_inputs="\n".join(
+            f"  top->{verilator_name(inp)} = in[{j}];" for j, inp in enumerate(inputs)
+        ),
+        get_outputs="\n".join(
+            f"  out[{j}] = top->{verilator_name(outp)};" for j, outp in enumerate(outputs)
+        ),
+    )
+
+
+def val_bits(val, n_test_vectors):
+    # what the cocotb tb compares against, i.e., binstr's (canonical) bits
+    if val.is_tile:
+        bits = val.fp.canonical_bits().astype(np.uint64)
+    else:
+        bits = np.uint64(int(val.fp.binstr(), 2))
+    return np.broadcast_to(bits, (n_test_vectors,))
+
+
+def write_test_vectors(
+    vectors_fp,
+    module_fp,
+    inputs,
+    outputs,
+    output_map,
+    n_test_vectors,
+    width_exponent,
+    width_fraction,
+    seed,
+):
+    # the same vectors as tb.py makes for the same seed, as uint64 words: n vectors, n inputs,
+    # n outputs, then the inputs and the expected outputs, both vector major
+    np.random.seed(seed)
+    module = import_module_from_fp("test_module", module_fp)
+    test_inputs, expected_outputs = make_test_vectors(
+        module, n_test_vectors, width_exponent, width_fraction
+    )
+    input_vals = {}
+    for memref in test_inputs.values():
+        for inp_name, val in memref.val_names_map.items():
+            input_vals[inp_name.replace("%", "p_")] = val
+    missing = [inp for inp in inputs if inp not in input_vals]
+    if missing:
+        raise KeyError(f"no test vectors for inputs {missing[:10]}")
+
+    input_bits = np.zeros((n_test_vectors, len(inputs)), dtype="<u8")
+    for j, inp in enumerate(inputs):
+        input_bits[:, j] = val_bits(input_vals[inp], n_test_vectors)
+    output_bits = np.zeros((n_test_vectors, len(outputs)), dtype="<u8")
+    for j, outp in enumerate(outputs):
+        arr_name, idx = output_map[outp]
+        output_bits[:, j] = val_bits(
+            expected_outputs[arr_name].registers[tuple(idx)], n_test_vectors
+        )
+    with open(vectors_fp, "wb") as f:
+        np.array([n_test_vectors, len(inputs), len(outputs)], dtype="<u8").tofile(f)
+        input_bits.tofile(f)
+        output_bits.tofile(f)
+    return output_bits
+
+
+def build(proj_path, verilog_sources, top_level, harness_fp, threads=VERILATOR_THREADS):
+    verilator = shutil.which("verilator")
+    if verilator is None:
+        raise SystemExit("ERROR: verilator executable not found!")
+    obj_dir = proj_path / "obj_dir"
+    cmd = (
+        [verilator, "--cc", "--exe", "--build", "-j", "0"]
+        + VERILATOR_ARGS
+        + (["--threads", str(threads)] if threads > 1 else [])
+        + ["--top-module", top_level, "-Mdir", str(obj_dir)]
+        + ["-o", f"V{top_level}_harness", str(harness_fp)]
+        + [str(s) for s in verilog_sources]
+    )
+    exe = obj_dir / f"V{top_level}_harness"
+    # the harness is regenerated every run too, so it's hashed along with the sources
+    build_hash = sources_hash([harness_fp] + list(verilog_sources), cmd[1:])
+    stamp_file = obj_dir / "build.sha256"
+    if exe.exists() and read_stamp(stamp_file) == build_hash:
+        logger.info(f"Skipping verilator build of {top_level}, sources unchanged")
+        return exe
+
+    logger.info(f"Building {top_level} with verilator")
+    if stamp_file.exists():
+        stamp_file.unlink()
+    subprocess.run(cmd, cwd=proj_path, check=True)
+    with open(stamp_file, "w") as f:
+        f.write(build_hash)
+    return exe
+
+
+def verilator_testbench_runner(
+    proj_path,
+    module_fp,
+    verilog_sources,
+    sv_file_name,
+    top_level,
+    max_fsm_stage,
+    output_map,
+    width_exponent,
+    width_fraction,
+    n_test_vectors=10,
+    threshold=None,
+    ii=None,
+):
+    # the vectors are made and written once, the harness (generated for the module's ports)
+    # streams them through the verilated model and only the wrong outputs come back
+    proj_path = Path(proj_path).resolve()
+    signal_width = width_exponent + width_fraction + 3
+    assert signal_width <= 64, "ports are passed as 64 bit words"
+    inputs, outputs = read_ports(proj_path / sv_file_name)
+    # the tb's (i.e., output val id) order
+    outputs.sort(key=lambda outp: int(outp.split("_")[-1]))
+
+    harness_fp = proj_path / f"{top_level}_harness.cpp"
+    with open(harness_fp, "w") as f:
+        f.write(make_harness(top_level, inputs, outputs, max_fsm_stage, ii))
+    exe = build(proj_path, verilog_sources, top_level, harness_fp)
+
+    seed = int(os.getenv("TB_RANDOM") or np.random.randint(1, 100))
+    # the golden model picks the flopoco fmacs off of this
+    os.environ["TB_RANDOM"] = str(seed)
+    logger.info(f"TB_RANDOM={seed}")
+    vectors_fp = proj_path / "tb_vectors.bin"
+    report_fp = proj_path / "tb_report.bin"
+    expected = write_test_vectors(
+        vectors_fp,
+        module_fp,
+        inputs,
+        outputs,
+        output_map,
+        n_test_vectors,
+        width_exponent,
+        width_fraction,
+        seed,
+    )
+    subprocess.run([str(exe), str(vectors_fp), str(report_fp)], cwd=proj_path, check=True)
+
+    report = np.fromfile(report_fp, dtype="<u8").reshape(-1, 3)
+    n_wrong = len(report)
+    total = n_test_vectors * len(outputs)
+    for vec_idx, j, measured in report[:10]:
+        measured_str = format(int(measured), f"0{signal_width}b")
+        expected_str = format(int(expected[vec_idx, j]), f"0{signal_width}b")
+        logger.debug(
+            f"vector {vec_idx} {outputs[j]}: measured "
+            f"{convert_flopoco_binary_str_to_float(measured_str, width_exponent, width_fraction)}:{measured_str} "
+            f"expected {convert_flopoco_binary_str_to_float(expected_str, width_exponent, width_fraction)}:{expected_str}"
+        )
+    logger.info(f"{n_wrong}/{total} outputs wrong")
+    with open(proj_path / "tb_results.json", "w") as f:
+        json.dump({"n_wrong": n_wrong, "total": total}, f)
+
+    if threshold and n_wrong / total > threshold:
+        raise SystemExit(
+            f"ERROR: {n_wrong}/{total} outputs wrong (threshold {threshold})"
+        )
@@ -0,0 +1,70 @@
+import fnmatch
+import logging
+import re
+from pathlib import Path
+from textwrap import dedent
+
+from openhls.rtl.emit_verilog import WAVES_ON_REG
+
+logger = logging.getLogger(__name__)
+
+decl_re = re.compile(r"^\s*(?:input |output )?(?:reg|wire)\s*(?:\[\d+:0\])?\s*(\w+)")
+instance_re = re.compile(r"^\s*\w+\s+#\(\d+\)\s+(\w+)\s*\(")
+
+
+def module_signals(sv_fp):
+    # the (flat) module's regs, wires, ports and ip instances
+    signals = []
+    with open(sv_fp) as f:
+        for line in f:
+            m = decl_re.match(line) or instance_re.match(line)
+            if m is not None:
+                signals.append(m.group(1))
+    return signals
+
+
+def select_signals(signals, scope):
+    # scope is glob patterns over the signals' names, e.g., *_0_0_0_0_1_* for one pe's ip inputs
+    # and outputs; no patterns is everything
+    if not scope:
+        return None
+    return [s for s in signals if any(fnmatch.fnmatchcase(s, p) for p in scope)]
+
+
+def write_waves_module(out_dir, top_level, sv_fp, scope, fmt, windowed):
+    # a separate root module that dumps (hierarchically) from the top level, so that the emitted
+    # module doesn't change with what's dumped; the dump goes in the sim dir (i.e., a shard's own)
+    signals = select_signals(module_signals(sv_fp), scope)
+    if signals is None:
+        dumpvars = top_level
+    elif signals:
+        dumpvars = ", ".join(f"{top_level}.{s}" for s in signals)
+        logger.info(f"Dumping {len(signals)} signals matching {' '.join(scope)}")
+    else:
+        raise ValueError(f"no signals in {sv_fp} match {' '.join(scope)}")
+    waves_sv = dedent(
+        f"""\
+        module {top_level}_waves;
+        initial begin
+          $dumpfile("{top_level}.{fmt}");
+          $dumpvars(0, {dumpvars});
+        """
+    )
+    if windowed:
+        waves_sv += dedent(
+            f"""\
+              $dumpoff;
+            end
+            always @({top_level}.{WAVES_ON_REG})
+              if ({top_level}.{WAVES_ON_REG}) $dumpon;
+              else $dumpoff;
+            endmodule
+            """
+        )
+    else:
+        waves_sv += "end\nendmodule\n"
+
+    waves_fp = Path(out_dir) / f"{top_level}_waves.sv"
+    with open(waves_fp, "w") as f:
+        f.write(waves_sv)
+    return waves_fp
@@ -0,0 +1,100 @@
+import argparse
+import glob
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from openhls.config import WIDTH_EXPONENT, WIDTH_FRACTION
+from openhls.ir.parse import parse_mlir_module
+from openhls.rtl.emit_verilog import emit_verilog
+
+
+def emit(fp, out_dir, in_memory):
+    with open(fp) as f:
+        (
+            op_id_data,
+            func_args,
+            returns,
+            _output_map,
+            return_time,
+            vals,
+            csts,
+            pe_idxs,
+        ) = parse_mlir_module(f)
+    parsed_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    module_fp = os.path.join(out_dir, "module.sv")
+    blackbox_fp = os.path.join(out_dir, "module_blackbox.sv")
+    args = (
+        "module",
+        WIDTH_EXPONENT,
+        WIDTH_FRACTION,
+        op_id_data,
+        func_args,
+        returns,
+        return_time,
+        vals,
+        csts,
+        pe_idxs,
+    )
+    if in_memory:
+        # roughly what compile used to do: the whole module in a StringIO, read back and written
+        module_s, blackbox_s = io.StringIO(), io.StringIO()
+        emit_verilog(*args, module_s, blackbox_s)
+        module = module_s.getvalue()
+        with open(module_fp, "w") as f:
+            f.write(module)
+        with open(blackbox_fp, "w") as f:
+            f.write(blackbox_s.getvalue())
+    else:
+        with open(module_fp, "w") as module_f, open(blackbox_fp, "w") as blackbox_f:
+            emit_verilog(*args, module_f, blackbox_f)
+    secs = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{'in memory' if in_memory else 'streaming'}: {secs:.3f}s, "
+        f"peak RSS {peak_rss / 1024:.1f}MB ({(peak_rss - parsed_rss) / 1024:.1f}MB over parsing), "
+        f"{os.path.getsize(module_fp) / 2**20:.1f}MB of verilog"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser("Verilog emitter peak RSS")
+    parser.add_argument(
+        "fp",
+        nargs="?",
+        help="Scheduled module (defaults to the largest of the examples' *.rewritten.sched.mlir)",
+    )
+    parser.add_argument("--in_memory", default=False, action="store_true")
+    parser.add_argument("--child", default=False, action="store_true")
+    args = parser.parse_args()
+
+    fp = args.fp
+    if fp is None:
+        fps = glob.glob("examples/**/*.rewritten.sched.mlir", recursive=True)
+        if not fps:
+            parser.error("no scheduled modules found; run the compiler with -s first")
+        fp = max(fps, key=os.path.getsize)
+
+    if args.child:
+        with tempfile.TemporaryDirectory() as out_dir:
+            emit(fp, out_dir, args.in_memory)
+        return
+
+    # peak RSS is per process so each emitter gets its own
+    print(f"{fp} ({os.path.getsize(fp) / 2**20:.1f}MB)")
+    for in_memory in [True, False]:
+        subprocess.run(
+            [sys.executable, __file__, fp, "--child"]
+            + (["--in_memory"] if in_memory else []),
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from openhls.compiler.runner import (
+    get_default_args,
+    get_py_module_args_globals,
+    run_model_with_fp_number,
+)
+from openhls.config import WIDTH_EXPONENT, WIDTH_FRACTION
+from openhls.ir.evaluate import Evaluator, module_inputs
+from openhls.ir.parse import parse_mlir_module
+from openhls.util import import_module_from_fp
+
+
+def bench(fp, n_test_vectors, width_exponent, width_fraction):
+    # the golden model picks the flopoco fmacs when it's run by the testbench
+    os.environ.setdefault("TB_RANDOM", "1")
+    mod = import_module_from_fp("test_module", fp)
+    input_memrefs, *_ = get_py_module_args_globals(get_default_args(mod.forward))
+    np.random.seed(0)
+    test_inputs = {
+        name: np.random.randn(n_test_vectors, *memref.shape)
+        for name, memref in input_memrefs.items()
+    }
+
+    start = time.perf_counter()
+    _, outputs = run_model_with_fp_number(
+        mod, test_inputs, width_exponent, width_fraction
+    )
+    golden_secs = time.perf_counter() - start
+
+    with open(fp.replace("_rewritten.py", ".rewritten.mlir")) as f:
+        op_id_data, func_args, returns, output_map, _, _, csts, _ = parse_mlir_module(f)
+    start = time.perf_counter()
+    evaluator = Evaluator(op_id_data, func_args, returns, csts)
+    results = evaluator.run(
+        module_inputs(mod, test_inputs), width_exponent, width_fraction
+    )
+    eval_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    evaluator.run(module_inputs(mod, test_inputs))
+    f32_secs = time.perf_counter() - start
+
+    n_wrong = 0
+    for v, (arr_name, idx) in output_map.items():
+        expected = outputs[arr_name].registers[idx].fp.canonical_bits()
+        n_wrong += int(np.sum(expected != results[v].canonical_bits()))
+    print(
+        f"{fp}: {len(op_id_data)} ops, {evaluator.n_levels} levels, {n_test_vectors} vectors; "
+        f"golden model {golden_secs:.3f}s, evaluator {eval_secs:.3f}s "
+        f"({golden_secs / eval_secs:.1f}x), float32 {f32_secs:.3f}s; "
+        f"{n_wrong}/{len(output_map) * n_test_vectors} outputs differ"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser("Golden model vs op graph evaluator")
+    parser.add_argument(
+        "fps",
+        nargs="*",
+        help="Rewritten modules (defaults to the examples' *_rewritten.py), next to their .rewritten.mlir",
+    )
+    parser.add_argument("-n", "--n_test_vectors", type=int, default=100)
+    args = parser.parse_args()
+
+    fps = args.fps or sorted(glob.glob("examples/**/*_rewritten.py", recursive=True))
+    fps = [
+        fp for fp in fps if os.path.exists(fp.replace("_rewritten.py", ".rewritten.mlir"))
+    ]
+    if not fps:
+        parser.error("no rewritten modules found; run the compiler with -t -r first")
+    for fp in fps:
+        bench(fp, args.n_test_vectors, WIDTH_EXPONENT, WIDTH_FRACTION)
+
+
+if __name__ == "__main__":
+    main()
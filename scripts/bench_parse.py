@@ -0,0 +1,39 @@
+import argparse
+import glob
+import time
+
+from openhls.ir.parse import parse_mlir_module
+
+
+def bench(fp, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with open(fp) as f:
+            op_id_data, *_ = parse_mlir_module(f)
+        best = min(best, time.perf_counter() - start)
+    return len(op_id_data), best
+
+
+def main():
+    parser = argparse.ArgumentParser("Scheduled MLIR parse throughput")
+    parser.add_argument(
+        "fps",
+        nargs="*",
+        help="Scheduled modules (defaults to the examples' *.rewritten.sched.mlir)",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    fps = args.fps or sorted(
+        glob.glob("examples/**/*.rewritten.sched.mlir", recursive=True)
+    )
+    if not fps:
+        parser.error("no scheduled modules found; run the compiler with -s first")
+    for fp in fps:
+        n_ops, secs = bench(fp, args.repeats)
+        print(f"{fp}: {n_ops} ops in {secs:.3f}s ({n_ops / secs:,.0f} ops/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import importlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from openhls.compiler import state
+from openhls.compiler.runner import (
+    get_default_args,
+    get_py_module_args_globals,
+    reductions_fp,
+    run_model_with_fp_number,
+)
+from openhls.compiler.schedule import native_schedule
+from openhls.config import WIDTH_EXPONENT, WIDTH_FRACTION
+from openhls.ir import ops
+from openhls.ir.evaluate import Evaluator, module_inputs
+from openhls.ir.ops import OpType
+from openhls.ir.parse import parse_mlir_module
+from openhls.util import import_module_from_fp
+
+# a tiled dense layer: each tile's dot product is a chain (whose length depends on how many of
+# its weights are zero, since those are folded away) and the tiles' partial sums and the bias are
+# reduced, i.e., the operands of the reductions arrive at different times
+MODULE = """\
+import numpy as np
+from openhls.compiler.runner import make_output_file, parfor
+from openhls.ir.memref import MemRef, GlobalMemRef
+from openhls.ir.ops import ReduceAdd
+make_output_file(__file__)
+np.random.seed({seed})
+W = np.random.randn({n_out}, {n_in}).astype(np.float32)
+W[np.random.rand({n_out}, {n_in}) < {sparsity}] = 0
+B = np.random.randn({n_out}).astype(np.float32)
+
+
+def forward(_arg0=MemRef("_arg0", 1, {n_in}, input=True), _arg1=MemRef("_arg1", {n_out}, output=True), w=GlobalMemRef("w", W), b=GlobalMemRef("b", B)):
+    partial = MemRef("partial", {n_out}, {n_tiles})
+
+    @parfor(i=(0, {n_out}), t=(0, {n_tiles}))
+    def body(i, t):
+        acc = _arg0[0, t * {tile}] * w[i, t * {tile}]
+        for k in range(t * {tile} + 1, min((t + 1) * {tile}, {n_in})):
+            acc = acc + _arg0[0, k] * w[i, k]
+        partial[i, t] = acc
+
+    for i in range({n_out}):
+        _arg1[i] = ReduceAdd([partial[i, t] for t in range({n_tiles})] + [b[i]])
+"""
+
+
+def trace(mod_fp, reduction_tree):
+    compile_mod = importlib.import_module("openhls.compiler.compile")
+    ops.REDUCTION_TREE = reduction_tree
+    state.state = None
+    mod = import_module_from_fp("reduction_module", mod_fp)
+    mlir, _output_name, reductions = compile_mod.run_rewrite(mod)
+    # (where the compiler leaves them for the golden model)
+    with open(reductions_fp(mod_fp), "w") as f:
+        json.dump(reductions, f)
+    sched_mlir = native_schedule(mlir, mode="list", state=state.state)
+    op_id_data, func_args, returns, output_map, return_time, _, csts, _ = (
+        parse_mlir_module(sched_mlir)
+    )
+    n_copies = sum(op.type == OpType.COPY for op in op_id_data.values())
+    return return_time, n_copies, Evaluator(op_id_data, func_args, returns, csts), output_map
+
+
+def check_golden(mod_fp, evaluator, output_map, n_test_vectors):
+    # the golden model (which replays the traced trees) against the traced ops
+    state.state = None
+    mod = import_module_from_fp("reduction_module", mod_fp)
+    input_memrefs, *_ = get_py_module_args_globals(get_default_args(mod.forward))
+    np.random.seed(0)
+    test_inputs = {
+        name: np.random.randn(n_test_vectors, *memref.shape)
+        for name, memref in input_memrefs.items()
+    }
+    _, outputs = run_model_with_fp_number(
+        mod, test_inputs, WIDTH_EXPONENT, WIDTH_FRACTION
+    )
+    results = evaluator.run(
+        module_inputs(mod, test_inputs), WIDTH_EXPONENT, WIDTH_FRACTION
+    )
+    n_wrong = 0
+    for v, (arr_name, idx) in output_map.items():
+        expected = outputs[arr_name].registers[idx].fp.canonical_bits()
+        n_wrong += int(np.sum(expected != results[v].canonical_bits()))
+    return n_wrong, len(output_map) * n_test_vectors
+
+
+def main():
+    parser = argparse.ArgumentParser("Arrival ordered vs pairwise reduction trees")
+    parser.add_argument("--n_in", type=int, nargs="*", default=[27, 50, 144, 400])
+    parser.add_argument("--n_out", type=int, default=4)
+    parser.add_argument("--tile", type=int, default=9)
+    parser.add_argument("--sparsity", type=float, default=0.3)
+    parser.add_argument("-n", "--n_test_vectors", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_in in args.n_in:
+            n_tiles = -(-n_in // args.tile)
+            mod_fp = os.path.join(tmp_dir, f"dense_{n_in}_rewritten.py")
+            with open(mod_fp, "w") as f:
+                f.write(
+                    MODULE.format(
+                        seed=0,
+                        n_in=n_in,
+                        n_out=args.n_out,
+                        tile=args.tile,
+                        n_tiles=n_tiles,
+                        sparsity=args.sparsity,
+                    )
+                )
+            report = []
+            for reduction_tree in ["pairwise", "arrival"]:
+                return_time, n_copies, evaluator, output_map = trace(
+                    mod_fp, reduction_tree
+                )
+                n_wrong, n_outputs = check_golden(
+                    mod_fp, evaluator, output_map, args.n_test_vectors
+                )
+                report.append(
+                    f"{reduction_tree} {return_time + 1} stages, {n_copies} copies, "
+                    f"{n_wrong}/{n_outputs} outputs differ from the golden model"
+                )
+            print(f"{n_in} inputs ({n_tiles} tiles + bias): {'; '.join(report)}")
+
+
+if __name__ == "__main__":
+    main()
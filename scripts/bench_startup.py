@@ -0,0 +1,75 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_import(module, n_runs):
+    # each run is a fresh interpreter (nothing's cached in sys.modules)
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def slowest_imports(module, n_top):
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    imports = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative_us), name.strip()))
+    # the dependencies' top-level packages' cumulative times, e.g., numpy, not numpy._core
+    top_level = {}
+    for cumulative_us, name in imports:
+        pkg = name.split(".")[0]
+        if pkg == module.split(".")[0]:
+            continue
+        top_level[pkg] = max(top_level.get(pkg, 0), cumulative_us)
+    return sorted(top_level.items(), key=lambda kv: -kv[1])[:n_top]
+
+
+def main():
+    parser = argparse.ArgumentParser("OpenHLS import (startup) time")
+    parser.add_argument(
+        "modules", nargs="*", default=["openhls.compiler.compile", "openhls.config"]
+    )
+    parser.add_argument("-n", "--n_runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=8, help="Slowest packages to list")
+    parser.add_argument(
+        "--max_s",
+        type=float,
+        default=None,
+        help="Exit non-zero if the (median) import of the first module takes longer",
+    )
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_import("sys", args.n_runs))
+    print(f"interpreter startup {baseline:.3f}s")
+    medians = []
+    for module in args.modules:
+        times = time_import(module, args.n_runs)
+        median = statistics.median(times)
+        medians.append(median)
+        print(
+            f"import {module}: median {median:.3f}s, min {min(times):.3f}s "
+            f"({median - baseline:.3f}s over the interpreter)"
+        )
+        for pkg, cumulative_us in slowest_imports(module, args.top):
+            print(f"  {pkg:<24} {cumulative_us / 1e6:.3f}s")
+
+    if args.max_s is not None and medians[0] > args.max_s:
+        sys.exit(f"import {args.modules[0]} took {medians[0]:.3f}s > {args.max_s}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+from openhls.compiler import state
+from openhls.compiler.compile import run_rewrite
+from openhls.compiler.schedule import SCHEDULERS, native_schedule
+from openhls.util import import_module_from_fp
+
+# a small dense layer whose outputs are scaled, i.e., the traced module has a constant (which has
+# an op_id, and so gets a start time, but isn't a node in the op graph)
+MODULE = """\
+import numpy as np
+from openhls.compiler.runner import make_output_file, parfor
+from openhls.ir.memref import MemRef, GlobalMemRef
+make_output_file(__file__)
+np.random.seed(0)
+W = np.random.randn({n_out}, {n_in}).astype(np.float32)
+
+
+def forward(_arg0=MemRef("_arg0", 1, {n_in}, input=True), _arg1=MemRef("_arg1", {n_out}, output=True), w=GlobalMemRef("w", W)):
+
+    @parfor(i=(0, {n_out}))
+    def body(i):
+        acc = _arg0[0, 0] * w[i, 0]
+        for k in range(1, {n_in}):
+            acc = acc + _arg0[0, k] * w[i, k]
+        _arg1[i] = acc * {scale}
+"""
+
+return_time_re = re.compile(r"return .*lpStartTime = (\d+)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "Schedule a module with a constant from the traced state and from the MLIR"
+    )
+    parser.add_argument("--n_in", type=int, default=8)
+    parser.add_argument("--n_out", type=int, default=4)
+    parser.add_argument("--scale", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mod_fp = os.path.join(tmp_dir, "scaled_rewritten.py")
+        with open(mod_fp, "w") as f:
+            f.write(MODULE.format(n_in=args.n_in, n_out=args.n_out, scale=args.scale))
+        mod = import_module_from_fp("scaled_module", mod_fp)
+        mlir, _output_name, _reductions = run_rewrite(mod)
+
+    assert "arith.constant" in mlir, "the module should have a constant"
+    failed = False
+    for mode in SCHEDULERS:
+        from_state = native_schedule(mlir, mode=mode, state=state.state)
+        from_module = native_schedule(mlir, mode=mode)
+        return_time = int(return_time_re.search(from_state).group(1))
+        if from_state != from_module:
+            print(f"{mode}: the traced state's schedule differs from the MLIR's")
+            failed = True
+        else:
+            print(f"{mode}: {return_time + 1} stages")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -68,5 +68,6 @@ for freq in "${frequencies[@]}"; do
   done
 done
 
-
-
+# the pipeline depths openhls.config reads (instead of scanning the vhdl on every import);
+# re-run it after moving new cores into openhls/ip_cores/<op>/
+(cd $OPENHLS_DIR && python -m openhls.ip_cores.latencies)
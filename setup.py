@@ -325,6 +325,7 @@ setup(
             "ip_cores/*.vhdl",
             "ip_cores/*.sv",
             "ip_cores/*.xdc",
+            "ip_cores/*.json",
             "ip_cores/fadd/*.vhdl",
             "ip_cores/fadd/*.sv",
             "ip_cores/fcmplt/*.vhdl",
@@ -344,6 +345,8 @@ setup(
     entry_points={
         "console_scripts": [
             "openhls_compiler = openhls.compiler.compile:main",
+            "openhls_sweep = openhls.compiler.sweep:main",
+            "openhls_server = openhls.compiler.server:main",
         ],
     },
 )
@@ -0,0 +1,87 @@
+import io
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+from openhls.compiler import state
+from openhls.compiler.compile import run_rewrite
+from openhls.compiler.schedule import native_schedule
+from openhls.config import ADD_LATENCY, MUL_LATENCY
+from openhls.ir.ops import LATENCIES, OpType
+from openhls.ir.parse import parse_mlir_module
+from openhls.rtl.emit_verilog import op_reads
+from openhls.rtl.fsm import mac_fsm_times
+
+
+@pytest.fixture
+def trace_state():
+    # a fresh tracing state whose emitted ops go nowhere
+    state.state = state.State(io.StringIO())
+    yield state.state
+    state.state = None
+
+
+def trace(forward):
+    mlir, *_ = run_rewrite(SimpleNamespace(forward=forward))
+    traced = state.state
+    state.state = None
+    return mlir, traced
+
+
+def trace_and_schedule(forward, mode="list"):
+    mlir, *_ = run_rewrite(SimpleNamespace(forward=forward))
+    traced = state.state
+    sched_mlir = native_schedule(mlir, mode=mode, state=traced)
+    state.state = None
+    return sched_mlir, traced
+
+
+def overwritten_reads(sched_mlir):
+    # the (value, reader, fsm stage) reads of ips' results that another op on the same ip has
+    # already replaced, i.e., a value is only on its ip's result wire until the ip's next result
+    op_id_data, _, returns, _, return_time, *_ = parse_mlir_module(sched_mlir)
+    results = defaultdict(list)
+    produced = {}
+    for op in op_id_data.values():
+        if op.type in {OpType.CST, OpType.COPY} or op.pe_idx[0] < 0:
+            continue
+        start_time = op.attrs["start_time"]
+        if op.type == OpType.FMAC:
+            fmul_times, fadd_times, _ = mac_fsm_times((len(op.args) - 1) // 2, start_time)
+            ip = op.pe_idx, OpType.ADD.value
+            results[op.pe_idx, OpType.MUL.value] += [(t + MUL_LATENCY, None) for t in fmul_times]
+            results[ip] += [(t + ADD_LATENCY, None) for t in fadd_times[:-1]]
+            done = fadd_times[-1] + ADD_LATENCY
+        else:
+            ip = op.pe_idx, op.type.value
+            done = start_time + LATENCIES[op]
+        results[ip].append((done, op.res))
+        produced[op.res] = ip
+
+    reads = [
+        (v, op.res, t)
+        for op in op_id_data.values()
+        if op.type != OpType.CST
+        for v, t in op_reads(op)
+    ]
+    reads += [(v, "return", return_time + 1) for v in returns]
+    overwritten = []
+    for v, reader, t in reads:
+        if v not in produced:
+            continue
+        _done, latest = max(
+            (r for r in results[produced[v]] if r[0] <= t), key=lambda r: r[0]
+        )
+        if latest != v:
+            overwritten.append((v, reader, t))
+    return overwritten
+
+
+@pytest.fixture
+def lifetimes():
+    return SimpleNamespace(
+        trace=trace,
+        trace_and_schedule=trace_and_schedule,
+        overwritten_reads=overwritten_reads,
+    )
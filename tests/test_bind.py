@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from openhls.compiler.bind import bind
+from openhls.compiler.runner import parfor
+from openhls.compiler.schedule import native_schedule
+from openhls.ir.memref import MemRef, GlobalMemRef
+from openhls.ir.ops import OpType, ReduceAdd
+from openhls.ir.parse import parse_mlir_module
+
+W = np.arange(1, 13, dtype=np.float32).reshape(4, 3)
+
+
+def forward(
+    _arg0=MemRef("_arg0", 3, input=True),
+    _arg1=MemRef("_arg1", 4, output=True),
+    w=GlobalMemRef("w", W),
+):
+    @parfor(i=(0, 4))
+    def body(i):
+        _arg1[i] = ReduceAdd([(_arg0[k] * w[i, k] + 0.5).relu() for k in range(3)])
+
+
+@pytest.mark.parametrize(
+    "limits", [{"fadd": 1, "fmul": 1}, {"fadd": 2, "fmul": 1}, {"fadd": 3}]
+)
+def test_bound_reads_are_live(lifetimes, limits):
+    mlir, _traced = lifetimes.trace(forward)
+    bound_mlir, bound = bind(mlir, limits)
+    assert bound
+    sched_mlir = native_schedule(bound_mlir, mode="list")
+    op_id_data, *_ = parse_mlir_module(sched_mlir)
+    for op_type, limit in limits.items():
+        pes = {op.pe_idx for op in op_id_data.values() if op.type == OpType(op_type)}
+        assert len(pes) <= limit
+    assert lifetimes.overwritten_reads(sched_mlir) == []
@@ -0,0 +1,40 @@
+import numpy as np
+
+from openhls.ir.memref import MemRef, GlobalMemRef
+from openhls.ir.ops import OpType
+from openhls.ir.parse import parse_mlir_module
+
+W = np.arange(1, 9, dtype=np.float32)
+
+
+def forward(
+    _arg0=MemRef("_arg0", 8, input=True),
+    _arg1=MemRef("_arg1", 1, output=True),
+    w=GlobalMemRef("w", W),
+):
+    # t2 is t again, but by the time it's read the pe's fmul has moved on
+    t = _arg0[0] * w[0]
+    acc = t
+    for k in range(1, 8):
+        acc = acc + _arg0[k] * w[k]
+    t2 = _arg0[0] * w[0]
+    _arg1[0] = acc + t2
+
+
+def test_cse_reuses_op(lifetimes):
+    _sched_mlir, traced = lifetimes.trace_and_schedule(forward)
+    assert traced.cse_ops["fmul"] == 1
+
+
+def test_cse_reuses_copy(lifetimes):
+    mlir, _traced = lifetimes.trace(forward)
+    op_id_data, _, (ret,), *_ = parse_mlir_module(mlir)
+    ops = {op.res: op for op in op_id_data.values()}
+    reused = ops[ops[ret].args[1]]
+    assert reused.type == OpType.COPY
+    assert ops[reused.args[0]].args == ("%_arg0_0", "%w_0")
+
+
+def test_cse_reads_are_live(lifetimes):
+    sched_mlir, _traced = lifetimes.trace_and_schedule(forward)
+    assert lifetimes.overwritten_reads(sched_mlir) == []
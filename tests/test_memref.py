@@ -0,0 +1,21 @@
+import numpy as np
+
+from openhls.ir.memref import MemRef, GlobalMemRef
+
+
+def test_input_int_index(trace_state):
+    a = MemRef("a", 4, input=True)
+    assert str(a[2]) == "%a_2"
+    assert a[2] is a[(2,)]
+    assert str(a[-1]) == "%a_3"
+
+
+def test_input_tuple_index(trace_state):
+    a = MemRef("a", 2, 3, input=True)
+    assert str(a[1, 2]) == "%a_1_2"
+    assert str(a[0][1]) == "%a_0_1"
+
+
+def test_global_int_index(trace_state):
+    w = GlobalMemRef("w", np.arange(1, 4, dtype=np.float32))
+    assert str(w[1]) == "%w_1"
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from openhls.ir.memref import MemRef, GlobalMemRef
+from openhls.ir.ops import ReduceAdd
+
+W = np.arange(1, 4, dtype=np.float32)
+
+
+def forward(
+    _arg0=MemRef("_arg0", 3, input=True),
+    _arg1=MemRef("_arg1", 1, output=True),
+    w=GlobalMemRef("w", W),
+):
+    # the list scheduler interleaves the relus and the (taller) fmuls and fadds after them, so
+    # the relus' args are overwritten on their ips before they're read
+    _arg1[0] = ReduceAdd([(_arg0[k] * w[k] + 0.5).relu() for k in range(3)])
+
+
+@pytest.mark.parametrize("mode", ["list", "exact"])
+def test_reads_are_live(lifetimes, mode):
+    sched_mlir, _traced = lifetimes.trace_and_schedule(forward, mode)
+    assert lifetimes.overwritten_reads(sched_mlir) == []
+
+
+def test_overwritten_results_are_copied(lifetimes):
+    sched_mlir, _traced = lifetimes.trace_and_schedule(forward)
+    assert '"copy" (' in sched_mlir
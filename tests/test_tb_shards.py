@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("cocotb")
+
+from openhls.testbench import tb_runner
+from openhls.testbench.cocotb_runner import Simulator
+
+
+class RecordingRunner:
+    # stands in for a simulator: sets up the env the way Simulator.test() does, then keeps it
+    envs = []
+
+    def test(self, toplevel, python_search, py_module, extra_env, **_kwargs):
+        self.python_search = python_search
+        self.sim_toplevel = toplevel
+        self.module = py_module
+        self.env = dict(extra_env)
+        Simulator.set_env(self)
+        RecordingRunner.envs.append(self.env)
+
+
+def test_shards_see_different_seeds(tmp_path, monkeypatch):
+    # TB_RANDOM is exported by the regression script, so it's also in os.environ
+    monkeypatch.setenv("TB_RANDOM", "7")
+    monkeypatch.setenv("LIBPYTHON_LOC", "libpython.so")
+    monkeypatch.setattr(tb_runner, "get_runner", lambda _simulator: RecordingRunner)
+    monkeypatch.setattr(tb_runner, "merge_shard_results", lambda *_args: None)
+    RecordingRunner.envs = []
+
+    tb_runner.run_shards(
+        "icarus", tmp_path, "forward", {"TB_RANDOM": "7"}, 12, 3, None, [], False
+    )
+
+    assert sorted(env["TB_RANDOM"] for env in RecordingRunner.envs) == ["7", "8", "9"]
+    assert sorted(env["N_TEST_VECTORS"] for env in RecordingRunner.envs) == ["4"] * 3